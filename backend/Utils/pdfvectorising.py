@@ -1,35 +1,232 @@
+import hashlib
+import json
 import os
+import re
 import sys
+import threading
 
 # --- PATH SETUP TO FIND MODULES ---
 # This ensures we can find the 'backend' folder even from inside Utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import chromadb
 from langchain_chroma import Chroma
 # NEW: Must use FastEmbed to match ingest.py
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 
+from services.embedding_cache import CachedQueryEmbeddings
+
 # --- CONFIGURATION ---
 # This points to backend/chroma_db
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chroma_db")
+EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+# Collection every dataset shared before per-project collections (langchain_chroma's default)
+LEGACY_COLLECTION = "langchain"
+REGISTRY_PATH = os.path.join(DB_PATH, "dataset_collections.json")
+
+# --- LAZY SHARED INSTANCES ---
+# Nothing is loaded at import time. The lifespan warm-up (services/warmup.py)
+# builds these in parallel at startup; any caller that gets here first simply
+# pays the load itself. Separate locks let the embedding model and the Chroma
+# client load at the same time.
+_embeddings: CachedQueryEmbeddings | None = None
+_client = None
+_vectorstore: Chroma | None = None
+_embeddings_lock = threading.Lock()
+_client_lock = threading.Lock()
+_vectorstore_lock = threading.Lock()
+
+
+def get_embeddings() -> CachedQueryEmbeddings:
+    """Shared query-side embeddings, with an LRU of query text → vector in front."""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                # NEW: Initialize with the EXACT same model as ingest.py
+                _embeddings = CachedQueryEmbeddings(FastEmbedEmbeddings(model_name=EMBEDDING_MODEL))
+    return _embeddings
+
+
+def query_cache_stats() -> dict | None:
+    """Query-embedding cache counters (None until the model has been loaded)."""
+    return _embeddings.stats() if _embeddings is not None else None
+
+
+def get_chroma_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not os.path.exists(DB_PATH):
+                    print(f"⚠️ Warning: Database folder not found at {DB_PATH}")
+                    os.makedirs(DB_PATH)
+                print(f"🔌 Connecting to DB at: {DB_PATH}")
+                _client = chromadb.PersistentClient(path=DB_PATH)
+    return _client
+
+
+def get_vectorstore() -> Chroma:
+    """The legacy shared collection. Only the migration still reads it —
+    datasets live in their own collections (get_project_vectorstore)."""
+    global _vectorstore
+    if _vectorstore is None:
+        with _vectorstore_lock:
+            if _vectorstore is None:
+                _vectorstore = Chroma(
+                    client=get_chroma_client(),
+                    collection_name=LEGACY_COLLECTION,
+                    embedding_function=get_embeddings()
+                )
+                print("✅ Vector store ready with FastEmbed.")
+    return _vectorstore
+
+
+# ============================================================================
+#   PER-PROJECT COLLECTIONS
+# ============================================================================
+# One Chroma collection per dataset: a query searches only that project's
+# HNSW index (no shared index + metadata post-filter), nothing depends on the
+# absolute install path, and deleting a dataset is a collection drop.
+
+def collection_name(filename: str) -> str:
+    """Chroma-safe, stable collection name for a dataset filename.
+
+    Chroma names allow [a-zA-Z0-9._-], 3-63 chars, alphanumeric at both ends;
+    the short hash keeps names that sanitize alike ("a b.pdf" / "a_b.pdf") apart.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    slug = re.sub(r"[^a-zA-Z0-9_-]+", "_", stem).strip("_-")[:40] or "dataset"
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:8]
+    return f"ds_{slug}_{digest}"
+
+
+class CollectionRegistry:
+    """{dataset filename: collection name}, persisted next to chroma_db so
+    fan-out search, warm-up and the migration know which collections exist."""
+
+    def __init__(self, path: str = REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, str] | None = None
+
+    def _load(self) -> dict[str, str]:
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def register(self, filename: str) -> str:
+        with self._lock:
+            entries = self._load()
+            if filename not in entries:
+                entries[filename] = collection_name(filename)
+                self._save()
+            return entries[filename]
+
+    def unregister(self, filename: str) -> str | None:
+        with self._lock:
+            name = self._load().pop(filename, None)
+            if name is not None:
+                self._save()
+            return name
+
+    def datasets(self) -> dict[str, str]:
+        with self._lock:
+            return dict(self._load())
+
+
+registry = CollectionRegistry()
+_project_stores: dict[str, Chroma] = {}
+_project_lock = threading.Lock()
+
+
+def get_project_vectorstore(filename: str) -> Chroma:
+    """The vector store of one dataset (created and registered on first use)."""
+    store = _project_stores.get(filename)
+    if store is None:
+        with _project_lock:
+            store = _project_stores.get(filename)
+            if store is None:
+                store = Chroma(
+                    client=get_chroma_client(),
+                    collection_name=registry.register(filename),
+                    embedding_function=get_embeddings(),
+                )
+                _project_stores[filename] = store
+    return store
+
+
+def drop_project_collection(filename: str) -> bool:
+    """Delete a dataset's vectors by dropping its whole collection."""
+    with _project_lock:
+        _project_stores.pop(filename, None)
+        name = registry.unregister(filename) or collection_name(filename)
+    try:
+        get_chroma_client().delete_collection(name)
+        return True
+    except Exception as e:   # already gone / never ingested
+        print(f"⚠️ Could not drop collection {name} for {filename}: {e}")
+        return False
+
+
+# ============================================================================
+#   MIGRATION FROM THE SHARED COLLECTION
+# ============================================================================
+
+MIGRATION_BATCH = 1000
+
+
+def migrate_legacy_collection() -> dict:
+    """Move every vector of the old shared collection into its dataset's own
+    collection (IDs, embeddings, documents and metadata copied as-is — no
+    re-embedding), then drop the shared collection. Safe to re-run."""
+    client = get_chroma_client()
+    try:
+        legacy = client.get_collection(LEGACY_COLLECTION)
+    except Exception:
+        return {"migrated": 0, "datasets": {}}
 
-if not os.path.exists(DB_PATH):
-    print(f"⚠️ Warning: Database folder not found at {DB_PATH}")
-    os.makedirs(DB_PATH)
+    moved: dict[str, int] = {}
+    while True:
+        batch = legacy.get(limit=MIGRATION_BATCH, include=["embeddings", "documents", "metadatas"])
+        if not batch["ids"]:
+            break
 
-print(f"🔌 Connecting to DB at: {DB_PATH}")
+        by_dataset: dict[str, list[int]] = {}
+        for i, metadata in enumerate(batch["metadatas"]):
+            # "source" was the absolute Dataset/ path at ingest time
+            source = (metadata or {}).get("source") or "unknown"
+            by_dataset.setdefault(os.path.basename(source), []).append(i)
 
-# NEW: Initialize with the EXACT same model as ingest.py
-embeddings = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")
+        for filename, rows in by_dataset.items():
+            get_project_vectorstore(filename)._collection.upsert(
+                ids=[batch["ids"][i] for i in rows],
+                embeddings=[batch["embeddings"][i] for i in rows],
+                documents=[batch["documents"][i] for i in rows],
+                metadatas=[batch["metadatas"][i] for i in rows],
+            )
+            moved[filename] = moved.get(filename, 0) + len(rows)
+        legacy.delete(ids=batch["ids"])
 
-vectorstore = Chroma(
-    persist_directory=DB_PATH,
-    embedding_function=embeddings
-)
+    client.delete_collection(LEGACY_COLLECTION)
+    global _vectorstore
+    _vectorstore = None
+    total = sum(moved.values())
+    print(f"📦 Migrated {total} vectors into {len(moved)} per-project collections")
+    return {"migrated": total, "datasets": moved}
 
-retriever = vectorstore.as_retriever(
-    search_type="similarity",
-    search_kwargs={"k": 8} # Fetch top 8 relevant chunks
-)
 
-print("✅ Retriever Ready with FastEmbed.")
\ No newline at end of file
+if __name__ == "__main__":
+    # python Utils/pdfvectorising.py — one-off migration of an existing chroma_db
+    print(migrate_legacy_collection())
@@ -1,15 +1,30 @@
 """
 analytics.py — Lightweight SQLite-backed analytics for Lumira.
 Tracks visitor sessions, messages, and provides aggregate stats.
+
+Writes are batched: start_session / heartbeat_session / log_message only put
+an event on an in-memory queue. One writer thread drains it and commits a
+batch every ANALYTICS_FLUSH_MS or ANALYTICS_BATCH_SIZE events with
+executemany, so a busy expo costs one WAL commit per batch instead of one
+fsync per chat message, and chat requests never wait on SQLite. When the
+queue is full, events are dropped and counted rather than blocking.
 """
 
+import queue
 import sqlite3
 import os
 import threading
-from datetime import datetime
+import time
+import uuid
+from datetime import datetime, timezone
 
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analytics.db")
 
+# --- WRITE BATCHING (override via .env) ---
+ANALYTICS_FLUSH_MS = int(os.getenv("ANALYTICS_FLUSH_MS", "250"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "500"))
+ANALYTICS_QUEUE_MAX = int(os.getenv("ANALYTICS_QUEUE_MAX", "10000"))
+
 _local = threading.local()
 
 
@@ -23,14 +38,16 @@ def _get_conn() -> sqlite3.Connection:
 
 
 def init_db():
-    """Create tables if they don't exist."""
+    """Create tables if they don't exist, and migrate older analytics.db files."""
     conn = _get_conn()
     conn.executescript("""
         CREATE TABLE IF NOT EXISTS sessions (
             id TEXT PRIMARY KEY,
             project TEXT NOT NULL,
             started_at TEXT NOT NULL,
-            last_active TEXT NOT NULL
+            last_active TEXT NOT NULL,
+            started_ts INTEGER,          -- unix epoch seconds (UTC)
+            last_active_ts INTEGER
         );
 
         CREATE TABLE IF NOT EXISTS messages (
@@ -38,85 +55,421 @@ def init_db():
             session_id TEXT,
             project TEXT NOT NULL,
             role TEXT NOT NULL,
-            timestamp TEXT NOT NULL
+            timestamp TEXT NOT NULL,
+            ts INTEGER                   -- unix epoch seconds (UTC)
+        );
+
+        CREATE TABLE IF NOT EXISTS qr_events (
+            id TEXT PRIMARY KEY,
+            project TEXT NOT NULL,
+            started_ts INTEGER NOT NULL,
+            ended_ts INTEGER             -- NULL while the QR is still active
         );
 
         CREATE INDEX IF NOT EXISTS idx_sessions_project ON sessions(project);
         CREATE INDEX IF NOT EXISTS idx_messages_project ON messages(project);
         CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id);
-        CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_qr_events_project ON qr_events(project, started_ts);
+    """)
+    _migrate_epoch_columns(conn)
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_project_ts ON sessions(project, started_ts);
+        CREATE INDEX IF NOT EXISTS idx_sessions_ts ON sessions(started_ts);
+        CREATE INDEX IF NOT EXISTS idx_messages_project_ts ON messages(project, ts);
+        CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(ts);
+        DROP INDEX IF EXISTS idx_messages_timestamp;
     """)
+    conn.executescript(_ROLLUP_SCHEMA)
     conn.commit()
 
+    # Databases from before the rollup tables: build them once from raw rows
+    row = conn.execute("SELECT value FROM analytics_meta WHERE key = 'rollups_version'").fetchone()
+    if row is None or row["value"] != ROLLUPS_VERSION:
+        rebuild_rollups(conn)
+
+
+def _migrate_epoch_columns(conn: sqlite3.Connection):
+    """Older databases only have ISO-string timestamps: add the integer epoch
+    columns and backfill them (one-off, on the first start after upgrading)."""
+    added = False
+    for table, columns in (("sessions", ("started_ts", "last_active_ts")), ("messages", ("ts",))):
+        existing = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+        for column in columns:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER")
+                added = True
+    if added:
+        print("🛠️ Migrating analytics.db timestamps to epoch columns...")
+    with conn:
+        conn.execute("""
+            UPDATE sessions SET
+                started_ts = CAST(strftime('%s', started_at) AS INTEGER),
+                last_active_ts = CAST(strftime('%s', last_active) AS INTEGER)
+            WHERE started_ts IS NULL OR last_active_ts IS NULL
+        """)
+        conn.execute("""
+            UPDATE messages SET ts = CAST(strftime('%s', timestamp) AS INTEGER)
+            WHERE ts IS NULL
+        """)
+
+
+# ---------- ROLLUPS ----------
+# Counters maintained by triggers on every insert / heartbeat, so the
+# dashboard reads O(projects) rows instead of scanning every message.
+
+ROLLUPS_VERSION = "1"
+
+_ROLLUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analytics_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS project_stats (
+        project TEXT PRIMARY KEY,
+        visitors INTEGER NOT NULL DEFAULT 0,
+        messages INTEGER NOT NULL DEFAULT 0,
+        duration_sum_sec REAL NOT NULL DEFAULT 0,   -- over sessions with last_active_ts != started_ts
+        duration_sessions INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS hourly_stats (
+        project TEXT NOT NULL,
+        hour INTEGER NOT NULL,                      -- hour of day, 0-23 (UTC)
+        messages INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (project, hour)
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_insert AFTER INSERT ON sessions
+    BEGIN
+        INSERT INTO project_stats (project, visitors) VALUES (NEW.project, 1)
+        ON CONFLICT(project) DO UPDATE SET visitors = visitors + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_heartbeat AFTER UPDATE OF last_active_ts ON sessions
+    BEGIN
+        UPDATE project_stats SET
+            duration_sum_sec = duration_sum_sec
+                + (NEW.last_active_ts != NEW.started_ts) * (NEW.last_active_ts - NEW.started_ts)
+                - (OLD.last_active_ts != OLD.started_ts) * (OLD.last_active_ts - OLD.started_ts),
+            duration_sessions = duration_sessions
+                + (NEW.last_active_ts != NEW.started_ts) - (OLD.last_active_ts != OLD.started_ts)
+        WHERE project = NEW.project;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_messages_rollup_insert AFTER INSERT ON messages
+    BEGIN
+        INSERT INTO project_stats (project, messages) VALUES (NEW.project, 1)
+        ON CONFLICT(project) DO UPDATE SET messages = messages + 1;
+        INSERT INTO hourly_stats (project, hour, messages)
+        VALUES (NEW.project, (NEW.ts / 3600) % 24, 1)
+        ON CONFLICT(project, hour) DO UPDATE SET messages = messages + 1;
+    END;
+"""
+
+
+def rebuild_rollups(conn: sqlite3.Connection | None = None):
+    """Recompute every rollup from the raw sessions / messages rows."""
+    conn = conn or _get_conn()
+    with conn:
+        conn.execute("DELETE FROM project_stats")
+        conn.execute("DELETE FROM hourly_stats")
+        conn.execute("""
+            INSERT INTO project_stats (project, visitors, duration_sum_sec, duration_sessions)
+            SELECT project,
+                   COUNT(*),
+                   COALESCE(SUM(CASE WHEN last_active_ts != started_ts
+                                     THEN last_active_ts - started_ts END), 0),
+                   SUM(last_active_ts != started_ts)
+            FROM sessions
+            GROUP BY project
+        """)
+        conn.execute("""
+            INSERT INTO project_stats (project, messages)
+            SELECT project, COUNT(*) FROM messages WHERE true GROUP BY project
+            ON CONFLICT(project) DO UPDATE SET messages = excluded.messages
+        """)
+        conn.execute("""
+            INSERT INTO hourly_stats (project, hour, messages)
+            SELECT project, (ts / 3600) % 24, COUNT(*)
+            FROM messages
+            GROUP BY 1, 2
+        """)
+        conn.execute(
+            "INSERT OR REPLACE INTO analytics_meta (key, value) VALUES ('rollups_version', ?)",
+            (ROLLUPS_VERSION,),
+        )
+
+
+# ---------- BATCHED WRITER ----------
+
+_events: queue.Queue = queue.Queue(maxsize=ANALYTICS_QUEUE_MAX)
+_writer: threading.Thread | None = None
+_writer_lock = threading.Lock()
+_FLUSH = object()      # sentinel: commit now and signal the attached Event
+_STOP = object()
+
+_writer_stats = {"written": 0, "batches": 0, "dropped": 0, "failed": 0, "last_batch": 0}
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is None or not _writer.is_alive():
+                _writer = threading.Thread(target=_writer_loop, name="analytics-writer", daemon=True)
+                _writer.start()
+
+
+def _enqueue(kind: str, params: tuple):
+    _ensure_writer()
+    try:
+        _events.put_nowait((kind, params))
+    except queue.Full:
+        # Never block a request on analytics
+        with _writer_lock:
+            _writer_stats["dropped"] += 1
+
+
+def _write_batch(conn: sqlite3.Connection, batch: list[tuple]):
+    starts = [params for kind, params in batch if kind == "session_start"]
+    messages = [params for kind, params in batch if kind == "message"]
+    # Only the latest heartbeat per session matters
+    heartbeats = {}
+    for kind, params in batch:
+        if kind == "heartbeat":
+            heartbeats[params[2]] = params
+
+    with conn:
+        if starts:
+            conn.executemany(
+                "INSERT OR IGNORE INTO sessions (id, project, started_at, last_active, started_ts, last_active_ts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                starts,
+            )
+        if heartbeats:
+            conn.executemany(
+                "UPDATE sessions SET last_active = ?, last_active_ts = ? WHERE id = ?",
+                list(heartbeats.values()),
+            )
+        if messages:
+            conn.executemany(
+                "INSERT INTO messages (session_id, project, role, timestamp, ts) VALUES (?, ?, ?, ?, ?)",
+                messages,
+            )
+
+
+def _writer_loop():
+    conn = _get_conn()
+    # WAL + NORMAL: commits no longer fsync; the WAL is synced at checkpoints
+    conn.execute("PRAGMA synchronous=NORMAL")
+    flush_sec = ANALYTICS_FLUSH_MS / 1000
+    while True:
+        batch, waiters, stop = [], [], False
+        deadline = None
+        while len(batch) < ANALYTICS_BATCH_SIZE:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = _events.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            if isinstance(item, tuple) and item[0] is _FLUSH:
+                waiters.append(item[1])
+                break
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + flush_sec
+
+        if batch:
+            try:
+                _write_batch(conn, batch)
+                _writer_stats["written"] += len(batch)
+                _writer_stats["batches"] += 1
+                _writer_stats["last_batch"] = len(batch)
+            except sqlite3.Error as e:
+                _writer_stats["failed"] += len(batch)
+                print(f"❌ Analytics batch of {len(batch)} failed: {e}")
+        for waiter in waiters:
+            waiter.set()
+        if stop:
+            return
+
+
+def flush(timeout: float = 5.0) -> bool:
+    """Commit everything queued so far. True once it is on disk."""
+    if _writer is None or not _writer.is_alive():
+        return _events.empty()
+    done = threading.Event()
+    _events.put((_FLUSH, done))
+    return done.wait(timeout)
+
+
+def shutdown_writer(timeout: float = 5.0):
+    """Flush pending events and stop the writer (FastAPI shutdown)."""
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        return
+    _events.put(_STOP)
+    _writer.join(timeout)
+    _writer = None
+
+
+def writer_stats() -> dict:
+    return {**_writer_stats, "queued": _events.qsize(), "queue_max": ANALYTICS_QUEUE_MAX}
+
 
 # ---------- SESSION TRACKING ----------
 
+def _now() -> tuple[str, int]:
+    """(ISO string, epoch seconds) for the same instant."""
+    now = datetime.now(timezone.utc)
+    return now.replace(tzinfo=None).isoformat(), int(now.timestamp())
+
+
 def start_session(session_id: str, project: str):
     """Record a new visitor session."""
-    now = datetime.utcnow().isoformat()
-    conn = _get_conn()
-    conn.execute(
-        "INSERT OR IGNORE INTO sessions (id, project, started_at, last_active) VALUES (?, ?, ?, ?)",
-        (session_id, project, now, now)
-    )
-    conn.commit()
+    now, ts = _now()
+    _enqueue("session_start", (session_id, project, now, now, ts, ts))
 
 
 def heartbeat_session(session_id: str):
     """Update the last_active timestamp for a session."""
-    now = datetime.utcnow().isoformat()
-    conn = _get_conn()
-    conn.execute(
-        "UPDATE sessions SET last_active = ? WHERE id = ?",
-        (now, session_id)
-    )
-    conn.commit()
+    now, ts = _now()
+    _enqueue("heartbeat", (now, ts, session_id))
 
 
 # ---------- MESSAGE LOGGING ----------
 
 def log_message(session_id: str | None, project: str, role: str):
     """Record a single message event (user or ai)."""
-    now = datetime.utcnow().isoformat()
-    conn = _get_conn()
-    conn.execute(
-        "INSERT INTO messages (session_id, project, role, timestamp) VALUES (?, ?, ?, ?)",
-        (session_id, project, role, now)
-    )
-    conn.commit()
+    now, ts = _now()
+    _enqueue("message", (session_id, project, role, now, ts))
 
 
-# ---------- ANALYTICS QUERIES ----------
+# ---------- QR EVENT CYCLES ----------
+# An "event" is one QR activation window: it opens when the exhibitor
+# toggles the QR active and closes when it is toggled off or destroyed.
+# Analytics can be scoped to one event instead of all of history.
 
-def get_project_analytics(project: str) -> dict:
-    """Get analytics for a single project."""
+def open_event(project: str) -> str:
+    """Start a new event cycle for a project (closing any that is still open)."""
+    _, ts = _now()
+    event_id = uuid.uuid4().hex[:12]
+    conn = _get_conn()
+    with conn:
+        conn.execute(
+            "UPDATE qr_events SET ended_ts = ? WHERE project = ? AND ended_ts IS NULL", (ts, project)
+        )
+        conn.execute(
+            "INSERT INTO qr_events (id, project, started_ts) VALUES (?, ?, ?)", (event_id, project, ts)
+        )
+    return event_id
+
+
+def close_event(project: str):
+    _, ts = _now()
     conn = _get_conn()
+    with conn:
+        conn.execute(
+            "UPDATE qr_events SET ended_ts = ? WHERE project = ? AND ended_ts IS NULL", (ts, project)
+        )
+
+
+def list_events(project: str) -> list[dict]:
+    rows = _get_conn().execute(
+        "SELECT id, started_ts, ended_ts FROM qr_events WHERE project = ? ORDER BY started_ts DESC",
+        (project,),
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def parse_time(value: str | None) -> int | None:
+    """since/until query values: epoch seconds, an ISO-8601 datetime (UTC when
+    no offset is given), or "today" for the start of the current UTC day —
+    the same day boundaries as the hourly rollups and peak hours."""
+    if value is None or value == "":
+        return None
+    value = value.strip()
+    if value.lower() == "today":
+        midnight = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        return int(midnight.timestamp())
+    if value.lstrip("-").isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def _time_window(conn: sqlite3.Connection, since: int | None, until: int | None,
+                 event_id: str | None) -> tuple[str | None, int, int]:
+    """Resolve filters to (event project or None, since, until) — half-open [since, until)."""
+    project = None
+    since = since if since is not None else 0
+    until = until if until is not None else 2 ** 62
+    if event_id:
+        event = conn.execute("SELECT * FROM qr_events WHERE id = ?", (event_id,)).fetchone()
+        if event is None:
+            raise KeyError(event_id)
+        project = event["project"]
+        since = max(since, event["started_ts"])
+        if event["ended_ts"] is not None:
+            until = min(until, event["ended_ts"] + 1)
+    return project, since, until
 
-    # Visitor count
-    row = conn.execute(
-        "SELECT COUNT(*) as cnt FROM sessions WHERE project = ?", (project,)
-    ).fetchone()
-    total_visitors = row["cnt"] if row else 0
 
-    # Message counts
-    row = conn.execute(
-        "SELECT COUNT(*) as cnt FROM messages WHERE project = ?", (project,)
-    ).fetchone()
-    total_messages = row["cnt"] if row else 0
+# ---------- ANALYTICS QUERIES ----------
+# All reads come from the rollup tables — a handful of O(projects) queries
+# however many messages a season of events has accumulated.
+#
+# Session durations are measured on the whole-second epoch columns: a
+# session counts towards the average once last_active_ts != started_ts,
+# and its duration is truncated to whole seconds. (The ISO text columns
+# used before compared with microsecond precision, so sub-second sessions
+# used to count, with their fractional durations.)
+
+def _avg_duration(duration_sum_sec: float, duration_sessions: int) -> int:
+    return round(duration_sum_sec / duration_sessions) if duration_sessions else 0
+
+
+def get_project_analytics(project: str, since: int | None = None, until: int | None = None,
+                          event_id: str | None = None) -> dict:
+    """Get analytics for a single project, optionally scoped to [since, until)
+    (epoch seconds) and/or one QR event cycle.
+
+    avg_session_duration_sec averages over sessions that lasted at least one
+    whole second (see the note above)."""
+    conn = _get_conn()
+    if since is None and until is None and not event_id:
+        row = conn.execute("SELECT * FROM project_stats WHERE project = ?", (project,)).fetchone()
+        total_visitors = row["visitors"] if row else 0
+        total_messages = row["messages"] if row else 0
+        duration_sum = row["duration_sum_sec"] if row else 0
+        duration_sessions = row["duration_sessions"] if row else 0
+    else:
+        _, since, until = _time_window(conn, since, until, event_id)
+        # Index range scans on (project, started_ts) / (project, ts)
+        row = conn.execute("""
+            SELECT COUNT(*) AS visitors,
+                   COALESCE(SUM(CASE WHEN last_active_ts != started_ts THEN last_active_ts - started_ts END), 0) AS dur,
+                   COALESCE(SUM(last_active_ts != started_ts), 0) AS dur_sessions
+            FROM sessions
+            WHERE project = ? AND started_ts >= ? AND started_ts < ?
+        """, (project, since, until)).fetchone()
+        total_visitors, duration_sum, duration_sessions = row["visitors"], row["dur"], row["dur_sessions"]
+        total_messages = conn.execute(
+            "SELECT COUNT(*) AS cnt FROM messages WHERE project = ? AND ts >= ? AND ts < ?",
+            (project, since, until),
+        ).fetchone()["cnt"]
 
     # Avg messages per session
     avg_messages = round(total_messages / total_visitors, 1) if total_visitors > 0 else 0
 
     # Avg session duration (seconds)
-    row = conn.execute("""
-        SELECT AVG(
-            (julianday(last_active) - julianday(started_at)) * 86400
-        ) as avg_dur
-        FROM sessions
-        WHERE project = ?
-          AND last_active != started_at
-    """, (project,)).fetchone()
-    avg_duration = round(row["avg_dur"]) if row and row["avg_dur"] else 0
+    avg_duration = _avg_duration(duration_sum, duration_sessions)
 
     return {
         "project": project,
@@ -127,72 +480,84 @@ def get_project_analytics(project: str) -> dict:
     }
 
 
-def get_all_analytics(dataset_files: list[str] | None = None) -> dict:
+def get_all_analytics(dataset_files: list[str] | None = None, since: int | None = None,
+                      until: int | None = None, event_id: str | None = None) -> dict:
     """Get aggregated analytics across all projects + per-project breakdown.
 
     Args:
         dataset_files: Optional list of all dataset filenames on disk.
                        If provided, projects with zero activity are also included.
+        since / until: Optional [since, until) window in epoch seconds.
+        event_id:      Optional QR event cycle; scopes to that project and window.
+
+    avg_session_duration_sec averages over sessions that lasted at least one
+    whole second (see the note above).
     """
     conn = _get_conn()
+    peak_hours = [0] * 24
+    projects = {}
 
-    # Overall stats
-    total_visitors = conn.execute("SELECT COUNT(*) as cnt FROM sessions").fetchone()["cnt"]
-    total_messages = conn.execute("SELECT COUNT(*) as cnt FROM messages").fetchone()["cnt"]
+    if since is None and until is None and not event_id:
+        # All of history: rollups only
+        project_rows = conn.execute("""
+            SELECT project, visitors, messages, duration_sum_sec AS dur, duration_sessions AS dur_sessions
+            FROM project_stats
+        """).fetchall()
+        hour_rows = conn.execute(
+            "SELECT hour, SUM(messages) as cnt FROM hourly_stats GROUP BY hour"
+        ).fetchall()
+    else:
+        event_project, since, until = _time_window(conn, since, until, event_id)
+        scope = "AND project = ?" if event_project else ""
+        extra = (event_project,) if event_project else ()
+        # Index range scans on started_ts / ts (all projects) or the (project, …) pairs
+        session_rows = conn.execute(f"""
+            SELECT project, COUNT(*) AS visitors,
+                   COALESCE(SUM(CASE WHEN last_active_ts != started_ts THEN last_active_ts - started_ts END), 0) AS dur,
+                   COALESCE(SUM(last_active_ts != started_ts), 0) AS dur_sessions
+            FROM sessions
+            WHERE started_ts >= ? AND started_ts < ? {scope}
+            GROUP BY project
+        """, (since, until, *extra)).fetchall()
+        message_rows = conn.execute(f"""
+            SELECT project, COUNT(*) AS cnt FROM messages
+            WHERE ts >= ? AND ts < ? {scope}
+            GROUP BY project
+        """, (since, until, *extra)).fetchall()
+        hour_rows = conn.execute(f"""
+            SELECT (ts / 3600) % 24 AS hour, COUNT(*) AS cnt FROM messages
+            WHERE ts >= ? AND ts < ? {scope}
+            GROUP BY hour
+        """, (since, until, *extra)).fetchall()
+
+        merged = {r["project"]: {**dict(r), "messages": 0} for r in session_rows}
+        for r in message_rows:
+            merged.setdefault(r["project"], {"project": r["project"], "visitors": 0, "dur": 0, "dur_sessions": 0})
+            merged[r["project"]]["messages"] = r["cnt"]
+        project_rows = list(merged.values())
+
+    # Per-project breakdown (includes projects with messages but no sessions)
+    total_visitors = total_messages = duration_sessions = 0
+    duration_sum = 0.0
+    for row in project_rows:
+        projects[row["project"]] = {
+            "visitors": row["visitors"],
+            "messages": row["messages"],
+        }
+        total_visitors += row["visitors"]
+        total_messages += row["messages"]
+        duration_sum += row["dur"]
+        duration_sessions += row["dur_sessions"]
 
     avg_messages = round(total_messages / total_visitors, 1) if total_visitors > 0 else 0
-
-    row = conn.execute("""
-        SELECT AVG(
-            (julianday(last_active) - julianday(started_at)) * 86400
-        ) as avg_dur
-        FROM sessions
-        WHERE last_active != started_at
-    """).fetchone()
-    avg_duration = round(row["avg_dur"]) if row and row["avg_dur"] else 0
+    avg_duration = _avg_duration(duration_sum, duration_sessions)
 
     # Peak hours (24 slots)
-    peak_hours = [0] * 24
-    rows = conn.execute("""
-        SELECT CAST(strftime('%H', timestamp) AS INTEGER) as hour, COUNT(*) as cnt
-        FROM messages
-        GROUP BY hour
-        ORDER BY hour
-    """).fetchall()
-    for r in rows:
+    for r in hour_rows:
         peak_hours[r["hour"]] = r["cnt"]
 
-    # Per-project breakdown
-    projects = {}
-
-    # First, populate from sessions table (projects with activity)
-    proj_rows = conn.execute("""
-        SELECT project, COUNT(*) as visitors FROM sessions GROUP BY project
-    """).fetchall()
-    for pr in proj_rows:
-        p = pr["project"]
-        msg_row = conn.execute(
-            "SELECT COUNT(*) as cnt FROM messages WHERE project = ?", (p,)
-        ).fetchone()
-        projects[p] = {
-            "visitors": pr["visitors"],
-            "messages": msg_row["cnt"] if msg_row else 0,
-        }
-
-    # Also check messages table for projects that have messages but no sessions
-    msg_proj_rows = conn.execute("""
-        SELECT project, COUNT(*) as cnt FROM messages GROUP BY project
-    """).fetchall()
-    for mr in msg_proj_rows:
-        p = mr["project"]
-        if p not in projects:
-            projects[p] = {
-                "visitors": 0,
-                "messages": mr["cnt"],
-            }
-
     # Include all dataset files (even those with zero activity)
-    if dataset_files:
+    if dataset_files and not event_id:
         for fname in dataset_files:
             if fname not in projects:
                 projects[fname] = {"visitors": 0, "messages": 0}
@@ -211,9 +576,14 @@ def get_all_analytics(dataset_files: list[str] | None = None) -> dict:
 
 def clear_all_analytics():
     """Wipe all sessions and messages — hard reset to zero."""
+    # Events still queued would otherwise land right after the wipe
+    flush()
     conn = _get_conn()
     conn.execute("DELETE FROM messages")
     conn.execute("DELETE FROM sessions")
+    conn.execute("DELETE FROM project_stats")
+    conn.execute("DELETE FROM hourly_stats")
+    conn.execute("DELETE FROM qr_events WHERE ended_ts IS NOT NULL")
     conn.commit()
 
 
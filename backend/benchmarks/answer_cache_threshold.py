@@ -0,0 +1,89 @@
+"""
+answer_cache_threshold.py — Does ANSWER_CACHE_THRESHOLD separate paraphrases
+from different questions?
+
+Embeds question pairs with the same BGE-small query embeddings the answer
+cache uses and prints their cosine similarity. Paraphrases ("same") should
+score at or above the threshold; distinct questions — especially ones that
+differ in a single word — must stay below it, or one visitor gets the answer
+to another visitor's question. Exits with status 1 when a distinct pair
+reaches the threshold. Run from backend/:
+
+    python -m benchmarks.answer_cache_threshold [--threshold 0.93]
+    python -m benchmarks.answer_cache_threshold --pairs-file booth_pairs.jsonl
+
+--pairs-file takes JSONL lines {"a": "...", "b": "...", "same": true|false},
+ideally the booth's own questions.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.answer_cache import ANSWER_CACHE_THRESHOLD
+from Utils.pdfvectorising import get_embeddings
+
+PAIRS = [
+    # Paraphrases: reusing the answer is correct
+    ("What does this project do?", "What does the project do?", True),
+    ("How does the login work?", "How does login work?", True),
+    ("What is the tech stack?", "Which tech stack does it use?", True),
+    ("Who built this project?", "Who made this project?", True),
+    ("How accurate is the model?", "How accurate is the model used here?", True),
+    # Distinct questions: reusing the answer is wrong
+    ("How does the login work?", "How does the logout work?", False),
+    ("What is the accuracy of the model?", "What is the latency of the model?", False),
+    ("What database does it use?", "What frontend does it use?", False),
+    ("How is the data collected?", "How is the data stored?", False),
+    ("What are the limitations?", "What are the future plans?", False),
+    ("How much does it cost to run?", "How long does it take to run?", False),
+]
+
+
+def _load_pairs(path: str) -> list[tuple[str, str, bool]]:
+    with open(path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["a"], row["b"], bool(row["same"])) for row in rows]
+
+
+def _cosine(a, b) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=float, default=ANSWER_CACHE_THRESHOLD)
+    parser.add_argument("--pairs-file")
+    args = parser.parse_args()
+
+    pairs = _load_pairs(args.pairs_file) if args.pairs_file else PAIRS
+    embeddings = get_embeddings()
+    scored = [(a, b, same, _cosine(embeddings.embed_query(a), embeddings.embed_query(b)))
+              for a, b, same in pairs]
+
+    print(f"--- Answer cache threshold {args.threshold} over {len(scored)} pairs ---")
+    for a, b, same, score in sorted(scored, key=lambda row: row[3], reverse=True):
+        hit = score >= args.threshold
+        flag = "  " if hit == same else "✗ "
+        print(f"{flag}{score:.3f} {'same' if same else 'diff'}  {a!r} / {b!r}")
+
+    for label, same in (("same", True), ("diff", False)):
+        scores = [score for _, _, s, score in scored if s == same]
+        if scores:
+            print(f"{label}: min {min(scores):.3f}  median {statistics.median(scores):.3f}  max {max(scores):.3f}")
+
+    conflated = [row for row in scored if not row[2] and row[3] >= args.threshold]
+    missed = [row for row in scored if row[2] and row[3] < args.threshold]
+    print(f"{len(conflated)} distinct pairs would share an answer, {len(missed)} paraphrases would miss the cache")
+    sys.exit(1 if conflated else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+retrieval_recall.py — recall@k vs latency: vector, BM25, hybrid (RRF) and the
+full retrieval pipeline (over-fetch → MMR → optional rerank).
+
+Runs on the datasets already ingested into chroma_db. Without a query file
+each sampled chunk is its own test: one of its sentences is the query and the
+chunk is the only relevant answer (a self-retrieval proxy). With
+--queries-file, every JSONL line {"dataset", "question", "expect"} counts a
+hit for any retrieved chunk containing the `expect` text. Run from backend/:
+
+    python -m benchmarks.retrieval_recall [--dataset X.pdf] [--samples 30] [--k 2,4,6,10]
+    python -m benchmarks.retrieval_recall --queries-file booth_questions.jsonl
+
+The pipeline returns at most retrieval_k(--mode) chunks, so its recall at
+larger k is capped there.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.hybrid_retrieval import HYBRID_FETCH_K, hybrid_search, lexical_candidates, vector_candidates
+from services.retrieval_pipeline import retrieve
+from Utils.pdfvectorising import get_embeddings, get_project_vectorstore, registry
+
+METHODS = ("vector", "bm25", "hybrid", "pipeline")
+
+
+def _sample_queries(filename: str, samples: int, rng: random.Random) -> list[dict]:
+    rows = get_project_vectorstore(filename)._collection.get(include=["documents"])
+    chunks = list(zip(rows["ids"], rows["documents"]))
+    rng.shuffle(chunks)
+    queries = []
+    for chunk, text in chunks:
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", text or "") if 6 <= len(s.split()) <= 25]
+        if sentences:
+            queries.append({"dataset": filename, "question": rng.choice(sentences), "ids": {chunk}})
+        if len(queries) >= samples:
+            break
+    return queries
+
+
+def _load_queries(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _is_hit(query: dict, doc_id: str, text: str) -> bool:
+    if "ids" in query:
+        return doc_id in query["ids"]
+    return query["expect"].lower() in (text or "").lower()
+
+
+def _rank(method: str, query: dict, depth: int, mode: str) -> list[tuple[str, str]]:
+    """(chunk ID, text) best first, after clearing the query-embedding cache
+    so every method pays the same embedding cost."""
+    get_embeddings().clear()
+    filename, question = query["dataset"], query["question"]
+    if method == "vector":
+        return [(doc.id, doc.page_content) for doc in vector_candidates(filename, question, depth)]
+    if method == "bm25":
+        ids = lexical_candidates(filename, question, depth)
+        if not ids:
+            return []
+        rows = get_project_vectorstore(filename)._collection.get(ids=ids, include=["documents"])
+        texts = dict(zip(rows["ids"], rows["documents"]))
+        return [(chunk, texts.get(chunk, "")) for chunk in ids]
+    if method == "pipeline":
+        return [(doc.id, doc.page_content) for doc in retrieve(question, filename, mode)[0]]
+    return [(doc.id, doc.page_content) for doc in hybrid_search(filename, question, depth)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", action="append", help="dataset filename (repeatable; default: all)")
+    parser.add_argument("--samples", type=int, default=30, help="sampled queries per dataset")
+    parser.add_argument("--queries-file")
+    parser.add_argument("--k", default="2,4,6,10")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--mode", default="normal", help="classify_question() mode for the pipeline")
+    args = parser.parse_args()
+
+    ks = sorted(int(k) for k in args.k.split(","))
+    if args.queries_file:
+        queries = _load_queries(args.queries_file)
+    else:
+        rng = random.Random(args.seed)
+        datasets = args.dataset or sorted(registry.datasets())
+        queries = [q for filename in datasets for q in _sample_queries(filename, args.samples, rng)]
+    if not queries:
+        print("No queries — ingest a dataset first.")
+        return
+
+    # Untimed pass: loads the embedding model, HNSW and lexical indexes
+    for method in METHODS:
+        _rank(method, queries[0], ks[-1], args.mode)
+
+    print(f"--- Retrieval recall@k over {len(queries)} queries (fetch_k={HYBRID_FETCH_K}) ---")
+    print(f"{'method':<8} " + " ".join(f"{'R@' + str(k):>6}" for k in ks) + f" {'p50 ms':>8} {'p95 ms':>8}")
+    for method in METHODS:
+        hits = {k: 0 for k in ks}
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            ranked = _rank(method, query, ks[-1], args.mode)
+            latencies.append(time.perf_counter() - started)
+            first_hit = next((i for i, (chunk, text) in enumerate(ranked) if _is_hit(query, chunk, text)), None)
+            for k in ks:
+                if first_hit is not None and first_hit < k:
+                    hits[k] += 1
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{method:<8} " + " ".join(f"{hits[k] / len(queries):6.2f}" for k in ks)
+              + f" {statistics.median(latencies) * 1000:8.1f} {p95 * 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
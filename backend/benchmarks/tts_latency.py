@@ -0,0 +1,82 @@
+"""
+tts_latency.py — Time-to-first-audio: edge-tts vs the local Piper voice.
+
+Bypasses the audio cache and calls each engine directly, so every run is a
+real synthesis. Run from backend/:
+
+    python -m benchmarks.tts_latency [--runs 3] [--edge-voice ava] [--local-voice piper:en_US-amy-medium]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.tts_service import VOICE_MAP, TTS_FALLBACK_VOICE, _clean_text_for_tts, _engine_for
+
+PHRASES = [
+    "Hello! Welcome to the exhibition. What would you like to know?",
+    "The project uses a retrieval pipeline over the exhibitor's documents.",
+    "It runs entirely on a laptop CPU, so it keeps working when the venue Wi-Fi does not.",
+    "I don't have that information right now.",
+]
+
+
+async def _measure(voice_name: str, text: str) -> tuple[float, float, int]:
+    engine, voice_id = _engine_for(voice_name)
+    started = time.perf_counter()
+    first_audio = None
+    size = 0
+    async for data in engine.stream(_clean_text_for_tts(text), voice_id):
+        if first_audio is None:
+            first_audio = time.perf_counter() - started
+        size += len(data)
+    return first_audio or 0.0, time.perf_counter() - started, size
+
+
+async def _bench(label: str, voice_name: str, runs: int):
+    engine, voice_id = _engine_for(voice_name)
+    if not engine.available(voice_id):
+        print(f"{label:<8} {voice_name}: not available, skipped")
+        return
+    # First call pays connection setup / model load — reported separately
+    try:
+        cold_first, _, _ = await _measure(voice_name, PHRASES[0])
+    except Exception as e:
+        print(f"{label:<8} {voice_name}: failed ({e})")
+        return
+
+    firsts, totals, sizes = [], [], []
+    for _ in range(runs):
+        for phrase in PHRASES:
+            first, total, size = await _measure(voice_name, phrase)
+            firsts.append(first)
+            totals.append(total)
+            sizes.append(size)
+
+    print(
+        f"{label:<8} cold {cold_first * 1000:7.0f} ms | "
+        f"first audio p50 {statistics.median(firsts) * 1000:6.0f} ms, max {max(firsts) * 1000:6.0f} ms | "
+        f"full clip p50 {statistics.median(totals) * 1000:6.0f} ms | "
+        f"avg {statistics.mean(sizes) / 1024:5.1f} KB ({engine.media_type})"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--edge-voice", default="ava")
+    parser.add_argument("--local-voice", default=TTS_FALLBACK_VOICE)
+    args = parser.parse_args()
+
+    print(f"--- TTS time-to-first-audio ({args.runs} x {len(PHRASES)} phrases) ---")
+    await _bench("edge", VOICE_MAP.get(args.edge_voice, args.edge_voice), args.runs)
+    await _bench("local", VOICE_MAP.get(args.local_voice, args.local_voice), args.runs)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,9 @@
+import asyncio
 import sys
 import os
 import re
-from collections import defaultdict
+import time
+from collections import OrderedDict, defaultdict
 
 # --- PATH SETUP ---
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -10,17 +12,21 @@ from langchain_ollama.llms import OllamaLLM
 from langchain_core.prompts import ChatPromptTemplate
 
 try:
-    from Utils.pdfvectorising import vectorstore
+    from Utils.pdfvectorising import get_embeddings
 except ImportError:
-    from Utils.pdfvectorising import vectorstore
+    from Utils.pdfvectorising import get_embeddings
+
+from services.answer_cache import answer_cache, replay
+from services.context_packer import LLM_NUM_CTX, pack_context
+from services.prefetch import prefetcher
+from services.project_overview import project_overviews
+from services.retrieval_pipeline import aretrieve, retrieve, submit_retrieve
 
 # --- MODEL (single shared instance, keep_alive prevents cold-starts) ---
 # temperature=0.2 keeps the model factual and grounded in the dataset.
 # Higher values (0.5+) cause hallucination of terms that don't exist in context.
-model = OllamaLLM(model="llama3.2", temperature=0.2, keep_alive="30m")
-
-# --- RETRIEVER CACHE (avoids rebuilding ChromaDB connections every query) ---
-_retriever_cache: dict = {}
+# num_ctx: Ollama's 2048-token default cannot hold the packed context budgets.
+model = OllamaLLM(model="llama3.2", temperature=0.2, keep_alive="30m", num_ctx=LLM_NUM_CTX)
 
 # ============================================================================
 #   CONVERSATION MEMORY (per-file sessions)
@@ -28,10 +34,13 @@ _retriever_cache: dict = {}
 class ConversationMemory:
     """Maintains recent conversation history per project file."""
 
-    def __init__(self, max_turns=3):
+    def __init__(self, max_turns=3, max_prefetched=256):
         self.max_turns = max_turns
         # {filter_filename: [(role, text), ...]}
         self.history = defaultdict(list)
+        # {filter_key: (match key, Future of prefetched docs, created)}, oldest first
+        self.prefetched = OrderedDict()
+        self.max_prefetched = max_prefetched
 
     def add(self, filter_key, role, text):
         key = filter_key or "__global__"
@@ -51,6 +60,9 @@ class ConversationMemory:
             lines.append(f"{prefix}: {text}")
         return "\n".join(lines)
 
+    def has_history(self, filter_key):
+        return bool(self.history.get(filter_key or "__global__"))
+
     def get_last_answer(self, filter_key):
         key = filter_key or "__global__"
         for role, text in reversed(self.history[key]):
@@ -58,11 +70,33 @@ class ConversationMemory:
                 return text
         return ""
 
+    def set_prefetch(self, filter_key, match, future):
+        """Park a retrieval started ahead of this session's next question."""
+        key = filter_key or "__global__"
+        replaced = self.prefetched.pop(key, None)
+        if replaced is not None:
+            replaced[1].cancel()   # no-op once it started; frees the queue otherwise
+        self.prefetched[key] = (match, future, time.monotonic())
+        while len(self.prefetched) > self.max_prefetched:
+            self.prefetched.popitem(last=False)[1][1].cancel()
+
+    def take_prefetch(self, filter_key, match):
+        """The parked retrieval if it was made for exactly this query (one use only)."""
+        entry = self.prefetched.pop(filter_key or "__global__", None)
+        if entry is None:
+            return None
+        if entry[0] != match or time.monotonic() - entry[2] > prefetcher.ttl_sec:
+            entry[1].cancel()
+            return None
+        return entry[1]
+
     def clear(self, filter_key=None):
         if filter_key:
             self.history[filter_key or "__global__"] = []
+            self.prefetched.pop(filter_key, None)
         else:
             self.history.clear()
+            self.prefetched.clear()
 
 
 memory = ConversationMemory(max_turns=3)
@@ -229,6 +263,7 @@ def classify_question(question: str) -> str:
         "main features", "key points", "in brief", "briefly explain",
         "give me an overview", "what's it about", "what is it about",
         "what is this", "what's this",
+        "tech stack", "built with", "what technologies",
     ]
     if any(p in q for p in summary_patterns):
         return "summary"
@@ -413,150 +448,277 @@ _chain_cache = {
 }
 
 
-def _get_retriever(filter_filename: str | None, mode: str):
-    """
-    Return a cached retriever for the given (filename, mode) pair.
-    Building a retriever is cheap but calling vectorstore.as_retriever()
-    repeatedly inside a hot loop accumulates objects and slows down ChromaDB.
-    """
-    k_values = {"deep": 8, "comparison": 10, "summary": 14, "elaborate": 10, "normal": 8}
-    k = k_values.get(mode, 8)
-
-    cache_key = (filter_filename, mode)
-    if cache_key in _retriever_cache:
-        return _retriever_cache[cache_key]
-
-    search_kwargs: dict = {"k": k}
-    if filter_filename:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        full_path = os.path.join(base_dir, "Dataset", filter_filename)
-        search_kwargs["filter"] = {"source": full_path}
-        print(f"🔒 Locking search to: {filter_filename}")
-
-    retriever = vectorstore.as_retriever(
-        search_type="similarity",
-        search_kwargs=search_kwargs
-    )
-    # Cache up to 20 unique (file, mode) combos; evict oldest when full
-    if len(_retriever_cache) >= 20:
-        oldest_key = next(iter(_retriever_cache))
-        del _retriever_cache[oldest_key]
-    _retriever_cache[cache_key] = retriever
-    return retriever
-
-
-def ask_lumira(question, filter_filename=None, session_id=None):
-    print(f"🤖 Processing: {question} | Filter: {filter_filename} | Session: {session_id}")
-
-    mem_key = _memory_key(session_id, filter_filename)
-
+def _screen_input(question: str) -> str | None:
+    """Steps 1-3: canned replies that never touch retrieval or the LLM."""
     # 1. Check Small Talk (fuzzy)
     small_talk_reply = match_small_talk(question)
     if small_talk_reply:
-        yield small_talk_reply
-        return
+        return small_talk_reply
 
     # 2. Check for Noise (very short inputs)
     clean_q = question.strip().lower().replace('.', '').replace('!', '').replace('?', '')
     if len(clean_q) < 2 and clean_q not in ["ai", "ui", "ux"]:
-        yield "I didn't quite catch that. Could you rephrase?"
-        return
+        return "I didn't quite catch that. Could you rephrase?"
 
     # 3. Check for Gibberish / unintelligible input
     if is_gibberish(question):
         print(f"🚫 Gibberish detected: {question}")
-        yield "I didn't quite understand that. Could you rephrase your question?"
+        return "I didn't quite understand that. Could you rephrase your question?"
+
+    return None
+
+
+# A follow-up made only of these words adds no search terms of its own
+_BARE_FOLLOW_UP_WORDS = frozenset(
+    "tell me more about on that this it please can could you a bit little some go keep going "
+    "continue elaborate explain expand deeper dig detail details and then what else why is how "
+    "so do mean".split()
+)
+FOLLOW_UP_QUERY = "tell me more"
+
+
+def _is_bare_follow_up(question: str) -> bool:
+    words = re.findall(r"[a-z]+", question.lower())
+    return bool(words) and all(w in _BARE_FOLLOW_UP_WORDS for w in words)
+
+
+def _build_search_query(question: str, mode: str, mem_key: str) -> str:
+    """Step 5: for elaborations, enhance the search query with prior context."""
+    search_query = question
+    if mode == "elaborate":
+        last_answer = memory.get_last_answer(mem_key)
+        if last_answer:
+            # "Tell me more" / "can you elaborate?" / "go on" all search the
+            # same way, which is what lets the prefetched retrieval match
+            follow_up = FOLLOW_UP_QUERY if _is_bare_follow_up(question) else question
+            search_query = f"{last_answer[:200]} {follow_up}"
+            print(f"🔗 Enhanced search with prior context")
+    return search_query
+
+
+def _prefetch_match(filter_filename: str | None, mode: str, search_query: str) -> tuple:
+    """What a retrieval started ahead of time must match to be reused. Case and
+    punctuation are ignored: a partial transcript rarely has the final's."""
+    return filter_filename, mode, " ".join(re.findall(r"\w+", search_query.lower()))
+
+
+def _prefetch_follow_up(mem_key: str, filter_filename: str | None):
+    """After an answer: retrieve for a "tell me more" in the background."""
+    search_query = _build_search_query(FOLLOW_UP_QUERY, "elaborate", mem_key)
+    future = prefetcher.submit(lambda: retrieve(search_query, filter_filename, "elaborate")[0])
+    if future is not None:
+        memory.set_prefetch(mem_key, _prefetch_match(filter_filename, "elaborate", search_query), future)
+
+
+def start_retrieval(question: str, filter_filename: str | None = None, session_id: str | None = None):
+    """Start retrieving for a question that is about to be asked — e.g. from
+    the last partial transcript while the final STT decode runs. If the final
+    question searches the same way, ask_lumira_async joins this retrieval."""
+    if _screen_input(question):
+        return
+    mode = classify_question(question)
+    if mode == "summary" and project_overviews.lookup(filter_filename, question):
+        return
+    mem_key = _memory_key(session_id, filter_filename)
+    search_query = _build_search_query(question, mode, mem_key)
+    memory.set_prefetch(mem_key, _prefetch_match(filter_filename, mode, search_query),
+                        submit_retrieve(search_query, filter_filename, mode))
+
+
+def _take_prefetched(mem_key: str, filter_filename: str | None, mode: str, search_query: str):
+    """Future of the docs retrieved ahead of time for this question, or None.
+
+    A job still queued behind other sessions' work is cancelled: the live
+    retrieval is faster than waiting for it to start."""
+    future = memory.take_prefetch(mem_key, _prefetch_match(filter_filename, mode, search_query))
+    cancelled = future is not None and future.cancel()
+    if cancelled:
+        future = None
+    if mode == "elaborate":
+        prefetcher.record(hit=future is not None, cancelled=cancelled)
+    return future
+
+
+def _format_context(context_docs, mode: str) -> str:
+    """Step 8: pack whole, de-duplicated chunks into the mode's token budget."""
+    print(f"🔎 Found {len(context_docs)} relevant chunks.")
+    if context_docs:
+        print(f"📄 Top Context: {context_docs[0].page_content[:200]}...")
+    else:
+        print("⚠️ NO CONTEXT FOUND!")
+
+    context, stats = pack_context(context_docs, mode)
+    print(f"📦 Packed {stats['packed']}/{stats['retrieved']} chunks, "
+          f"{stats['tokens']}/{stats['budget']} tokens ({stats['duplicates']} duplicates dropped)")
+    return context
+
+
+NO_CONTEXT_REPLY = "I don't have enough information to answer that right now. Could you try rephrasing?"
+
+
+def _remember_no_context(mem_key: str, question: str):
+    memory.add(mem_key, "user", question)
+    memory.add(mem_key, "ai", "I don't have enough information to answer that.")
+
+
+def _chain_inputs(formatted_context: str, question: str, mem_key: str) -> dict:
+    """Steps 9-11: history lookup + store the user turn, returning the prompt variables."""
+    # 9. GET CONVERSATION HISTORY (scoped to this session)
+    history = memory.get_formatted(mem_key)
+    if not history:
+        history = "(No prior conversation)"
+
+    # 11. STORE USER MESSAGE IN MEMORY (session-scoped)
+    memory.add(mem_key, "user", question)
+
+    return {
+        "context": formatted_context,
+        "question": question,
+        "history": history
+    }
+
+
+def _error_notification(e: Exception) -> str:
+    """Map a failure to an ERROR_NOTIFICATION: line so the frontend shows a toast, not chat text."""
+    if isinstance(e, ConnectionError):
+        print(f"❌ Connection error in ask_lumira: {e}")
+        return f"ERROR_NOTIFICATION: Connection lost. Please check the server."
+    if isinstance(e, TimeoutError):
+        print(f"❌ Timeout in ask_lumira: {e}")
+        return f"ERROR_NOTIFICATION: Request timed out. Please try again."
+
+    err_str = str(e)
+    print(f"❌ Error in ask_lumira: {err_str}")
+    # Ollama not running / refused connection
+    if "10061" in err_str or "refused" in err_str.lower() or "connection" in err_str.lower():
+        return f"ERROR_NOTIFICATION: Cannot reach the AI model. Make sure Ollama is running."
+    return f"ERROR_NOTIFICATION: Something went wrong. Please try again."
+
+
+async def ask_lumira_async(question, filter_filename=None, session_id=None, ticket=None):
+    """Answer a question as an async stream of text chunks (the routes and the CLI).
+
+    Uses async retrieval and chain.astream so an in-flight answer only costs an
+    await on the event loop instead of pinning a Starlette threadpool worker
+    for the whole llama3.2 stream.
+
+    ticket: optional GenerationTicket from services.generation_scheduler. The
+    LLM slot is only acquired right before generation and always released.
+    The follow-up prefetch starts only after that release, so it sees the
+    slot this answer just freed.
+    """
+    answered = []
+    try:
+        async for chunk in _ask_lumira_async(question, filter_filename, session_id, ticket, answered):
+            yield chunk
+    finally:
+        if ticket is not None:
+            ticket.release()
+        for mem_key, project in answered:
+            _prefetch_follow_up(mem_key, project)
+
+
+async def _ask_lumira_async(question, filter_filename, session_id, ticket, answered):
+    print(f"🤖 Processing (async): {question} | Filter: {filter_filename} | Session: {session_id}")
+
+    mem_key = _memory_key(session_id, filter_filename)
+
+    # 1-3. Small talk / noise / gibberish
+    canned_reply = _screen_input(question)
+    if canned_reply:
+        yield canned_reply
         return
 
     try:
+        started = time.perf_counter()
+
         # 4. CLASSIFY QUESTION
         mode = classify_question(question)
         print(f"🎯 Mode: {mode.upper()}")
 
+        # 4b. PRECOMPUTED OVERVIEW (no retrieval, no LLM slot)
+        overview = project_overviews.answer(filter_filename, question) if mode == "summary" else None
+        if overview:
+            memory.add(mem_key, "user", question)
+            for chunk in replay(overview):
+                yield chunk
+            memory.add(mem_key, "ai", overview)
+            answered.append((mem_key, filter_filename))
+            return
+
         # 5. BUILD SEARCH QUERY
-        # For elaborations, enhance the search query with prior context
-        search_query = question
-        if mode == "elaborate":
-            last_answer = memory.get_last_answer(mem_key)
-            if last_answer:
-                search_query = f"{last_answer[:200]} {question}"
-                print(f"🔗 Enhanced search with prior context")
-
-        # 6. GET CACHED RETRIEVER (avoids per-query ChromaDB overhead)
+        search_query = _build_search_query(question, mode, mem_key)
+
+        # 5b. SEMANTIC ANSWER CACHE — first questions of a session only; later
+        # ones are answered in the light of the history
+        question_vector = None
+        if answer_cache.is_cacheable(mode, memory.has_history(mem_key)):
+            question_vector = await get_embeddings().aembed_query(question)
+            cached_answer = answer_cache.lookup(filter_filename, mode, question_vector)
+            if cached_answer:
+                memory.add(mem_key, "user", question)
+                for chunk in replay(cached_answer):
+                    yield chunk
+                memory.add(mem_key, "ai", cached_answer)
+                answered.append((mem_key, filter_filename))
+                return
+
+        # 6-7. RETRIEVE CONTEXT (async)
         print(f"📊 Retrieving with mode={mode}")
-        retriever = _get_retriever(filter_filename, mode)
-
-        # 7. RETRIEVE CONTEXT
-        context_docs = retriever.invoke(search_query)
-
-        print(f"🔎 Found {len(context_docs)} relevant chunks.")
-        if context_docs:
-            print(f"📄 Top Context: {context_docs[0].page_content[:200]}...")
+        prefetched = _take_prefetched(mem_key, filter_filename, mode, search_query)
+        # Running or finished: joining it is never slower than starting over
+        context_docs = await asyncio.wrap_future(prefetched) if prefetched is not None else None
+        if context_docs is None:
+            context_docs, _ = await aretrieve(search_query, filter_filename, mode)
         else:
-            print("⚠️ NO CONTEXT FOUND!")
+            print("⚡ Using context retrieved ahead of the question")
 
-        # 8. FORMAT CONTEXT (cap total to ~3000 chars to avoid prompt bloat)
-        raw_context = "\n\n".join([doc.page_content for doc in context_docs])
-        formatted_context = raw_context[:3000]
-
-        # 8b. CONTEXT QUALITY GATE — if retrieval returned nothing useful,
-        # give a polite fallback instead of letting the LLM hallucinate.
+        # 8. FORMAT CONTEXT + QUALITY GATE
+        formatted_context = _format_context(context_docs, mode)
         if not formatted_context.strip():
-            yield "I don't have enough information to answer that right now. Could you try rephrasing?"
-            memory.add(mem_key, "user", question)
-            memory.add(mem_key, "ai", "I don't have enough information to answer that.")
+            yield NO_CONTEXT_REPLY
+            _remember_no_context(mem_key, question)
             return
 
-        # 9. GET CONVERSATION HISTORY (scoped to this session)
-        history = memory.get_formatted(mem_key)
-        if not history:
-            history = "(No prior conversation)"
-
-        # 10. GET CACHED CHAIN
+        # 9-11. HISTORY + CACHED CHAIN
+        inputs = _chain_inputs(formatted_context, question, mem_key)
         chain = _chain_cache.get(mode, _chain_cache["normal"])
 
-        # 11. STORE USER MESSAGE IN MEMORY (session-scoped)
-        memory.add(mem_key, "user", question)
-
-        # 12. GENERATE & STREAM ANSWER
+        # 12. WAIT FOR AN LLM SLOT, THEN GENERATE & STREAM (native async)
+        if ticket is not None:
+            await ticket.acquire()
         full_response = ""
-        for chunk in chain.stream({
-            "context": formatted_context,
-            "question": question,
-            "history": history
-        }):
+        async for chunk in chain.astream(inputs):
             full_response += chunk
             yield chunk
 
-        # 13. STORE AI RESPONSE IN MEMORY (session-scoped)
+        # 13. STORE AI RESPONSE IN MEMORY
         memory.add(mem_key, "ai", full_response)
+        answered.append((mem_key, filter_filename))
 
+        # 14. CACHE THE FINISHED ANSWER
+        if question_vector is not None:
+            answer_cache.store(
+                filter_filename, mode, question, question_vector,
+                full_response, time.perf_counter() - started,
+            )
 
-    except ConnectionError as e:
-        print(f"❌ Connection error in ask_lumira: {e}")
-        # Prefix with ERROR_NOTIFICATION: so the frontend shows a toast, not chat text
-        yield f"ERROR_NOTIFICATION: Connection lost. Please check the server."
-    except TimeoutError as e:
-        print(f"❌ Timeout in ask_lumira: {e}")
-        yield f"ERROR_NOTIFICATION: Request timed out. Please try again."
     except Exception as e:
-        err_str = str(e)
-        print(f"❌ Error in ask_lumira: {err_str}")
-        # Ollama not running / refused connection
-        if "10061" in err_str or "refused" in err_str.lower() or "connection" in err_str.lower():
-            yield f"ERROR_NOTIFICATION: Cannot reach the AI model. Make sure Ollama is running."
-        else:
-            yield f"ERROR_NOTIFICATION: Something went wrong. Please try again."
+        yield _error_notification(e)
 
 
 # --- CLI LOOP (For testing without Frontend) ---
-if __name__ == "__main__":
+async def _cli():
     print("--- CLI Mode (Type 'q' to quit) ---")
     while True:
         qn = input("\nAsk: ")
         if qn.lower() == "q": break
 
         print("Lumira: ", end="")
-        for chunk in ask_lumira(qn, None):
+        async for chunk in ask_lumira_async(qn, None):
             print(chunk, end="", flush=True)
-        print()
\ No newline at end of file
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli())
@@ -1,54 +1,275 @@
+import hashlib
 import os
-import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from langchain_community.document_loaders import PyPDFLoader
 # CHANGE: Switched from SemanticChunker to Recursive for reliable large chunks
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 from langchain_chroma import Chroma
 
+from services.lexical_index import lexical_indexes
+from services.project_overview import project_overviews
+from Utils.pdfvectorising import registry
+
 # Configuration
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db")
+EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 
+# Chroma rejects very large single writes; stay well under its max batch size
+CHROMA_WRITE_BATCH = 1000
 
-def ingest_document(file_path: str):
-    print(f"🔄 Starting ingestion for: {file_path}")
+# Embedding is done in batches so Chroma writes overlap with the next batch's
+# embedding; threads = ONNX Runtime intra-op threads (0 = let ONNX decide)
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+EMBED_THREADS = int(os.getenv("INGEST_EMBED_THREADS", "0"))
+
+# --- WARM EMBEDDING MODEL (one per process, reused across jobs) ---
+_embeddings: FastEmbedEmbeddings | None = None
+
+
+def get_embeddings(threads: int | None = None) -> FastEmbedEmbeddings:
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = FastEmbedEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            threads=threads or EMBED_THREADS or None,
+            batch_size=EMBED_BATCH_SIZE,
+        )
+    return _embeddings
 
+
+def current_rss_mb() -> float | None:
+    """Resident memory of this process right now, in MB (None where unsupported)."""
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / (1024 * 1024), 1)
+    except ImportError:
+        pass
+    # Linux without psutil
     try:
-        # 1. Load PDF
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
-        if not documents:
-            return False
-
-        # 2. Initialize Fast Embeddings
-        embeddings = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")
-
-        print("🧠 Splitting text (Wide-Angle Mode)...")
-
-        # 3. FIX: USE RECURSIVE SPLITTER WITH LARGE CHUNKS
-        # chunk_size=2000 ensures we capture full pages/sections at once.
-        # This is CRITICAL for answering broad questions like "Summarize this".
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=2000,
-            chunk_overlap=200
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """Peak resident memory over one job, sampled between its steps. (The
+    rusage peak covers the worker's whole lifetime: after one large document
+    every later job would report the same number.)"""
+
+    def __init__(self):
+        self.peak = None
+        self.sample()
+
+    def sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+
+def _noop_progress(**fields):
+    pass
+
+
+def load_chunks(file_path: str, on_progress=_noop_progress):
+    """Load a PDF and split it into large chunks. Returns (page_count, chunks)."""
+    on_progress(state="parsing")
+
+    # 1. Load PDF
+    loader = PyPDFLoader(file_path)
+    documents = loader.load()
+    on_progress(pages=len(documents))
+    if not documents:
+        return 0, []
+
+    print("🧠 Splitting text (Wide-Angle Mode)...")
+
+    # 2. FIX: USE RECURSIVE SPLITTER WITH LARGE CHUNKS
+    # chunk_size=2000 ensures we capture full pages/sections at once.
+    # This is CRITICAL for answering broad questions like "Summarize this".
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=2000,
+        chunk_overlap=200
+    )
+
+    chunks = text_splitter.split_documents(documents)
+
+    # 🔍 DEBUG: See exactly how many large chunks were created
+    print(f"📄 SPLITTING REPORT: Created {len(chunks)} LARGE chunks from {os.path.basename(file_path)}")
+    on_progress(chunks_total=len(chunks))
+    return len(documents), chunks
+
+
+# ============================================================================
+#   CONTENT-HASHED CHUNK IDS (idempotent, incremental re-ingestion)
+# ============================================================================
+
+def chunk_id(source: str, text: str) -> str:
+    """Stable chunk ID from the dataset filename + chunk text.
+
+    Uses the basename so IDs survive the install directory moving. The same
+    chunk always gets the same ID, so re-ingesting never duplicates vectors
+    and unchanged chunks can be skipped entirely.
+    """
+    digest = hashlib.sha256(f"{os.path.basename(source)}\n{text}".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def existing_ids(vector_store: Chroma) -> set[str]:
+    """IDs of the vectors currently stored in a dataset's collection."""
+    result = vector_store._collection.get(include=[])
+    return set(result["ids"])
+
+
+def iter_embedded_batches(chunks, ids, batch_size: int = EMBED_BATCH_SIZE, on_progress=_noop_progress):
+    """Embed chunks batch by batch, yielding {"ids", "texts", "metadatas", "vectors"} per batch."""
+    embeddings = get_embeddings()
+    done = 0
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        texts = [c.page_content for c in batch]
+        vectors = embeddings.embed_documents(texts)
+        done += len(batch)
+        on_progress(chunks_done=done)
+        yield {
+            "ids": ids[start:start + batch_size],
+            "texts": texts,
+            "metadatas": [c.metadata for c in batch],
+            "vectors": vectors,
+        }
+
+
+def embed_document(file_path: str, on_batch, on_progress=_noop_progress, skip_ids=frozenset()) -> dict:
+    """Parse + embed a document without touching Chroma.
+
+    Chunks whose content-hash ID is in skip_ids (already in Chroma) are not
+    embedded again — fixing a typo only re-embeds the chunks around it.
+    Each embedded batch is handed to on_batch as soon as it is ready, so the
+    caller can write batch N to Chroma while batch N+1 is being embedded.
+    This is the CPU-heavy half of ingestion and runs inside the ingestion
+    worker processes. Returns per-job stats, including every current chunk
+    ID so the caller can delete the vanished ones.
+    """
+    rss = RssSampler()
+    pages, chunks = load_chunks(file_path, on_progress)
+    rss.sample()
+    if not chunks:
+        raise ValueError("No text could be extracted from the document.")
+
+    # Identical chunks hash to the same ID; keep the first occurrence only
+    current_ids, new_chunks, new_ids = [], [], []
+    seen = set()
+    for chunk in chunks:
+        cid = chunk_id(file_path, chunk.page_content)
+        if cid in seen:
+            continue
+        seen.add(cid)
+        current_ids.append(cid)
+        if cid not in skip_ids:
+            new_chunks.append(chunk)
+            new_ids.append(cid)
+
+    unchanged = len(current_ids) - len(new_chunks)
+    print(f"🧮 Incremental ingest: {len(new_chunks)} new chunks, {unchanged} unchanged")
+    on_progress(state="embedding", chunks_total=len(new_chunks), chunks_done=0)
+
+    started = time.perf_counter()
+    for batch in iter_embedded_batches(new_chunks, new_ids, on_progress=on_progress):
+        rss.sample()
+        on_batch(batch)
+    embed_sec = time.perf_counter() - started
+
+    stats = {
+        "pages": pages,
+        "chunks": len(current_ids),
+        "chunks_embedded": len(new_chunks),
+        "chunks_unchanged": unchanged,
+        "ids": current_ids,
+        "embed_sec": round(embed_sec, 2),
+        "chunks_per_sec": round(len(new_chunks) / embed_sec, 1) if embed_sec > 0 and new_chunks else None,
+        "peak_rss_mb": rss.peak,
+    }
+    print(f"⚡ Embedded {stats['chunks_embedded']} chunks in {stats['embed_sec']}s "
+          f"({stats['chunks_per_sec']} chunks/s, peak RSS {stats['peak_rss_mb']} MB)")
+    return stats
+
+
+def write_batch(vector_store: Chroma, batch: dict):
+    """Write one embedded batch into Chroma (upsert, so a resumed job is harmless)."""
+    ids, texts, metadatas, vectors = batch["ids"], batch["texts"], batch["metadatas"], batch["vectors"]
+    for start in range(0, len(texts), CHROMA_WRITE_BATCH):
+        end = start + CHROMA_WRITE_BATCH
+        vector_store._collection.upsert(
+            ids=ids[start:end],
+            embeddings=vectors[start:end],
+            documents=texts[start:end],
+            metadatas=metadatas[start:end],
         )
 
-        chunks = text_splitter.split_documents(documents)
 
-        # 🔍 DEBUG: See exactly how many large chunks were created
-        print(f"📄 SPLITTING REPORT: Created {len(chunks)} LARGE chunks from {os.path.basename(file_path)}")
+def remove_vanished(vector_store: Chroma, source: str, current_ids) -> int:
+    """Delete vectors of chunks that no longer exist in the document.
+    Also sweeps legacy random-UUID vectors from before content hashing."""
+    vanished = list(existing_ids(vector_store) - set(current_ids))
+    for start in range(0, len(vanished), CHROMA_WRITE_BATCH):
+        vector_store._collection.delete(ids=vanished[start:start + CHROMA_WRITE_BATCH])
+    if vanished:
+        print(f"🗑️ Removed {len(vanished)} vanished chunks for {os.path.basename(source)}")
+    return len(vanished)
+
+
+def ingest_document(file_path: str):
+    """Ingest a document in-process (CLI / one-off use). The server goes through
+    services.ingest_jobs, which runs embed_document in warm worker processes.
+
+    A running server is not told about it: it keeps serving its cached
+    answers for this project until it restarts or ANSWER_CACHE_TTL_SEC
+    passes (and its in-memory BM25 index and overview until it restarts).
+    While the server is up, upload through its file API instead."""
+    print(f"🔄 Starting ingestion for: {file_path}")
 
-        # 4. Add to Vector Store
-        # Note: We append to the existing DB, we don't overwrite it
+    try:
+        # Add to the dataset's own collection (created on first ingest)
         vector_store = Chroma(
             persist_directory=DB_PATH,
-            embedding_function=embeddings
+            collection_name=registry.register(os.path.basename(file_path)),
+            embedding_function=get_embeddings()
         )
-        vector_store.add_documents(chunks)
+
+        # One writer thread: batch N is written while batch N+1 is embedded
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+
+            def on_batch(batch):
+                nonlocal pending
+                if pending is not None:
+                    pending.result()   # at most one write in flight
+                pending = writer.submit(write_batch, vector_store, batch)
+
+            stats = embed_document(file_path, on_batch, skip_ids=existing_ids(vector_store))
+            if pending is not None:
+                pending.result()
+
+        removed = remove_vanished(vector_store, file_path, stats["ids"])
+        lexical_indexes.rebuild(os.path.basename(file_path), vector_store)
+        try:
+            project_overviews.build(os.path.basename(file_path), vector_store)
+        except Exception as e:
+            # The server regenerates it on its next start
+            print(f"⚠️ Overview generation skipped: {e}")
+
+        # Cached answers for this project were built from the old vectors,
+        # but they live in the server process, out of reach from here
+        if stats["chunks_embedded"] or removed:
+            print("⚠️ A running server keeps its cached answers for this dataset until it "
+                  "restarts or ANSWER_CACHE_TTL_SEC passes — restart it, or ingest via its upload API")
 
         print(f"✅ Successfully ingested {file_path}")
         return True
 
     except Exception as e:
         print(f"❌ Ingestion failed: {str(e)}")
-        return False
\ No newline at end of file
+        return False
@@ -1,5 +1,7 @@
+import asyncio
 import os
 import sys
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -18,8 +20,31 @@ from routes.chat import router as chat_router
 from routes.files import router as files_router
 from routes.analytics_routes import router as analytics_router
 from routes.auth_routes import router as auth_router
+from routes.ingest_routes import router as ingest_router
+from services.generation_scheduler import generation_scheduler
+from services.ingest_jobs import ingestion_manager
+from services.warmup import warm_up_all
+import analytics
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background LLM work (project overviews) queues for slots on this loop
+    generation_scheduler.bind_loop(asyncio.get_running_loop())
+    # Warm embeddings, Chroma, Whisper and Ollama in parallel in the background;
+    # the server accepts traffic right away and /api/health/ready says when it's warm
+    warmup_task = asyncio.create_task(warm_up_all())
+    # Warm ingestion workers + resume jobs interrupted by the last shutdown
+    ingestion_manager.start()
+    yield
+    warmup_task.cancel()
+    generation_scheduler.close()
+    ingestion_manager.shutdown()
+    # Commit analytics events still queued in memory
+    analytics.shutdown_writer()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # --- CORS: Read allowed origins from env (comma-separated) ---
 cors_origins = os.getenv(
@@ -41,6 +66,7 @@ app.include_router(chat_router)
 app.include_router(files_router)
 app.include_router(analytics_router)
 app.include_router(auth_router)
+app.include_router(ingest_router)
 
 # --- SERVE FRONTEND ---
 frontend_path = "../frontend/dist"
@@ -1,6 +1,6 @@
 import os
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 
 from models.schemas import SessionStartRequest, SessionHeartbeatRequest
 import analytics
@@ -24,8 +24,15 @@ def analytics_session_heartbeat(request: SessionHeartbeatRequest):
     return {"status": "ok"}
 
 
+def _window(since: str | None, until: str | None) -> tuple[int | None, int | None]:
+    try:
+        return analytics.parse_time(since), analytics.parse_time(until)
+    except ValueError:
+        raise HTTPException(400, "since/until must be epoch seconds, an ISO-8601 datetime or 'today'.")
+
+
 @router.get("/api/analytics")
-def analytics_all():
+def analytics_all(since: str | None = None, until: str | None = None, event_id: str | None = None):
     # Get all dataset filenames so new files with 0 activity are included
     dataset_files = []
     try:
@@ -36,7 +43,12 @@ def analytics_all():
             ]
     except OSError:
         pass
-    return analytics.get_all_analytics(dataset_files=dataset_files)
+    since_ts, until_ts = _window(since, until)
+    try:
+        return analytics.get_all_analytics(dataset_files=dataset_files, since=since_ts,
+                                           until=until_ts, event_id=event_id)
+    except KeyError:
+        raise HTTPException(404, f"Unknown event \"{event_id}\".")
 
 
 # NOTE: /clear must be declared BEFORE /{project} so the exact path takes priority
@@ -57,6 +69,25 @@ def analytics_clear():
     return analytics.get_all_analytics(dataset_files=dataset_files)
 
 
+@router.post("/api/analytics/rollups/rebuild")
+def analytics_rebuild_rollups():
+    """Recompute the dashboard rollups from the raw sessions / messages rows."""
+    analytics.flush()
+    analytics.rebuild_rollups()
+    return {"status": "ok"}
+
+
+@router.get("/api/analytics/{project}/events")
+def analytics_project_events(project: str):
+    """QR activation cycles of a project, newest first (ids for ?event_id=)."""
+    return {"project": project, "events": analytics.list_events(project)}
+
+
 @router.get("/api/analytics/{project}")
-def analytics_project(project: str):
-    return analytics.get_project_analytics(project)
+def analytics_project(project: str, since: str | None = None, until: str | None = None,
+                      event_id: str | None = None):
+    since_ts, until_ts = _window(since, until)
+    try:
+        return analytics.get_project_analytics(project, since=since_ts, until=until_ts, event_id=event_id)
+    except KeyError:
+        raise HTTPException(404, f"Unknown event \"{event_id}\".")
@@ -1,92 +1,240 @@
-import os
-import shutil
-import random
+import asyncio
+import json
 
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 
 from models.schemas import ChatRequest
-from services.stt_service import stt_model, inference_lock
+from services.stt_service import load_profiles, transcribe, transcribe_samples, transcribe_partial, STTBusy
+from services.stt_stream import UtteranceBuffer
 from services.tts_service import speak as tts_speak
-from bot import ask_lumira
-from routes.files import _is_qr_active
+from services.generation_scheduler import generation_scheduler, SchedulerOverloaded
+from services.project_overview import project_overviews
+from services.voice_pipeline import chat_with_audio
+from bot import ask_lumira_async, classify_question, start_retrieval
+from routes.files import _is_qr_active, _dataset_exists
 import analytics
 
 router = APIRouter()
 
-# --- Helpers ---
-_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-
-def _dataset_exists(filename: str) -> bool:
-    """Check if a dataset file exists on disk."""
-    if not filename:
-        return True  # No filter = global chat, always allowed
-    return os.path.isfile(os.path.join(_BASE_DIR, "Dataset", filename))
-
 
 @router.post("/api/stt")
-async def speech_to_text(file: UploadFile = File(...)):
-    if not stt_model: raise HTTPException(503, "STT Offline")
-
-    async with inference_lock:
-        # Preserve original file extension for correct FFmpeg/Whisper decoding
-        # iOS sends .mp4, Chrome sends .webm, fallback to .wav
-        original_name = file.filename or "audio.wav"
-        ext = original_name.rsplit(".", 1)[-1] if "." in original_name else "wav"
-        temp_path = f"temp_{random.randint(1000, 9999)}.{ext}"
-        try:
-            with open(temp_path, "wb") as b:
-                shutil.copyfileobj(file.file, b)
-
-            # DEBUG
-            print(f"🎤 Audio ({ext}): {os.path.getsize(temp_path)} bytes")
-
-            # --- ACCURACY SETTINGS ---
-            segments, _ = stt_model.transcribe(
-                temp_path,
-                vad_filter=False,  # Don't cut off quiet speech
-                beam_size=5,  # Look for 5 possibilities (Smarter)
-                initial_prompt="This is a user asking a technical question about a software project or exhibition."
-                # Context Clue
-            )
-
-            text = " ".join([s.text for s in segments]).strip()
-            print(f"📝 Transcribed: {text}")
-            return {"text": text}
-        except Exception as e:
-            print(f"STT Error: {e}")
-            return {"text": ""}
-        finally:
-            if os.path.exists(temp_path): os.remove(temp_path)
+async def speech_to_text(file: UploadFile = File(...), profile: str | None = None):
+    """Transcribe a voice query. ?profile=fast|accurate forces a profile;
+    by default it is picked from the clip length and the current load."""
+    if not await asyncio.to_thread(load_profiles): raise HTTPException(503, "STT Offline")
+
+    # Decoded straight from memory — iOS sends .mp4, Chrome sends .webm,
+    # and PyAV sniffs the container, so no temp file / extension is needed
+    audio = await file.read()
+    print(f"🎤 Audio ({file.filename or 'audio'}): {len(audio)} bytes")
+
+    try:
+        result = await transcribe(audio, profile)
+        print(f"📝 Transcribed [{result['profile']}, {result['audio_sec']}s audio, "
+              f"{result['decode_sec']}s decode, RTF {result['rtf']}]: {result['text']}")
+        return result
+    except STTBusy as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        print(f"STT Error: {e}")
+        return {"text": ""}
 
 
 @router.get("/api/speak")
-async def speak(text: str, voice: str | None = None):
-    return await tts_speak(text, voice)
+async def speak(request: Request, text: str, voice: str | None = None):
+    return await tts_speak(
+        text, voice,
+        range_header=request.headers.get("range"),
+        if_none_match=request.headers.get("if-none-match"),
+    )
 
 
-@router.post("/api/chat")
-async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
-    # --- Validate dataset still exists ---
-    if request.active_file and not _dataset_exists(request.active_file):
+def _admit_chat(active_file: str | None, message: str):
+    """Dataset / QR checks + admission control. Returns the generation ticket."""
+    # --- Validate dataset still exists (in-memory lookups, no disk I/O) ---
+    if active_file and not _dataset_exists(active_file):
         raise HTTPException(
             404,
-            f"Dataset \"{request.active_file}\" no longer exists. It may have been deleted."
+            f"Dataset \"{active_file}\" no longer exists. It may have been deleted."
         )
 
     # --- Check QR is active (exhibitor hasn't disabled it) ---
-    if request.active_file and not _is_qr_active(request.active_file):
+    if active_file and not _is_qr_active(active_file):
         raise HTTPException(
             403,
             "This project's QR has been deactivated by the exhibitor. The bot is currently offline for this project."
         )
 
-    # Log user message in background (non-blocking)
-    if request.active_file:
-        background_tasks.add_task(analytics.log_message, request.session_id, request.active_file, "user")
-        background_tasks.add_task(analytics.log_message, request.session_id, request.active_file, "ai")
-    return StreamingResponse(
-        ask_lumira(request.message, request.active_file, session_id=request.session_id),
-        media_type="text/plain"
-    )
+    # --- Precomputed overview answers never need an LLM slot ---
+    mode = classify_question(message)
+    if mode == "summary" and project_overviews.lookup(active_file, message):
+        return None
+
+    # --- Admission control: shed fast instead of timing out under load ---
+    try:
+        return generation_scheduler.admit(active_file, mode)
+    except SchedulerOverloaded as e:
+        raise HTTPException(e.status_code, e.detail, headers={"Retry-After": str(e.retry_after)})
+
+
+class _TicketedStreamingResponse(StreamingResponse):
+    """StreamingResponse that always releases the generation ticket.
+
+    The answer generator releases it itself, but only once iterated — a
+    client that disconnects before the body starts would otherwise leave
+    the ticket counted as waiting forever. release() is idempotent.
+    """
+
+    def __init__(self, content, ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.ticket is not None:
+                self.ticket.release()
+
+
+@router.post("/api/chat")
+async def chat_endpoint(request: ChatRequest, audio: bool = False, voice: str | None = None):
+    """Stream the answer as plain text, or with ?audio=1 as NDJSON frames that
+    interleave text with per-sentence TTS audio (see services/voice_pipeline)."""
+    ticket = _admit_chat(request.active_file, request.message)
+    try:
+        # Queued for the batched analytics writer (never waits on SQLite)
+        if request.active_file:
+            analytics.log_message(request.session_id, request.active_file, "user")
+            analytics.log_message(request.session_id, request.active_file, "ai")
+        # Async generator: StreamingResponse iterates it on the event loop, so a
+        # slow llama3.2 stream no longer holds a threadpool worker.
+        answer = ask_lumira_async(request.message, request.active_file, session_id=request.session_id, ticket=ticket)
+        if audio:
+            return _TicketedStreamingResponse(chat_with_audio(answer, voice), ticket,
+                                              media_type="application/x-ndjson")
+        return _TicketedStreamingResponse(answer, ticket, media_type="text/plain")
+    except BaseException:
+        if ticket is not None:
+            ticket.release()
+        raise
+
+
+# ============================================================================
+#   STREAMING SPEECH → ANSWER (WebSocket)
+# ============================================================================
+
+async def _send_partial(websocket: WebSocket, samples, last_text: list):
+    try:
+        result = await transcribe_partial(samples)
+    except STTBusy:
+        return
+    if result and result["text"] and result["text"] != last_text[0]:
+        last_text[0] = result["text"]
+        await websocket.send_json({"type": "partial", "text": result["text"]})
+
+
+async def _answer_over_ws(websocket: WebSocket, text: str, active_file: str | None, session_id: str | None):
+    try:
+        ticket = _admit_chat(active_file, text)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+        return
+
+    answer = ask_lumira_async(text, active_file, session_id=session_id, ticket=ticket)
+    try:
+        if active_file:
+            analytics.log_message(session_id, active_file, "user")
+            analytics.log_message(session_id, active_file, "ai")
+        async for chunk in answer:
+            await websocket.send_json({"type": "text", "data": chunk})
+    finally:
+        await answer.aclose()
+        # aclose() skips the generator's own cleanup if it never started
+        # (visitor hung up before the first chunk); release() is idempotent
+        if ticket is not None:
+            ticket.release()
+
+
+async def _close_with_error(websocket: WebSocket, status: int, detail: str, **extra):
+    try:
+        await websocket.send_json({"type": "error", "status": status, "detail": detail, **extra})
+        await websocket.close()
+    except (RuntimeError, WebSocketDisconnect):
+        pass   # the visitor is already gone
+
+
+@router.websocket("/ws/stt")
+async def speech_stream(websocket: WebSocket, active_file: str | None = None,
+                        session_id: str | None = None, sample_rate: int = 16000):
+    """Streaming voice query.
+
+    Client → server: binary frames of 16-bit mono PCM at `sample_rate`, and
+    optionally {"type": "end"} when the mic is released.
+    Server → client: {"type": "partial", "text"} while the visitor speaks,
+    {"type": "final", "text", "profile", ...} at end-of-speech (detected
+    from trailing silence, or the "end" message), then — when active_file is
+    given — the answer as {"type": "text", "data"} frames, and {"type": "done"}.
+    Retrieval starts from the last partial while the final decode runs.
+    """
+    await websocket.accept()
+    if sample_rate <= 0:
+        # 1003: the audio as described cannot be accepted
+        await websocket.close(code=1003, reason="sample_rate must be positive")
+        return
+    if not await asyncio.to_thread(load_profiles):
+        await _close_with_error(websocket, 503, "STT Offline")
+        return
+
+    utterance = UtteranceBuffer(sample_rate)
+    partial_task = None
+    last_partial = [""]
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                ended = utterance.feed(message["bytes"])
+            else:
+                try:
+                    ended = json.loads(message.get("text") or "{}").get("type") == "end"
+                except ValueError:
+                    ended = False
+            if ended:
+                break
+            if utterance.partial_due() and (partial_task is None or partial_task.done()):
+                partial_task = asyncio.create_task(
+                    _send_partial(websocket, utterance.partial_window(), last_partial)
+                )
+
+        # End-of-speech: a stale partial must not arrive after the final
+        if partial_task is not None:
+            partial_task.cancel()
+
+        # Retrieve for the last partial while the final decode runs; the
+        # answer joins it when the final transcript searches the same way
+        if active_file and last_partial[0] and _dataset_exists(active_file) and _is_qr_active(active_file):
+            start_retrieval(last_partial[0], active_file, session_id)
+
+        result = await transcribe_samples(utterance.samples())
+        print(f"📝 Streamed transcript [{result['profile']}, {result['audio_sec']}s audio, "
+              f"RTF {result['rtf']}]: {result['text']}")
+        await websocket.send_json({"type": "final", **result})
+
+        # Retrieval + generation start right away, on the same connection
+        if active_file and result["text"]:
+            await _answer_over_ws(websocket, result["text"], active_file, session_id)
+        await websocket.send_json({"type": "done"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except STTBusy as e:
+        await _close_with_error(websocket, 503, str(e), retry_after=e.retry_after)
+    except Exception as e:
+        print(f"STT Error: {e}")
+        await _close_with_error(websocket, 500, "Could not transcribe the audio")
+    finally:
+        if partial_task is not None:
+            partial_task.cancel()
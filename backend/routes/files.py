@@ -1,14 +1,17 @@
 import os
 import re
 import shutil
-import json
 import tempfile
 
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException
-from langchain_chroma import Chroma
-from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from fastapi import APIRouter, UploadFile, File, HTTPException
 
-from ingest import ingest_document
+from Utils.pdfvectorising import drop_project_collection
+from services.answer_cache import answer_cache
+from services.lexical_index import lexical_indexes
+from services.project_overview import project_overviews
+from services.ingest_jobs import ingestion_manager, IngestQueueFull
+from services.qr_state import QRStateStore
+import analytics
 
 router = APIRouter()
 
@@ -32,53 +35,46 @@ def _get_upload_dir() -> str:
 #   - active    : Event is live, visitors can chat
 #   - destroyed : Event is over, QR is permanently dead — nobody can access
 #
-# Backwards-compat: old boolean entries (True/False) are migrated on read.
+# Held in memory by services.qr_state (see there for refresh / atomic writes).
 
-_VALID_STATES = {"inactive", "active", "destroyed"}
-
-
-def _qr_status_path() -> str:
-    return os.path.join(_get_upload_dir(), ".qr_status.json")
+qr_store = QRStateStore(_get_upload_dir())
 
 
 def _load_qr_status() -> dict:
-    path = _qr_status_path()
-    if os.path.isfile(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-            # Migrate old boolean entries → string states
-            migrated = {}
-            for k, v in raw.items():
-                if v is True:
-                    migrated[k] = "active"
-                elif v is False:
-                    migrated[k] = "inactive"
-                elif v in _VALID_STATES:
-                    migrated[k] = v
-                else:
-                    migrated[k] = "inactive"
-            return migrated
-        except (json.JSONDecodeError, OSError):
-            pass
-    return {}
-
-
-def _save_qr_status(status: dict):
-    path = _qr_status_path()
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(status, f, indent=2)
+    return qr_store.snapshot()
 
 
 def _get_qr_state(filename: str) -> str:
     """Return the QR lifecycle state for a file. Default: 'inactive' for new files."""
-    status = _load_qr_status()
-    return status.get(filename, "inactive")
+    return qr_store.get(filename)
 
 
 def _is_qr_active(filename: str) -> bool:
     """Return True only if the file's QR is in 'active' state."""
-    return _get_qr_state(filename) == "active"
+    return qr_store.is_active(filename)
+
+
+def _dataset_exists(filename: str) -> bool:
+    """In-memory check that a dataset file exists (no stat per chat message)."""
+    return qr_store.dataset_exists(filename)
+
+
+def _queue_ingestion(filename: str) -> dict:
+    """Hand a saved dataset to the ingestion worker pool; returns the job record."""
+    try:
+        return ingestion_manager.submit(filename)
+    except IngestQueueFull as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": "30"})
+
+
+def _require_ingest_capacity():
+    """Reject an upload before saving it if the ingestion queue is already full."""
+    if not ingestion_manager.has_capacity():
+        raise HTTPException(
+            503,
+            "Too many documents are being ingested right now. Please try again shortly.",
+            headers={"Retry-After": "30"},
+        )
 
 
 def _sanitize_filename(filename: str) -> str:
@@ -119,17 +115,22 @@ def toggle_qr_status(filename: str):
     if not os.path.isfile(file_path):
         raise HTTPException(404, f"File \"{safe_name}\" not found.")
 
-    status = _load_qr_status()
-    current = status.get(safe_name, "inactive")
-
-    if current == "destroyed":
-        raise HTTPException(400, "This QR has been permanently destroyed and cannot be reactivated.")
+    def _toggle(current: str) -> str:
+        if current == "destroyed":
+            raise HTTPException(400, "This QR has been permanently destroyed and cannot be reactivated.")
+        return "active" if current == "inactive" else "inactive"
 
-    new_state = "active" if current == "inactive" else "inactive"
-    status[safe_name] = new_state
-    _save_qr_status(status)
+    new_state = qr_store.update(safe_name, _toggle)
     print(f"{'🟢' if new_state == 'active' else '🔴'} QR for {safe_name}: {new_state.upper()}")
-    return {"filename": safe_name, "qr_active": new_state == "active", "qr_state": new_state}
+
+    # Each activation window is one analytics event cycle
+    event_id = None
+    if new_state == "active":
+        event_id = analytics.open_event(safe_name)
+    else:
+        analytics.close_event(safe_name)
+    return {"filename": safe_name, "qr_active": new_state == "active", "qr_state": new_state,
+            "event_id": event_id}
 
 
 @router.post("/api/files/{filename}/destroy-qr")
@@ -142,9 +143,8 @@ def destroy_qr(filename: str):
     if not os.path.isfile(file_path):
         raise HTTPException(404, f"File \"{safe_name}\" not found.")
 
-    status = _load_qr_status()
-    status[safe_name] = "destroyed"
-    _save_qr_status(status)
+    qr_store.update(safe_name, lambda current: "destroyed")
+    analytics.close_event(safe_name)
     print(f"💀 QR DESTROYED for {safe_name} — permanently inaccessible")
     return {"filename": safe_name, "qr_active": False, "qr_state": "destroyed"}
 
@@ -160,19 +160,20 @@ def regenerate_qr(filename: str):
     if not os.path.isfile(file_path):
         raise HTTPException(404, f"File \"{safe_name}\" not found.")
 
-    status = _load_qr_status()
-    current = status.get(safe_name, "inactive")
-    if current != "destroyed":
-        raise HTTPException(400, "Only destroyed QRs can be regenerated.")
+    def _regenerate(current: str) -> str:
+        if current != "destroyed":
+            raise HTTPException(400, "Only destroyed QRs can be regenerated.")
+        return "inactive"
 
-    status[safe_name] = "inactive"
-    _save_qr_status(status)
+    qr_store.update(safe_name, _regenerate)
     print(f"♻️ QR REGENERATED for {safe_name} → inactive (ready for next event)")
     return {"filename": safe_name, "qr_active": False, "qr_state": "inactive"}
 
 
 @router.post("/api/upload")
-async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), replace: bool = False):
+    """Upload a dataset PDF. With ?replace=true an existing dataset is overwritten
+    and re-ingested incrementally — only changed chunks are re-embedded."""
     # --- Validate file extension ---
     if not file.filename:
         raise HTTPException(400, "No filename provided.")
@@ -189,10 +190,10 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
     file_path = os.path.join(upload_dir, safe_name)
 
     # --- Check for duplicates ---
-    if os.path.exists(file_path):
+    if os.path.exists(file_path) and not replace:
         raise HTTPException(
             409,
-            f"A file named \"{safe_name}\" already exists. Delete it first or rename your file."
+            f"A file named \"{safe_name}\" already exists. Delete it first, rename your file, or upload with replace=true."
         )
 
     # --- Read and validate file size ---
@@ -206,18 +207,22 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
     if len(content) == 0:
         raise HTTPException(400, "File is empty.")
 
+    _require_ingest_capacity()
+
     # --- Save file ---
     with open(file_path, "wb") as buffer:
         buffer.write(content)
+    qr_store.dataset_added(safe_name)
 
-    background_tasks.add_task(ingest_document, file_path)
-    return {"status": "File uploaded successfully", "filename": safe_name}
+    job = _queue_ingestion(safe_name)
+    return {"status": "File uploaded successfully", "filename": safe_name, "job_id": job["id"]}
 
 
 @router.get("/api/files")
 def list_files():
     upload_dir = _get_upload_dir()
     qr_status = _load_qr_status()
+    ingest_states = ingestion_manager.latest_states()
     try:
         file_list = []
         for f in os.listdir(upload_dir):
@@ -232,6 +237,7 @@ def list_files():
                 "status": "Active",
                 "qr_active": qr_status.get(f, "inactive") == "active",
                 "qr_state": qr_status.get(f, "inactive"),
+                "ingest_state": ingest_states.get(f, "indexed"),
             })
         return {"files": file_list}
     except Exception as e:
@@ -244,7 +250,6 @@ def delete_file(filename: str):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     safe_name = _sanitize_filename(filename)
     file_path = os.path.join(base_dir, "Dataset", safe_name)
-    db_path = os.path.join(base_dir, "chroma_db")
 
     # --- Check file exists ---
     if not os.path.exists(file_path):
@@ -253,19 +258,21 @@ def delete_file(filename: str):
     # --- Delete physical file ---
     try:
         os.remove(file_path)
+        qr_store.dataset_removed(safe_name)
     except OSError as e:
         print(f"❌ Failed to delete file: {e}")
         raise HTTPException(500, f"Failed to delete file: {e}")
 
     # --- Clean up vector store ---
-    try:
-        embeddings = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")
-        vector_store = Chroma(persist_directory=db_path, embedding_function=embeddings)
-        vector_store.delete(where={"source": file_path})
+    # The dataset's vectors are its whole collection; a failed drop is
+    # non-critical (logged) — the file is already deleted
+    if drop_project_collection(safe_name):
         print(f"✅ Deleted vectors for: {safe_name}")
-    except Exception as e:
-        # Vector cleanup is non-critical — file is already deleted
-        print(f"⚠️ Vector cleanup failed for {safe_name}: {e}")
+    lexical_indexes.drop(safe_name)
+    project_overviews.drop(safe_name)
+
+    answer_cache.invalidate(safe_name)
+    ingestion_manager.forget(safe_name)
 
     return {"status": "Deleted", "filename": safe_name}
 
@@ -326,10 +333,7 @@ def _convert_text_to_dataset_pdf(text: str, output_path: str, original_name: str
 
 
 @router.post("/api/convert")
-async def convert_document_to_dataset(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...)
-):
+async def convert_document_to_dataset(file: UploadFile = File(...)):
     """
     Upload any PDF / TXT / DOCX document.
     The backend extracts all text, wraps it into a clean PDF, saves it as a
@@ -367,6 +371,8 @@ async def convert_document_to_dataset(
             f'"{dataset_filename}" already exists. Delete it first or rename the source file.'
         )
 
+    _require_ingest_capacity()
+
     # Save original temporarily so we can extract text
     with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
         tmp.write(content)
@@ -381,15 +387,17 @@ async def convert_document_to_dataset(
 
         # 2. Write clean dataset PDF
         _convert_text_to_dataset_pdf(raw_text, output_path, base_name)
+        qr_store.dataset_added(dataset_filename)
         print(f"✅ Dataset PDF written: {output_path}")
 
-        # 3. Ingest into Chroma in the background
-        background_tasks.add_task(ingest_document, output_path)
+        # 3. Ingest into Chroma on the ingestion worker pool
+        job = _queue_ingestion(dataset_filename)
 
         return {
             "status": "converted",
             "dataset_filename": dataset_filename,
             "characters_extracted": len(raw_text),
+            "job_id": job["id"],
         }
 
     except HTTPException:
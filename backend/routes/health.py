@@ -1,4 +1,17 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from services.answer_cache import answer_cache
+from services.generation_scheduler import generation_scheduler
+from services.lexical_index import lexical_indexes
+from services.prefetch import prefetcher
+from services.project_overview import project_overviews
+from services.tts_cache import tts_cache
+from services import retrieval_pipeline
+from services import stt_service
+from services import warmup
+from Utils.pdfvectorising import query_cache_stats
+import analytics
 
 router = APIRouter()
 
@@ -6,3 +19,27 @@ router = APIRouter()
 @router.get("/api/health")
 def read_health():
     return {"status": "Lumira Backend Online"}
+
+
+@router.get("/api/health/ready")
+def read_readiness():
+    """Readiness probe: 200 once every required component is warm, 503 until then."""
+    report = warmup.readiness()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+@router.get("/api/health/stats")
+def read_stats():
+    """Runtime counters for the performance layers (what they buy us under expo load)."""
+    return {
+        "answer_cache": answer_cache.stats(),
+        "generation_scheduler": generation_scheduler.stats(),
+        "query_embedding_cache": query_cache_stats(),
+        "lexical_index": lexical_indexes.stats(),
+        "retrieval": retrieval_pipeline.stats(),
+        "project_overviews": project_overviews.stats(),
+        "follow_up_prefetch": prefetcher.stats(),
+        "tts_cache": tts_cache.stats(),
+        "stt": stt_service.stats(),
+        "analytics_writer": analytics.writer_stats(),
+    }
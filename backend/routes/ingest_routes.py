@@ -0,0 +1,23 @@
+from fastapi import APIRouter, HTTPException
+
+from services.ingest_jobs import ingestion_manager
+
+router = APIRouter()
+
+
+@router.get("/api/ingest/jobs")
+def list_ingest_jobs(filename: str | None = None):
+    """All ingestion jobs (newest first), optionally for one dataset."""
+    return {
+        "jobs": ingestion_manager.list_jobs(filename),
+        "pending": ingestion_manager.pending_count(),
+        "max_pending": ingestion_manager.max_pending,
+    }
+
+
+@router.get("/api/ingest/jobs/{job_id}")
+def get_ingest_job(job_id: str):
+    job = ingestion_manager.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Ingestion job \"{job_id}\" not found.")
+    return job
@@ -0,0 +1,170 @@
+"""
+answer_cache.py — Per-project semantic answer cache for Lumira.
+
+At a booth most visitors ask the same handful of questions. Instead of paying
+retrieval + llama3.2 generation every time, finished answers are stored per
+project together with the question embedding. A new question is served from
+the cache when its embedding is close enough to a cached one asked in the
+same classify_question() mode.
+
+The cache is dropped for a project whenever its vectors change (an
+ingestion job or delete_file). It lives in the server process, so a CLI
+ingest_document run cannot drop it.
+
+Only questions asked without conversation history are looked up or stored:
+the prompt includes the history, so "and the second one?" means something
+different in every session and its answer must never be shared.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# --- CONFIGURATION (override via .env) ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") != "0"
+# BGE-small also scores distinct questions that differ in one word ("login" /
+# "logout") high; benchmarks/answer_cache_threshold.py checks that none of
+# its distinct pairs reaches this before it is lowered
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93"))
+ANSWER_CACHE_MAX_PER_PROJECT = int(os.getenv("ANSWER_CACHE_MAX_PER_PROJECT", "64"))
+ANSWER_CACHE_TTL_SEC = float(os.getenv("ANSWER_CACHE_TTL_SEC", "3600"))
+
+# Elaborate answers build on the visitor's previous turn, so they are never shared.
+UNCACHEABLE_MODES = {"elaborate"}
+
+GLOBAL_KEY = "__global__"
+
+
+class _Entry:
+    __slots__ = ("question", "mode", "vector", "answer", "cost_sec", "created_at", "hits")
+
+    def __init__(self, question, mode, vector, answer, cost_sec):
+        self.question = question
+        self.mode = mode
+        self.vector = vector
+        self.answer = answer
+        self.cost_sec = cost_sec
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+def _normalize(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+class AnswerCache:
+    """Thread-safe semantic cache of finished answers, one LRU bucket per project."""
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD,
+                 max_per_project=ANSWER_CACHE_MAX_PER_PROJECT,
+                 ttl_sec=ANSWER_CACHE_TTL_SEC):
+        self.threshold = threshold
+        self.max_per_project = max_per_project
+        self.ttl_sec = ttl_sec
+        # {project: OrderedDict[question_key -> _Entry]}
+        self._buckets: dict[str, OrderedDict] = {}
+        self._lock = threading.Lock()
+
+        # --- Counters ---
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self.saved_sec = 0.0
+
+    @staticmethod
+    def _project_key(project: str | None) -> str:
+        return project or GLOBAL_KEY
+
+    def is_cacheable(self, mode: str, has_history: bool = False) -> bool:
+        """has_history: the session already has turns, which the answer depends on."""
+        return ANSWER_CACHE_ENABLED and mode not in UNCACHEABLE_MODES and not has_history
+
+    def lookup(self, project: str | None, mode: str, vector) -> str | None:
+        """Return a cached answer for a semantically equivalent question, or None."""
+        if not self.is_cacheable(mode):
+            return None
+
+        query = _normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(self._project_key(project))
+            best_key, best_entry, best_score = None, None, -1.0
+            if bucket:
+                for key, entry in list(bucket.items()):
+                    if now - entry.created_at > self.ttl_sec:
+                        del bucket[key]
+                        continue
+                    if entry.mode != mode:
+                        continue
+                    score = float(np.dot(query, entry.vector))
+                    if score > best_score:
+                        best_key, best_entry, best_score = key, entry, score
+
+            if best_entry is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+
+            bucket.move_to_end(best_key)
+            best_entry.hits += 1
+            self.hits += 1
+            self.saved_sec += best_entry.cost_sec
+            print(f"⚡ Answer cache hit ({best_score:.3f}): \"{best_entry.question[:60]}\"")
+            return best_entry.answer
+
+    def store(self, project: str | None, mode: str, question: str, vector,
+              answer: str, cost_sec: float):
+        """Remember a finished answer and how long it took to produce."""
+        if not self.is_cacheable(mode) or not answer.strip():
+            return
+
+        key = (mode, question.strip().lower())
+        entry = _Entry(question, mode, _normalize(vector), answer, cost_sec)
+        with self._lock:
+            bucket = self._buckets.setdefault(self._project_key(project), OrderedDict())
+            bucket[key] = entry
+            bucket.move_to_end(key)
+            while len(bucket) > self.max_per_project:
+                bucket.popitem(last=False)
+            self.stores += 1
+
+    def invalidate(self, project: str | None = None):
+        """Drop cached answers for a project (and the global bucket, which spans all projects).
+        With no project, the whole cache is cleared."""
+        with self._lock:
+            if project is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(self._project_key(project), None)
+                self._buckets.pop(GLOBAL_KEY, None)
+            self.invalidations += 1
+        print(f"🧹 Answer cache invalidated for: {project or 'ALL projects'}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "saved_latency_sec": round(self.saved_sec, 2),
+                "entries": {p: len(b) for p, b in self._buckets.items()},
+            }
+
+
+def replay(answer: str):
+    """Yield a cached answer word-by-word so the client sees the same stream shape."""
+    for i, word in enumerate(answer.split(" ")):
+        yield word if i == 0 else " " + word
+
+
+answer_cache = AnswerCache()
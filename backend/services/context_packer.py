@@ -0,0 +1,205 @@
+"""
+context_packer.py — Token-budgeted context packing for the llama3.2 prompt.
+
+The old step 8 joined up to 14 retrieved chunks (~2000 chars each) and sliced
+the result to 3000 characters, usually mid-sentence, throwing away most of
+what we had paid to embed and retrieve. Instead:
+
+  • every mode has a token budget for the Context block
+  • the 200-char overlap between neighbouring chunks is stripped
+  • near-duplicate chunks are dropped
+  • the highest-ranked chunks are packed WHOLE until the budget is full;
+    the first chunk that no longer fits is cut at a sentence end to fill
+    what is left, when that is still worth a few sentences
+  • retrieval_k() tells the retriever how many chunks can actually fit,
+    so we stop retrieving chunks we would discard
+
+Token counts use the real llama3.2 tokenizer when LLAMA_TOKENIZER_PATH points
+to its tokenizer.json (the `tokenizers` package is already a dependency);
+otherwise a conservative chars-per-token estimate is used.
+"""
+
+import math
+import os
+import re
+import threading
+
+# --- CONFIGURATION (override via .env) ---
+LLAMA_TOKENIZER_PATH = os.getenv("LLAMA_TOKENIZER_PATH", "")
+# English prose averages ~4 chars/token on llama3's tokenizer; 3.5 errs on the safe side
+CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "3.5"))
+# llama3.2's context window as requested from Ollama (bot.py passes it as num_ctx)
+LLM_NUM_CTX = int(os.getenv("LLM_NUM_CTX", "4096"))
+
+# Context-block budgets per classify_question() mode: at ~570 tokens per
+# 2000-char chunk, normal fits two whole chunks, the wider modes three and
+# summary four. The rest of the window goes to the template, up to 6 turns
+# of history and the answer.
+_DEFAULT_BUDGETS = {
+    "normal": 1200,
+    "elaborate": 1800,
+    "deep": 1800,
+    "comparison": 1800,
+    "summary": 2400,
+}
+TOKEN_BUDGETS = {
+    mode: int(os.getenv(f"CONTEXT_BUDGET_{mode.upper()}", str(default)))
+    for mode, default in _DEFAULT_BUDGETS.items()
+}
+
+# ingest.py splits with chunk_size=2000 / chunk_overlap=200
+CHUNK_CHARS = 2000
+CHUNK_OVERLAP_CHARS = 200
+MIN_OVERLAP_CHARS = 30
+NEAR_DUPLICATE_JACCARD = 0.8
+# Extra candidates so dedupe / oversize skips still leave enough to fill the budget
+RETRIEVAL_SLACK = 2
+# Smallest leftover budget worth filling with a sentence-trimmed partial chunk
+MIN_TAIL_TOKENS = 150
+
+
+# ============================================================================
+#   TOKEN COUNTING
+# ============================================================================
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                if LLAMA_TOKENIZER_PATH:
+                    try:
+                        from tokenizers import Tokenizer
+                        _tokenizer = Tokenizer.from_file(LLAMA_TOKENIZER_PATH)
+                        print(f"✅ Context packer using tokenizer: {LLAMA_TOKENIZER_PATH}")
+                    except Exception as e:
+                        print(f"⚠️ Could not load tokenizer ({e}), estimating tokens from length")
+                _tokenizer_loaded = True
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def budget_for(mode: str) -> int:
+    return TOKEN_BUDGETS.get(mode, TOKEN_BUDGETS["normal"])
+
+
+def retrieval_k(mode: str) -> int:
+    """How many chunks to retrieve so that what we retrieve is what fits."""
+    chunk_tokens = math.ceil(CHUNK_CHARS / CHARS_PER_TOKEN)
+    return max(1, budget_for(mode) // chunk_tokens) + RETRIEVAL_SLACK
+
+
+# ============================================================================
+#   DEDUPLICATION
+# ============================================================================
+
+def _strip_overlap(packed: list[str], text: str) -> str:
+    """Drop the head of `text` that repeats the tail of an already-packed chunk
+    (RecursiveCharacterTextSplitter's chunk_overlap)."""
+    best = 0
+    for prev in packed:
+        limit = min(len(prev), len(text), CHUNK_OVERLAP_CHARS * 2)
+        for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+            if size <= best:
+                break
+            if prev.endswith(text[:size]):
+                best = size
+                break
+    return text[best:].lstrip() if best else text
+
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def _is_near_duplicate(candidate: set, seen: list[set]) -> bool:
+    for other in seen:
+        union = len(candidate | other)
+        if union and len(candidate & other) / union >= NEAR_DUPLICATE_JACCARD:
+            return True
+    return False
+
+
+def _trim_to_sentences(text: str, budget: int, strict: bool = False) -> str:
+    """Cut at a sentence end to fit the budget. Unless strict, falls back to a
+    hard cut when not even the first sentence fits (top chunk larger than the budget)."""
+    sentences = re.split(r"(?<=[.!?])\s+", text)
+    out = ""
+    for sentence in sentences:
+        candidate = f"{out} {sentence}".strip()
+        if count_tokens(candidate) > budget:
+            break
+        out = candidate
+    if strict:
+        return out
+    return out or text[:int(budget * CHARS_PER_TOKEN)]
+
+
+# ============================================================================
+#   PACKING
+# ============================================================================
+
+def pack_context(docs, mode: str) -> tuple[str, dict]:
+    """Pack retrieved docs (best first) into the mode's token budget.
+
+    Returns (context_text, stats).
+    """
+    budget = budget_for(mode)
+    packed: list[str] = []
+    seen_shingles: list[set] = []
+    used = 0
+    dropped_duplicates = 0
+    skipped_oversize = 0
+    trimmed = 0
+
+    for doc in docs:
+        text = _strip_overlap(packed, doc.page_content.strip())
+        if not text:
+            dropped_duplicates += 1
+            continue
+
+        shingles = _shingles(text)
+        if _is_near_duplicate(shingles, seen_shingles):
+            dropped_duplicates += 1
+            continue
+
+        tokens = count_tokens(text)
+        if used + tokens > budget:
+            # Fill a worthwhile remainder with this chunk's leading sentences
+            tail = _trim_to_sentences(text, budget - used, strict=True) if budget - used >= MIN_TAIL_TOKENS else ""
+            if not tail:
+                skipped_oversize += 1
+                continue
+            text, tokens = tail, count_tokens(tail)
+            trimmed += 1
+
+        packed.append(text)
+        seen_shingles.append(shingles)
+        used += tokens
+
+    if not packed and docs:
+        packed.append(_trim_to_sentences(docs[0].page_content.strip(), budget))
+        used = count_tokens(packed[0])
+
+    stats = {
+        "retrieved": len(docs),
+        "packed": len(packed),
+        "duplicates": dropped_duplicates,
+        "skipped": skipped_oversize,
+        "trimmed": trimmed,
+        "tokens": used,
+        "budget": budget,
+    }
+    return "\n\n".join(packed), stats
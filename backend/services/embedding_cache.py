@@ -0,0 +1,110 @@
+"""
+embedding_cache.py — Bounded LRU of query text → embedding vector.
+
+The frontend sends the same strings over and over ("Tell me more about that.",
+suggested questions), and every retrieval used to re-embed them with
+BGE-small. On CPU-only booth laptops that is a measurable slice of
+time-to-first-token.
+
+CachedQueryEmbeddings wraps the shared FastEmbedEmbeddings instance, so every
+embed_query caller — Chroma retrieval through the vector store, the answer
+cache, anything else using get_embeddings() — shares one cache. Document
+embedding (ingestion) passes straight through.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.config import run_in_executor
+
+# --- CONFIGURATION (override via .env) ---
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "1024"))
+QUERY_EMBED_CACHE_TTL_SEC = float(os.getenv("QUERY_EMBED_CACHE_TTL_SEC", "3600"))
+
+
+def _normalize(text: str) -> str:
+    """Case / whitespace-insensitive key: "Tell me more " == "tell me  more"."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class CachedQueryEmbeddings(Embeddings):
+
+    def __init__(self, inner: Embeddings, max_size: int = QUERY_EMBED_CACHE_SIZE,
+                 ttl_sec: float = QUERY_EMBED_CACHE_TTL_SEC):
+        self.inner = inner
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        # {normalized text: (created_at, vector)}
+        self._cache: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        # --- Counters ---
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- CACHE ----------
+
+    def _get(self, key: str) -> list[float] | None:
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None and time.monotonic() - item[0] <= self.ttl_sec:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._cache[key]
+            self.misses += 1
+            return None
+
+    def _put(self, key: str, vector: list[float]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = (time.monotonic(), vector)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    # ---------- EMBEDDINGS INTERFACE ----------
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = _normalize(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self.inner.embed_query(text)
+            self._put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = _normalize(text)
+        vector = self._get(key)
+        if vector is None:
+            # Only a miss pays the threadpool hop for the ONNX call
+            vector = await run_in_executor(None, self.inner.embed_query, text)
+            self._put(key, vector)
+        return vector
+
+    # ---------- METRICS ----------
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "max_size": self.max_size,
+                "ttl_sec": self.ttl_sec,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
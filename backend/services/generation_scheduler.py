@@ -0,0 +1,329 @@
+"""
+generation_scheduler.py — Admission control + fair scheduling for LLM generations.
+
+Every project shares the single OllamaLLM instance in bot.py. Without ordering,
+one busy booth can starve every other project and overload only shows up as
+timeouts. This scheduler sits between /api/chat and chain.astream:
+
+  • a global concurrency cap matched to Ollama's parallel slots (OLLAMA_NUM_PARALLEL)
+  • per-project FIFO queues served round-robin, so each booth gets its turn
+  • cheap "normal" answers go before summary/deep/comparison/elaborate,
+    with aging so expensive modes are never starved
+  • fast back-pressure: 429 when one project's queue is full, 503 when the
+    whole server is, both with a Retry-After estimate
+  • queue wait and generation time are tracked separately
+  • background work (e.g. project overviews) gets its own priority class:
+    it only starts when no visitor is queued, at most
+    LLM_BACKGROUND_CONCURRENCY at a time, and never counts towards shedding
+
+All state lives on the event loop thread, so no locks are needed. Worker
+threads go through run_background(), which hops onto the loop.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+# --- CONFIGURATION (override via .env) ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", os.getenv("OLLAMA_NUM_PARALLEL", "4")))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_MAX_QUEUE_PER_PROJECT = int(os.getenv("LLM_MAX_QUEUE_PER_PROJECT", "12"))
+LLM_PRIORITY_AGING_SEC = float(os.getenv("LLM_PRIORITY_AGING_SEC", "8"))
+LLM_BACKGROUND_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_CONCURRENCY", "1"))
+
+HIGH, LOW, BACKGROUND = 0, 1, 2
+CHEAP_MODES = {"normal"}
+BACKGROUND_MODE = "background"
+_DEFAULT_GENERATION_SEC = 6.0
+
+
+class SchedulerOverloaded(Exception):
+    """Raised at admission time when a request should be shed instead of queued."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _Timings:
+    """Count / mean / max / p95 over a rolling window of durations."""
+
+    def __init__(self, window: int = 500):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self) -> dict:
+        recent = sorted(self.recent)
+        p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+        return {
+            "count": self.count,
+            "avg_sec": round(self.mean, 3),
+            "p95_sec": round(p95, 3),
+            "max_sec": round(self.max, 3),
+        }
+
+
+class GenerationTicket:
+    """A request's place in line. Admit → acquire() before generating → release() when done."""
+
+    def __init__(self, scheduler: "GenerationScheduler", project: str, mode: str):
+        self._scheduler = scheduler
+        self.project = project
+        self.mode = mode
+        if mode == BACKGROUND_MODE:
+            self.priority = BACKGROUND
+        else:
+            self.priority = HIGH if mode in CHEAP_MODES else LOW
+        self.state = "admitted"   # admitted → queued → running → done
+        self.enqueued_at = 0.0
+        self.started_at = 0.0
+        self._future: asyncio.Future | None = None
+
+    async def acquire(self):
+        await self._scheduler._acquire(self)
+
+    def release(self):
+        self._scheduler._release(self)
+
+    @property
+    def background(self) -> bool:
+        return self.priority == BACKGROUND
+
+
+class GenerationScheduler:
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                 max_queue_per_project=LLM_MAX_QUEUE_PER_PROJECT,
+                 aging_sec=LLM_PRIORITY_AGING_SEC, background_concurrency=LLM_BACKGROUND_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_queue_per_project = max_queue_per_project
+        self.aging_sec = aging_sec
+        self.background_concurrency = max(1, background_concurrency)
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._running = 0
+        self._background_running = 0
+        # Admitted but not yet running, per project (used for shedding)
+        self._waiting: dict[str, int] = {}
+        # {priority: OrderedDict[project -> deque[ticket]]} — rotation gives round-robin
+        self._queues = {HIGH: OrderedDict(), LOW: OrderedDict(), BACKGROUND: OrderedDict()}
+
+        # --- Counters ---
+        self.admitted = 0
+        self.background_runs = 0
+        self.shed_429 = 0
+        self.shed_503 = 0
+        self.queue_wait = _Timings()
+        self.generation = _Timings()
+
+    # ---------- ADMISSION ----------
+
+    @property
+    def waiting(self) -> int:
+        return sum(self._waiting.values())
+
+    def has_spare_slot(self) -> bool:
+        """A generation could start right now without delaying any visitor."""
+        return self._running < self.max_concurrency and not self.waiting
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop | None):
+        """The server's event loop (set in the lifespan), for run_background()."""
+        self._loop = loop
+
+    def _retry_after(self) -> int:
+        per_slot = self.generation.mean or _DEFAULT_GENERATION_SEC
+        estimate = per_slot * (self.waiting + 1) / self.max_concurrency
+        return max(1, min(60, math.ceil(estimate)))
+
+    def admit(self, project: str | None, mode: str) -> GenerationTicket:
+        """Reserve a place in line or raise SchedulerOverloaded immediately."""
+        project = project or "__global__"
+
+        if self.waiting >= self.max_queue:
+            self.shed_503 += 1
+            raise SchedulerOverloaded(
+                503, "Lumira is very busy right now. Please try again in a moment.", self._retry_after()
+            )
+        if self._waiting.get(project, 0) >= self.max_queue_per_project:
+            self.shed_429 += 1
+            raise SchedulerOverloaded(
+                429, "Lots of visitors are asking about this project. Please try again in a moment.",
+                self._retry_after()
+            )
+
+        self._waiting[project] = self._waiting.get(project, 0) + 1
+        self.admitted += 1
+        return GenerationTicket(self, project, mode)
+
+    def _unwait(self, project: str):
+        left = self._waiting.get(project, 0) - 1
+        if left > 0:
+            self._waiting[project] = left
+        else:
+            self._waiting.pop(project, None)
+
+    # ---------- SCHEDULING ----------
+
+    def _queued(self) -> bool:
+        """Visitors are waiting for a slot (queued background work doesn't count)."""
+        return any(self._queues[HIGH]) or any(self._queues[LOW])
+
+    def _can_start(self, ticket: GenerationTicket) -> bool:
+        if self._running >= self.max_concurrency or self._queued():
+            return False
+        return not ticket.background or self._background_running < self.background_concurrency
+
+    def _grant(self, ticket: GenerationTicket):
+        self._running += 1
+        ticket.state = "running"
+        ticket.started_at = time.monotonic()
+        if ticket.background:
+            self._background_running += 1
+            self.background_runs += 1
+        else:
+            self._unwait(ticket.project)
+            self.queue_wait.add(ticket.started_at - ticket.enqueued_at)
+
+    async def _acquire(self, ticket: GenerationTicket):
+        if ticket.state != "admitted":
+            return
+        ticket.enqueued_at = time.monotonic()
+
+        # Fast path: a slot is free and nobody is ahead of us
+        if self._can_start(ticket):
+            self._grant(ticket)
+            return
+
+        ticket.state = "queued"
+        ticket._future = asyncio.get_running_loop().create_future()
+        self._queues[ticket.priority].setdefault(ticket.project, deque()).append(ticket)
+        try:
+            await ticket._future
+        except asyncio.CancelledError:
+            if ticket.state == "queued":
+                self._remove_queued(ticket)
+            raise
+
+    def _remove_queued(self, ticket: GenerationTicket):
+        projects = self._queues[ticket.priority]
+        line = projects.get(ticket.project)
+        if line and ticket in line:
+            line.remove(ticket)
+            if not line:
+                del projects[ticket.project]
+        if not ticket.background:
+            self._unwait(ticket.project)
+        ticket.state = "done"
+
+    def _pop_next(self) -> GenerationTicket | None:
+        high, low = self._queues[HIGH], self._queues[LOW]
+
+        # Aging: an expensive request that waited too long jumps the cheap line
+        order = (high, low)
+        if low:
+            oldest = min(line[0].enqueued_at for line in low.values())
+            if time.monotonic() - oldest >= self.aging_sec:
+                order = (low, high)
+        # Background work only gets the slots visitors leave idle
+        if not high and not low and self._background_running < self.background_concurrency:
+            order = (self._queues[BACKGROUND],)
+
+        for projects in order:
+            if not projects:
+                continue
+            project, line = next(iter(projects.items()))
+            ticket = line.popleft()
+            del projects[project]
+            if line:
+                projects[project] = line   # re-insert at the back → round-robin
+            return ticket
+        return None
+
+    def _dispatch(self):
+        while self._running < self.max_concurrency:
+            ticket = self._pop_next()
+            if ticket is None:
+                return
+            self._grant(ticket)
+            if not ticket._future.done():
+                ticket._future.set_result(True)
+
+    def _release(self, ticket: GenerationTicket):
+        if ticket.state == "running":
+            self._running -= 1
+            if ticket.background:
+                self._background_running -= 1
+            else:
+                self.generation.add(time.monotonic() - ticket.started_at)
+            ticket.state = "done"
+            self._dispatch()
+        elif ticket.state == "admitted":
+            # Never needed a slot (small talk, cache hit, empty context)
+            if not ticket.background:
+                self._unwait(ticket.project)
+            ticket.state = "done"
+        elif ticket.state == "queued":
+            self._remove_queued(ticket)
+
+    # ---------- BACKGROUND WORK ----------
+
+    def run_background(self, project: str, fn):
+        """Run a blocking LLM call fn() from a worker thread, holding a
+        background slot for its duration. Without a running server (CLI
+        ingest) there is nobody to yield to and fn() runs directly."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return fn()
+        ticket = GenerationTicket(self, project, BACKGROUND_MODE)
+        asyncio.run_coroutine_threadsafe(ticket.acquire(), loop).result()
+        try:
+            return fn()
+        finally:
+            try:
+                loop.call_soon_threadsafe(ticket.release)
+            except RuntimeError:
+                pass   # loop already closed — the slot went with it
+
+    def close(self):
+        """Shutdown: background jobs still waiting for a slot give up."""
+        self._loop = None
+        waiting = [ticket for line in self._queues[BACKGROUND].values() for ticket in line]
+        for ticket in waiting:
+            ticket._future.cancel()
+
+    # ---------- METRICS ----------
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "background_running": self._background_running,
+            "background_runs": self.background_runs,
+            "waiting": self.waiting,
+            "waiting_per_project": dict(self._waiting),
+            "admitted": self.admitted,
+            "shed_429": self.shed_429,
+            "shed_503": self.shed_503,
+            "queue_wait": self.queue_wait.summary(),
+            "generation": self.generation.summary(),
+        }
+
+
+generation_scheduler = GenerationScheduler()
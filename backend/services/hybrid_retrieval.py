@@ -0,0 +1,62 @@
+"""
+hybrid_retrieval.py — Vector + BM25 retrieval fused with reciprocal-rank fusion.
+
+Both rankers over-fetch candidates from the project's own collection /
+lexical index (services.retrieval_pipeline sizes this per mode); every chunk then scores Σ 1 / (HYBRID_RRF_K + rank)
+over the rankings it appears in. RRF needs no score calibration between
+cosine distances and BM25 scores, and a chunk both rankers agree on rises to
+the top — so the few chunks the prompt budget can hold are the right ones.
+"""
+
+import os
+
+from langchain_core.documents import Document
+
+from services.lexical_index import lexical_indexes
+from Utils.pdfvectorising import get_project_vectorstore
+
+# --- CONFIGURATION (override via .env) ---
+HYBRID_ENABLED = os.getenv("HYBRID_ENABLED", "true").lower() == "true"
+# Candidates taken from each ranker by hybrid_search (benchmarks)
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+# RRF damping constant (60 is the value from the original RRF paper)
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], rrf_k: int = HYBRID_RRF_K) -> list[tuple[str, float]]:
+    """Fuse ranked ID lists (best first) into one (ID, RRF score) ranking, best first."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def vector_candidates(filename: str, query: str, fetch_k: int) -> list[Document]:
+    return get_project_vectorstore(filename).similarity_search(query, k=fetch_k)
+
+
+def lexical_candidates(filename: str, query: str, fetch_k: int) -> list[str]:
+    return [chunk for chunk, _ in lexical_indexes.search(
+        filename, query, fetch_k, vector_store=get_project_vectorstore(filename))]
+
+
+def hybrid_search(filename: str, query: str, k: int, fetch_k: int = HYBRID_FETCH_K) -> list[Document]:
+    """Top-k chunks of one dataset by fused vector + BM25 rank."""
+    fetch_k = max(fetch_k, k)
+    vector_docs = vector_candidates(filename, query, fetch_k)
+    by_id = {doc.id: doc for doc in vector_docs if doc.id}
+    lexical_ids = lexical_candidates(filename, query, fetch_k)
+
+    fused = reciprocal_rank_fusion([[doc.id for doc in vector_docs if doc.id], lexical_ids])
+    fused = [chunk for chunk, _ in fused[:k]]
+
+    # Keyword-only hits were never returned by the vector search: fetch their text
+    missing = [chunk for chunk in fused if chunk not in by_id]
+    if missing:
+        rows = get_project_vectorstore(filename)._collection.get(
+            ids=missing, include=["documents", "metadatas"])
+        for chunk, text, metadata in zip(rows["ids"], rows["documents"], rows["metadatas"]):
+            by_id[chunk] = Document(id=chunk, page_content=text or "", metadata=metadata or {})
+    return [by_id[chunk] for chunk in fused if chunk in by_id]
+
@@ -0,0 +1,354 @@
+"""
+ingest_jobs.py — Persistent ingestion job queue backed by warm worker processes.
+
+Uploads no longer run ingest_document on FastAPI BackgroundTasks inside the
+chat server. Instead each upload becomes a job:
+
+    queued → parsing → embedding → indexed
+                                 ↘ failed
+
+  • Parsing + embedding (the CPU-heavy part) runs in a small process pool.
+    Each worker loads the BGE-small model once and keeps it warm, with the
+    CPU cores split between the workers' ONNX threads.
+  • Embedded batches stream back and are written to Chroma from this process,
+    on a single indexer thread, while the worker embeds the next batch. The
+    chat server's vector store sees them immediately and Chroma only ever
+    has one writer.
+  • Chunk IDs are content hashes: only new chunks are embedded and vanished
+    ones deleted, so re-ingesting an edited dataset costs seconds.
+  • Each job reports chunks/sec and the worker's peak RSS while it ran.
+  • Job state is persisted to ingest_jobs.json on every state change (page /
+    chunk progress is kept in memory only), so unfinished jobs are resumed
+    after a restart.
+  • submit() only records the job: the Chroma read for already-embedded
+    chunks and the hand-off to a worker run on the indexer thread, so the
+    upload routes never block the event loop on Chroma.
+  • The queue is bounded: bulk uploads get fast back-pressure instead of
+    stalling the server.
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# --- CONFIGURATION (override via .env) ---
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "32"))
+# ONNX threads per worker; 0 = split the CPU cores evenly between the workers
+INGEST_EMBED_THREADS = int(os.getenv("INGEST_EMBED_THREADS", "0"))
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_DATASET_DIR = os.path.join(_BASE_DIR, "Dataset")
+JOBS_PATH = os.path.join(_BASE_DIR, "ingest_jobs.json")
+
+ACTIVE_STATES = {"queued", "parsing", "embedding"}
+TERMINAL_STATES = {"indexed", "failed"}
+
+
+class IngestQueueFull(Exception):
+    """Raised when too many ingestion jobs are already waiting."""
+
+
+# ============================================================================
+#   WORKER PROCESS SIDE
+# ============================================================================
+
+_events = None   # multiprocessing queue back to the server process
+
+
+def _worker_init(events, threads):
+    """Runs once per worker process: keep the embedding model warm for every job."""
+    global _events
+    _events = events
+    # Ingestion is background work — let the chat server win CPU contention
+    if hasattr(os, "nice"):
+        try:
+            os.nice(5)
+        except OSError:
+            pass
+
+    try:
+        import ingest
+        ingest.get_embeddings(threads)
+    except Exception as e:
+        # Don't break the pool — the job itself will retry the load and report failure
+        print(f"⚠️ Ingestion worker could not preload the embedding model: {e}")
+
+
+def _worker_run(job_id: str, file_path: str, skip_ids: frozenset) -> dict:
+    """Embed a document's new chunks, streaming each batch back so the server
+    writes batch N to Chroma while this worker embeds batch N+1."""
+    import ingest
+
+    def on_progress(**fields):
+        _events.put((job_id, "progress", fields))
+
+    def on_batch(batch):
+        _events.put((job_id, "batch", batch))
+
+    stats = ingest.embed_document(file_path, on_batch, on_progress, skip_ids)
+    # Sent on the same queue as the batches, so it is handled after the last write
+    _events.put((job_id, "done", stats))
+    return stats
+
+
+# ============================================================================
+#   SERVER PROCESS SIDE
+# ============================================================================
+
+class IngestionManager:
+
+    def __init__(self, workers=INGEST_WORKERS, max_pending=INGEST_MAX_PENDING, jobs_path=JOBS_PATH):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.jobs_path = jobs_path
+
+        self._jobs: dict[str, dict] = {}
+        self._lock = threading.RLock()
+        self._pool: ProcessPoolExecutor | None = None
+        self._indexer: ThreadPoolExecutor | None = None
+        self._ctx = None
+        self._events = None
+        self._listener: threading.Thread | None = None
+
+    # ---------- PERSISTENCE ----------
+
+    def _load(self):
+        if not os.path.isfile(self.jobs_path):
+            return
+        try:
+            with open(self.jobs_path, "r", encoding="utf-8") as f:
+                self._jobs = {j["id"]: j for j in json.load(f)}
+        except (json.JSONDecodeError, OSError, KeyError, TypeError):
+            print(f"⚠️ Could not read {self.jobs_path}, starting with an empty job list")
+            self._jobs = {}
+
+    def _save(self):
+        tmp_path = f"{self.jobs_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self._jobs.values()), f, indent=2)
+        os.replace(tmp_path, self.jobs_path)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] in TERMINAL_STATES:
+                return
+            changed = "state" in fields and fields["state"] != job["state"]
+            job.update(fields)
+            job["updated_at"] = time.time()
+            # Progress events arrive per batch; a restart resets progress anyway
+            if changed:
+                self._save()
+
+    # ---------- LIFECYCLE ----------
+
+    def start(self):
+        """Start the worker pool and resume any job a previous run left unfinished."""
+        with self._lock:
+            if self._pool is not None:
+                return
+            self._ctx = multiprocessing.get_context("spawn")
+            self._events = self._ctx.Queue()
+            self._pool = self._new_pool()
+            self._indexer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-indexer")
+            self._listener = threading.Thread(target=self._listen, name="ingest-events", daemon=True)
+            self._listener.start()
+
+            self._load()
+            resumed = [j for j in self._jobs.values() if j["state"] in ACTIVE_STATES]
+            for job in sorted(resumed, key=lambda j: j["created_at"]):
+                print(f"♻️ Resuming ingestion job {job['id']} ({job['filename']})")
+                job.update(state="queued", chunks_done=0, updated_at=time.time())
+                self._indexer.submit(self._dispatch, job["id"])
+            self._save()
+        print(f"✅ Ingestion pool ready ({self.workers} workers)")
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        threads = INGEST_EMBED_THREADS or max(1, (os.cpu_count() or 1) // self.workers)
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._ctx,
+            initializer=_worker_init,
+            initargs=(self._events, threads),
+        )
+
+    def shutdown(self):
+        """Stop accepting work. Unfinished jobs stay persisted and resume on next start."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            if pool is None:
+                return
+        pool.shutdown(wait=False, cancel_futures=True)
+        # Outside the lock: queued indexer work (writes, dispatches) takes it
+        self._indexer.shutdown(wait=True)
+        self._events.put(None)
+
+    def _listen(self):
+        """Apply events sent by worker processes. Progress is recorded here;
+        Chroma writes are handed to the single indexer thread, in order."""
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            job_id, kind, data = event
+            if kind == "progress":
+                self._update(job_id, **data)
+            elif self._indexer is not None:
+                self._indexer.submit(self._index_event, job_id, kind, data)
+
+    # ---------- JOBS ----------
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j["state"] in ACTIVE_STATES)
+
+    def has_capacity(self) -> bool:
+        return self.pending_count() < self.max_pending
+
+    def submit(self, filename: str) -> dict:
+        """Queue a dataset in Dataset/ for ingestion and return its job record."""
+        self.start()
+        with self._lock:
+            if not self.has_capacity():
+                raise IngestQueueFull(
+                    f"{self.max_pending} documents are already being ingested. Try again shortly."
+                )
+            now = time.time()
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "filename": filename,
+                "state": "queued",
+                "pages": 0,
+                "chunks_total": 0,
+                "chunks_done": 0,
+                "error": None,
+                "chunks_embedded": None,
+                "chunks_removed": None,
+                "embed_sec": None,
+                "chunks_per_sec": None,
+                "peak_rss_mb": None,
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._jobs[job["id"]] = job
+            self._save()
+            self._indexer.submit(self._dispatch, job["id"])
+            print(f"📥 Queued ingestion job {job['id']} for {filename}")
+            return dict(job)
+
+    def _dispatch(self, job_id: str):
+        """Indexer thread: hand a queued job to a worker process. Reading the
+        existing vectors can load the embedding model on a cold start, which
+        is why this never runs on the request path."""
+        job = self.get(job_id)
+        if job is None or job["state"] in TERMINAL_STATES:
+            return
+        file_path = os.path.join(_DATASET_DIR, job["filename"])
+        # Chunks already in Chroma (same content hash) are not embedded again
+        try:
+            from ingest import existing_ids
+            from Utils.pdfvectorising import get_project_vectorstore
+            skip_ids = frozenset(existing_ids(get_project_vectorstore(job["filename"])))
+        except Exception as e:
+            print(f"⚠️ Could not read existing vectors for {job['filename']}, re-embedding all: {e}")
+            skip_ids = frozenset()
+
+        with self._lock:
+            if self._pool is None:
+                return   # shutting down — the job resumes on next start
+            try:
+                future = self._pool.submit(_worker_run, job_id, file_path, skip_ids)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM on a huge PDF) — replace the pool and retry once
+                print("⚠️ Ingestion pool was broken, restarting workers")
+                self._pool = self._new_pool()
+                future = self._pool.submit(_worker_run, job_id, file_path, skip_ids)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+
+    def _on_done(self, job_id: str, future):
+        """Success is handled by the worker's "done" event; this only catches failures."""
+        indexer = self._indexer
+        if self._pool is None or indexer is None or future.cancelled():
+            return   # shutting down — the job resumes on next start
+        error = future.exception()
+        if error is not None:
+            indexer.submit(self._fail, job_id, error)
+
+    def _fail(self, job_id: str, error: Exception):
+        print(f"❌ Ingestion job {job_id} failed: {error}")
+        self._update(job_id, state="failed", error=str(error))
+
+    def _index_event(self, job_id: str, kind: str, data: dict):
+        """Indexer thread: write embedded batches into Chroma and close the job."""
+        job = self.get(job_id)
+        if job is None or job["state"] in TERMINAL_STATES:
+            return
+        try:
+            from ingest import write_batch, remove_vanished
+            from Utils.pdfvectorising import get_project_vectorstore
+            vectorstore = get_project_vectorstore(job["filename"])
+
+            if kind == "batch":
+                write_batch(vectorstore, data)
+                return
+
+            # kind == "done": every batch before it has been written
+            removed = remove_vanished(vectorstore, os.path.join(_DATASET_DIR, job["filename"]), data["ids"])
+            # Keyword index over exactly the chunks now in the collection
+            from services.lexical_index import lexical_indexes
+            lexical_indexes.rebuild(job["filename"], vectorstore)
+            # Overview answers are regenerated in the background (no-op if unchanged)
+            from services.project_overview import project_overviews
+            project_overviews.schedule(job["filename"], vectorstore)
+        except Exception as e:
+            self._fail(job_id, e)
+            return
+
+        self._update(job_id, state="indexed", pages=data["pages"],
+                     chunks_total=data["chunks"], chunks_done=data["chunks"],
+                     chunks_embedded=data["chunks_embedded"], chunks_removed=removed,
+                     embed_sec=data["embed_sec"], chunks_per_sec=data["chunks_per_sec"],
+                     peak_rss_mb=data["peak_rss_mb"])
+        if data["chunks_embedded"] or removed:
+            # Cached answers for this project were built from the old vectors
+            from services.answer_cache import answer_cache
+            answer_cache.invalidate(job["filename"])
+        print(f"✅ Successfully ingested {job['filename']} (job {job_id}: "
+              f"{data['chunks_embedded']} embedded, {removed} removed)")
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self, filename: str | None = None) -> list[dict]:
+        with self._lock:
+            jobs = [dict(j) for j in self._jobs.values()
+                    if filename is None or j["filename"] == filename]
+        return sorted(jobs, key=lambda j: j["created_at"], reverse=True)
+
+    def latest_states(self) -> dict:
+        """{filename: state of its most recent job} — used by the file list."""
+        states = {}
+        for job in reversed(self.list_jobs()):
+            states[job["filename"]] = job["state"]
+        return states
+
+    def forget(self, filename: str):
+        """Drop finished job records for a deleted dataset."""
+        with self._lock:
+            stale = [jid for jid, j in self._jobs.items()
+                     if j["filename"] == filename and j["state"] in TERMINAL_STATES]
+            for jid in stale:
+                del self._jobs[jid]
+            if stale:
+                self._save()
+
+
+ingestion_manager = IngestionManager()
@@ -0,0 +1,201 @@
+"""
+lexical_index.py — Per-project BM25 index over the ingested chunks.
+
+Booth questions are full of exact project terms: acronyms, component and
+model names ("STT", "ingest_jobs", "llama3.2"). BGE-small embeds those
+loosely, so pure vector search often ranks the chunk that actually names the
+term below chunks that are merely "about the same thing". A keyword ranking
+catches them; services.hybrid_retrieval fuses both.
+
+  • one index per dataset, built from the chunks in its Chroma collection
+    when an ingestion job finishes (same chunks, same IDs)
+  • persisted as JSON in LEXICAL_INDEX_DIR (next to chroma_db), loaded on
+    first use; a missing file (e.g. right after the collection migration) is
+    rebuilt from the collection
+  • pure Python Okapi BM25 — no new dependency, and a few thousand 2000-char
+    chunks score in well under a millisecond per query term
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from Utils.pdfvectorising import collection_name
+
+# --- CONFIGURATION (override via .env) ---
+LEXICAL_INDEX_DIR = os.getenv(
+    "LEXICAL_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lexical_index"),
+)
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+INDEX_VERSION = 1
+_READ_BATCH = 1000
+
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i in is it its "
+    "me my of on or our so that the their them there these they this to was we what "
+    "when where which who why will with you your".split()
+)
+# Words plus the joined forms people type: stt_service, llama3.2, gpt-4o, v1.5
+_TERM_RE = re.compile(r"[a-z0-9]+(?:[._\-/][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased terms. A joined term also yields its parts, so "stt_service"
+    matches both "stt_service" and a question that just says "stt"."""
+    terms = []
+    for term in _TERM_RE.findall(text.lower()):
+        parts = re.split(r"[._\-/]", term)
+        if len(parts) > 1:
+            terms.append(term)
+        terms.extend(p for p in parts if p and p not in _STOPWORDS)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over one dataset's chunks."""
+
+    def __init__(self, ids: list[str], term_freqs: list[dict[str, int]]):
+        self.ids = ids
+        self.term_freqs = term_freqs
+        self.lengths = [sum(tf.values()) for tf in term_freqs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+        # term → [(chunk position, tf)]
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        for position, tf in enumerate(term_freqs):
+            for term, count in tf.items():
+                self.postings.setdefault(term, []).append((position, count))
+        total = len(ids)
+        self.idf = {
+            term: math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    @classmethod
+    def from_texts(cls, ids: list[str], texts: list[str]) -> "BM25Index":
+        return cls(ids, [dict(Counter(tokenize(text))) for text in texts])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """Top-k (chunk ID, BM25 score), best first. Chunks sharing no term are never returned."""
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for position, tf in posting:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[position] / (self.avg_length or 1.0))
+                scores[position] = scores.get(position, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[position], score) for position, score in best]
+
+    def to_dict(self) -> dict:
+        return {"version": INDEX_VERSION, "ids": self.ids, "term_freqs": self.term_freqs}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"lexical index version {data.get('version')} != {INDEX_VERSION}")
+        return cls(data["ids"], data["term_freqs"])
+
+
+class LexicalIndexStore:
+    """Loaded BM25 indexes, one per dataset, backed by LEXICAL_INDEX_DIR."""
+
+    def __init__(self, directory: str = LEXICAL_INDEX_DIR):
+        self.directory = directory
+        self._indexes: dict[str, BM25Index] = {}
+        self._lock = threading.Lock()
+
+        # --- Counters ---
+        self.builds = 0
+        self.searches = 0
+        self.search_sec = 0.0
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, f"{collection_name(filename)}.json")
+
+    def rebuild(self, filename: str, vector_store) -> BM25Index:
+        """(Re)build a dataset's index from the chunks in its Chroma collection
+        and persist it. Called once an ingestion job has written every batch."""
+        ids, texts = [], []
+        offset = 0
+        while True:
+            page = vector_store._collection.get(include=["documents"], limit=_READ_BATCH, offset=offset)
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            texts.extend(doc or "" for doc in page["documents"])
+            offset += len(page["ids"])
+
+        index = BM25Index.from_texts(ids, texts)
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(filename)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._indexes[filename] = index
+            self.builds += 1
+        print(f"🔤 Lexical index for {filename}: {len(index)} chunks, {len(index.postings)} terms")
+        return index
+
+    def get(self, filename: str, vector_store=None) -> BM25Index | None:
+        """The dataset's index: memory, then disk, then (given its vector store)
+        built from the collection. None when there is nothing to load or build."""
+        index = self._indexes.get(filename)
+        if index is not None:
+            return index
+        try:
+            with open(self._path(filename), "r", encoding="utf-8") as f:
+                index = BM25Index.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            if vector_store is None:
+                return None
+            return self.rebuild(filename, vector_store)
+        with self._lock:
+            self._indexes[filename] = index
+        return index
+
+    def search(self, filename: str, query: str, k: int, vector_store=None) -> list[tuple[str, float]]:
+        index = self.get(filename, vector_store)
+        if index is None:
+            return []
+        started = time.perf_counter()
+        hits = index.search(query, k)
+        with self._lock:
+            self.searches += 1
+            self.search_sec += time.perf_counter() - started
+        return hits
+
+    def drop(self, filename: str):
+        with self._lock:
+            self._indexes.pop(filename, None)
+        try:
+            os.remove(self._path(filename))
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": len(self._indexes),
+                "builds": self.builds,
+                "searches": self.searches,
+                "avg_search_ms": round(self.search_sec * 1000 / self.searches, 3) if self.searches else 0.0,
+            }
+
+
+lexical_indexes = LexicalIndexStore()
@@ -0,0 +1,123 @@
+"""
+prefetch.py — Speculative retrieval for the visitor's likely follow-up.
+
+"Tell me more" is the most predictable question at a booth: it retrieves
+with the previous answer as the query, and that answer is known the moment
+it finishes streaming. So after every answer the follow-up retrieval (query
+embedding included) runs in the background, and the result waits in the
+session's ConversationMemory slot. When the follow-up arrives, retrieval is
+either done or already in flight and simply joined.
+
+The budget keeps this from competing with live visitors:
+
+  • one background thread, at most PREFETCH_MAX_PENDING jobs queued —
+    beyond that new prefetches are dropped, not queued
+  • no job is submitted while visitors are waiting for an LLM slot (checked
+    on the event loop, which owns the scheduler state)
+  • results expire after PREFETCH_TTL_SEC and are used at most once; a
+    follow-up never waits on a job that has not started yet — bot.py
+    cancels it and retrieves live
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from services.generation_scheduler import generation_scheduler
+
+# --- CONFIGURATION (override via .env) ---
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", "4"))
+PREFETCH_TTL_SEC = float(os.getenv("PREFETCH_TTL_SEC", "300"))
+
+
+class RetrievalPrefetcher:
+
+    def __init__(self, enabled: bool = PREFETCH_ENABLED, max_pending: int = PREFETCH_MAX_PENDING,
+                 ttl_sec: float = PREFETCH_TTL_SEC):
+        self.enabled = enabled
+        self.max_pending = max_pending
+        self.ttl_sec = ttl_sec
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+        # --- Counters ---
+        self.scheduled = 0
+        self.completed = 0
+        self.dropped_full = 0
+        self.skipped_busy = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.hits = 0
+        self.misses = 0
+        self.retrieval_sec = 0.0
+
+    def submit(self, fn) -> Future | None:
+        """Run fn() in the background within the budget. The future resolves
+        to fn's result, or None when the job failed. Call from the event loop."""
+        if not self.enabled:
+            return None
+        if not generation_scheduler.has_spare_slot():
+            with self._lock:
+                self.skipped_busy += 1
+            return None
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped_full += 1
+                return None
+            self._pending += 1
+            self.scheduled += 1
+        future = self._executor.submit(self._run, fn)
+        # Also runs when a queued job is cancelled before it starts
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, _future: Future):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, fn):
+        try:
+            started = time.perf_counter()
+            result = fn()
+            with self._lock:
+                self.completed += 1
+                self.retrieval_sec += time.perf_counter() - started
+            return result
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print(f"⚠️ Prefetch failed: {e}")
+            return None
+
+    def record(self, hit: bool, cancelled: bool = False):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if cancelled:
+                self.cancelled += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            used = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "pending": self._pending,
+                "scheduled": self.scheduled,
+                "completed": self.completed,
+                "dropped_full": self.dropped_full,
+                "skipped_busy": self.skipped_busy,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / used, 3) if used else 0.0,
+                "avg_retrieval_ms": round(self.retrieval_sec * 1000 / self.completed, 1) if self.completed else 0.0,
+            }
+
+
+prefetcher = RetrievalPrefetcher()
@@ -0,0 +1,364 @@
+"""
+project_overview.py — Per-project overview answers, generated once at ingest.
+
+"What is this project?" is the most common booth question and the most
+expensive one: a wide retrieval plus a 4-6 sentence generation, for an
+answer that only changes when the dataset does. Instead, when an ingestion
+job finishes, the dataset gets three canonical answers:
+
+  • summary     what it is, the problem, how it works, what is special
+  • features    the key features
+  • tech_stack  languages, frameworks, models and tools (when the dataset names any)
+
+They are written by map-reduce over ALL the chunks, not just the top-k
+neighbours of one question: map = notes per group of chunks, reduce = merge
+the notes until they fit one prompt, then one final prompt per answer.
+Project-level summary questions ("what is this project?", "what's the tech
+stack?") are then replayed from the artifact instantly, without an LLM
+slot. A summary question about one topic ("summarize the database schema")
+names terms the canned answer doesn't cover, so it still retrieves.
+
+  • artifacts live in OVERVIEW_DIR as JSON, one file per dataset, with a
+    fingerprint of the chunk IDs (content hashes): an unchanged dataset is
+    never regenerated, a changed one is regenerated in the background
+  • generation runs on one background thread, and each LLM call holds a
+    background slot of the generation scheduler, so visitors come first
+  • while an artifact is missing or stale, summary questions take the
+    normal retrieval path
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from services.generation_scheduler import generation_scheduler
+from Utils.pdfvectorising import collection_name
+
+# --- CONFIGURATION (override via .env) ---
+OVERVIEW_ENABLED = os.getenv("OVERVIEW_ENABLED", "true").lower() == "true"
+OVERVIEW_DIR = os.getenv(
+    "OVERVIEW_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "project_overviews"),
+)
+# Characters of chunk text per map call (~1150 tokens, well inside llama3.2's window)
+OVERVIEW_MAP_CHARS = int(os.getenv("OVERVIEW_MAP_CHARS", "4000"))
+# Map calls per dataset; larger datasets are sampled evenly across the document
+OVERVIEW_MAX_MAP_CALLS = int(os.getenv("OVERVIEW_MAX_MAP_CALLS", "24"))
+
+ARTIFACT_VERSION = 1
+ARTIFACTS = ("summary", "features", "tech_stack")
+
+_FEATURE_HINTS = ("feature", "key points", "what can it do", "capabilit")
+_TECH_HINTS = ("tech stack", "built with", "technolog", "framework", "stack", "language")
+_NONE_REPLY = "NONE"
+
+# Everything a whole-project question is made of. Any other word ("login",
+# "caching", "schema") is a specific topic that needs retrieval.
+_OVERVIEW_WORDS = frozenset(
+    "a about all an and any are as at be brief briefly can could describe do does doing "
+    "everything explain exhibit for general give goal here how i idea in is it its just "
+    "me more of on overall overview please point points problem project purpose quick "
+    "quickly really s short so solve solves summarise summarize summary tell that the "
+    "this to us what whats you your "
+    "main key feature features capability capabilities special unique "
+    "app application demo product system tool work works "
+    "tech technology technologies technical stack built build made written with using use "
+    "uses used framework frameworks language languages library libraries tools".split()
+)
+
+
+# ============================================================================
+#   PROMPTS
+# ============================================================================
+
+map_prompt = ChatPromptTemplate.from_template("""
+You are reading part of the documentation of a project shown at an exhibition.
+
+Text: {text}
+
+Write short factual notes on what this text says about:
+- what the project is and what problem it solves
+- how it works
+- its features
+- technologies, languages, frameworks, models and tools it uses
+
+Only use facts written in the Text. Skip any heading with nothing to say.
+
+Notes:
+""")
+
+reduce_prompt = ChatPromptTemplate.from_template("""
+Merge these notes about one project into a single set of notes under the
+same four headings. Keep every distinct fact and name, drop repetition.
+Do not add anything that is not in the notes.
+
+Notes: {notes}
+
+Merged notes:
+""")
+
+_SPOKEN_RULES = """
+• Conversational tone, no headers or bullet points — this is read aloud.
+• Use ONLY the Notes. Every name, feature and term you mention must appear in the Notes.
+• NEVER start with a greeting. Never say "Based on the notes".
+"""
+
+final_prompts = {
+    "summary": ChatPromptTemplate.from_template("""
+You are Lumira at a project exhibition. A visitor asked what this project is.
+
+Notes: {notes}
+
+• Give a clear overview in 4-6 sentences.
+• Cover: what it is, what problem it solves, how it works, what makes it special.
+""" + _SPOKEN_RULES + """
+Summary:
+"""),
+    "features": ChatPromptTemplate.from_template("""
+You are Lumira at a project exhibition. A visitor asked about this project's key features.
+
+Notes: {notes}
+
+• Describe the 3-5 most important features in 3-5 sentences.
+""" + _SPOKEN_RULES + """
+Answer:
+"""),
+    "tech_stack": ChatPromptTemplate.from_template("""
+You are Lumira at a project exhibition. A visitor asked what this project is built with.
+
+Notes: {notes}
+
+• In 2-4 sentences, name the languages, frameworks, models and tools it uses and what each is used for.
+• If the Notes name no technologies at all, reply with exactly: """ + _NONE_REPLY + """
+""" + _SPOKEN_RULES + """
+Answer:
+"""),
+}
+
+
+def _name_words(filename: str | None) -> set[str]:
+    """'Smart_Irrigation v2.pdf' → {'smart', 'irrigation', 'v2'}: the project's own name is not a topic."""
+    if not filename:
+        return set()
+    return set(re.findall(r"[a-z0-9]+", os.path.splitext(filename)[0].lower()))
+
+
+def artifact_for(question: str, filename: str | None = None) -> str | None:
+    """Which precomputed answer a summary-mode question is asking for, or
+    None when it asks about something specific ("tell me about the login
+    feature") — a whole-project answer would not be about that."""
+    q = question.lower()
+    allowed = _OVERVIEW_WORDS | _name_words(filename)
+    if any(word not in allowed for word in re.findall(r"[a-z]+", q)):
+        return None
+    if any(hint in q for hint in _TECH_HINTS):
+        return "tech_stack"
+    if any(hint in q for hint in _FEATURE_HINTS):
+        return "features"
+    return "summary"
+
+
+def fingerprint(ids) -> str:
+    """Chunk IDs are content hashes, so this changes exactly when the dataset does."""
+    return hashlib.sha1("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+
+
+def _group(texts: list[str], limit: int, min_per_group: int = 1) -> list[list[str]]:
+    groups, current, size = [], [], 0
+    for text in texts:
+        if current and size + len(text) > limit and len(current) >= min_per_group:
+            groups.append(current)
+            current, size = [], 0
+        current.append(text)
+        size += len(text)
+    if current:
+        groups.append(current)
+    return groups
+
+
+# ============================================================================
+#   STORE
+# ============================================================================
+
+class OverviewStore:
+
+    def __init__(self, directory: str = OVERVIEW_DIR, enabled: bool = OVERVIEW_ENABLED):
+        self.directory = directory
+        self.enabled = enabled
+        self._overviews: dict[str, dict] = {}
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="overview")
+
+        # --- Counters ---
+        self.generated = 0
+        self.failed = 0
+        self.served = 0
+        self.llm_calls = 0
+        self.generation_sec = 0.0
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, f"{collection_name(filename)}.json")
+
+    def get(self, filename: str) -> dict | None:
+        overview = self._overviews.get(filename)
+        if overview is None:
+            try:
+                with open(self._path(filename), "r", encoding="utf-8") as f:
+                    overview = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if overview.get("version") != ARTIFACT_VERSION:
+                return None
+            with self._lock:
+                self._overviews[filename] = overview
+        return overview
+
+    def lookup(self, filename: str | None, question: str) -> str | None:
+        """The precomputed answer for a summary-mode question, or None (no
+        project, no artifact yet, a question about one specific topic, or
+        the dataset names no tech stack)."""
+        if not self.enabled or not filename or filename in self._pending:
+            return None
+        artifact = artifact_for(question, filename)
+        if artifact is None:
+            return None
+        overview = self.get(filename)
+        if overview is None:
+            return None
+        return overview.get(artifact) or None
+
+    def answer(self, filename: str | None, question: str) -> str | None:
+        """lookup() for an answer that is about to be served."""
+        text = self.lookup(filename, question)
+        if text:
+            with self._lock:
+                self.served += 1
+        return text
+
+    # ---------- GENERATION ----------
+
+    def schedule(self, filename: str, vector_store):
+        """(Re)generate a dataset's artifact in the background. The current
+        one stops being served at once — it describes the old dataset."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if filename in self._pending:
+                return
+            self._pending.add(filename)
+            self._overviews.pop(filename, None)
+        self._executor.submit(self._run, filename, vector_store)
+
+    def schedule_missing(self, datasets: dict, get_store):
+        """Queue generation for datasets that have no artifact yet (e.g. ingested
+        before this existed). get_store(filename) returns the vector store."""
+        for filename in datasets:
+            if self.get(filename) is None:
+                self.schedule(filename, get_store(filename))
+
+    def _run(self, filename: str, vector_store):
+        try:
+            self.build(filename, vector_store)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            # Whatever is on disk describes the old dataset
+            self.drop(filename)
+            print(f"⚠️ Overview generation failed for {filename}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(filename)
+
+    def build(self, filename: str, vector_store) -> dict:
+        """Map-reduce the dataset's chunks into its overview artifact (blocking)."""
+        rows = vector_store._collection.get(include=["documents", "metadatas"])
+        current = fingerprint(rows["ids"])
+        try:
+            with open(self._path(filename), "r", encoding="utf-8") as f:
+                existing = json.load(f)
+            if existing.get("version") == ARTIFACT_VERSION and existing.get("fingerprint") == current:
+                with self._lock:
+                    self._overviews[filename] = existing
+                return existing
+        except (OSError, ValueError):
+            pass
+
+        started = time.perf_counter()
+        # Document order: page, then position within the page
+        chunks = sorted(
+            zip(rows["documents"], rows["metadatas"]),
+            key=lambda row: ((row[1] or {}).get("page", 0), (row[1] or {}).get("start_index", 0)),
+        )
+        notes = self._map_reduce(filename, [text for text, _ in chunks if text])
+
+        overview = {"version": ARTIFACT_VERSION, "fingerprint": current,
+                    "generated_at": time.time(), "chunks": len(rows["ids"])}
+        for artifact, prompt in final_prompts.items():
+            text = self._generate(filename, prompt, notes=notes).strip()
+            overview[artifact] = None if _NONE_REPLY in text[:10].upper() else text
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(filename)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(overview, f, indent=2)
+        os.replace(tmp_path, path)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._overviews[filename] = overview
+            self.generated += 1
+            self.generation_sec += elapsed
+        print(f"📝 Overview for {filename} generated in {elapsed:.1f}s ({len(chunks)} chunks)")
+        return overview
+
+    def _map_reduce(self, filename: str, texts: list[str]) -> str:
+        groups = ["\n\n".join(group) for group in _group(texts, OVERVIEW_MAP_CHARS)]
+        if len(groups) > OVERVIEW_MAX_MAP_CALLS:
+            step = len(groups) / OVERVIEW_MAX_MAP_CALLS
+            groups = [groups[int(i * step)] for i in range(OVERVIEW_MAX_MAP_CALLS)]
+
+        notes = [self._generate(filename, map_prompt, text=group).strip() for group in groups]
+        # At least two sets of notes per reduce call, so every round shrinks
+        while len(notes) > 1 and sum(len(n) for n in notes) > OVERVIEW_MAP_CHARS:
+            notes = [self._generate(filename, reduce_prompt, notes="\n\n".join(batch)).strip()
+                     for batch in _group(notes, OVERVIEW_MAP_CHARS, min_per_group=2)]
+        return "\n\n".join(notes)
+
+    def _generate(self, filename: str, prompt, **inputs) -> str:
+        from bot import model
+        with self._lock:
+            self.llm_calls += 1
+        # Blocks until the scheduler grants a background slot (visitors first)
+        return generation_scheduler.run_background(filename, lambda: (prompt | model).invoke(inputs))
+
+    def drop(self, filename: str):
+        with self._lock:
+            self._overviews.pop(filename, None)
+        try:
+            os.remove(self._path(filename))
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "loaded": len(self._overviews),
+                "pending": len(self._pending),
+                "generated": self.generated,
+                "failed": self.failed,
+                "served": self.served,
+                "llm_calls": self.llm_calls,
+                "avg_generation_sec": round(self.generation_sec / self.generated, 1) if self.generated else 0.0,
+            }
+
+
+project_overviews = OverviewStore()
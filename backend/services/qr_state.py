@@ -0,0 +1,150 @@
+"""
+qr_state.py — In-memory QR lifecycle store backed by Dataset/.qr_status.json.
+
+Every /api/chat message checks that the dataset exists and that its QR is
+active. That used to mean a stat plus opening and JSON-parsing the status
+file (and re-running the boolean migration) per message. Now the state lives
+in memory:
+
+  • lookups are dict / set lookups with no disk I/O
+  • the file (and the Dataset/ listing) is re-read only when its mtime
+    changes, checked at most every QR_STATUS_RECHECK_SEC, so hand edits and
+    manually copied datasets are still picked up
+  • read-modify-write transitions run under a lock and are written
+    atomically (temp file + rename)
+
+State values: {filename: "inactive"|"active"|"destroyed"}
+Backwards-compat: old boolean entries (True/False) are migrated on read.
+"""
+
+import json
+import os
+import threading
+import time
+
+QR_STATUS_RECHECK_SEC = float(os.getenv("QR_STATUS_RECHECK_SEC", "2"))
+
+VALID_STATES = {"inactive", "active", "destroyed"}
+DEFAULT_STATE = "inactive"
+
+
+def _migrate(raw: dict) -> dict:
+    """Migrate old boolean entries → string states."""
+    migrated = {}
+    for k, v in raw.items():
+        if v is True:
+            migrated[k] = "active"
+        elif v is False:
+            migrated[k] = "inactive"
+        elif v in VALID_STATES:
+            migrated[k] = v
+        else:
+            migrated[k] = "inactive"
+    return migrated
+
+
+class QRStateStore:
+
+    def __init__(self, dataset_dir: str, recheck_sec: float = QR_STATUS_RECHECK_SEC):
+        self.dataset_dir = dataset_dir
+        self.path = os.path.join(dataset_dir, ".qr_status.json")
+        self.recheck_sec = recheck_sec
+
+        self._states: dict[str, str] = {}
+        self._datasets: set[str] = set()
+        self._mtime: tuple | None = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+        self._reload()
+
+    # ---------- DISK ----------
+
+    def _current_mtime(self) -> tuple:
+        mtimes = []
+        for path in (self.path, self.dataset_dir):
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _reload(self):
+        """Re-read the status file and the dataset listing."""
+        self._mtime = self._current_mtime()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._states = _migrate(json.load(f))
+        except FileNotFoundError:
+            self._states = {}
+        except (json.JSONDecodeError, OSError):
+            # Keep the last good in-memory copy rather than dropping every state
+            pass
+
+        try:
+            self._datasets = {
+                f for f in os.listdir(self.dataset_dir)
+                if not f.startswith(".") and os.path.isfile(os.path.join(self.dataset_dir, f))
+            }
+        except OSError:
+            self._datasets = set()
+        self._checked_at = time.monotonic()
+
+    def _maybe_refresh(self):
+        """Pick up external edits, at most one stat per recheck interval."""
+        if time.monotonic() - self._checked_at < self.recheck_sec:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.recheck_sec:
+                return
+            if self._current_mtime() != self._mtime:
+                self._reload()
+            else:
+                self._checked_at = time.monotonic()
+
+    def _save(self):
+        """Atomic write: readers never see a half-written file."""
+        os.makedirs(self.dataset_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._states, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._mtime = self._current_mtime()
+
+    # ---------- READS (no disk I/O on the hot path) ----------
+
+    def get(self, filename: str) -> str:
+        """Return the QR lifecycle state for a file. Default: 'inactive' for new files."""
+        self._maybe_refresh()
+        return self._states.get(filename, DEFAULT_STATE)
+
+    def is_active(self, filename: str) -> bool:
+        return self.get(filename) == "active"
+
+    def dataset_exists(self, filename: str) -> bool:
+        self._maybe_refresh()
+        return filename in self._datasets
+
+    def snapshot(self) -> dict:
+        self._maybe_refresh()
+        with self._lock:
+            return dict(self._states)
+
+    # ---------- WRITES ----------
+
+    def update(self, filename: str, transition) -> str:
+        """Atomically apply transition(current_state) -> new_state and persist it.
+        The transition may raise to reject the change; nothing is written then."""
+        with self._lock:
+            self._maybe_refresh()
+            new_state = transition(self._states.get(filename, DEFAULT_STATE))
+            self._states[filename] = new_state
+            self._save()
+            return new_state
+
+    def dataset_added(self, filename: str):
+        with self._lock:
+            self._datasets.add(filename)
+
+    def dataset_removed(self, filename: str):
+        with self._lock:
+            self._datasets.discard(filename)
@@ -0,0 +1,286 @@
+"""
+retrieval_pipeline.py — Mode-aware retrieval: over-fetch → MMR → (rerank) → fit.
+
+Top-k similarity over overlapping 2000-char chunks mostly returned the same
+passage several times, so the context budget was spent on near-copies. Each
+classify_question() mode now runs the same staged pipeline with its own
+settings:
+
+  1. embed       the query once (shared LRU in front of BGE-small)
+  2. candidates  over-fetch `fetch_k` cheaply: vector + BM25 fused by rank for
+                 a project-locked question, nearest chunks of every project
+                 otherwise. One Chroma call returns text and stored
+                 embeddings, so nothing is embedded twice.
+  3. mmr         maximal marginal relevance on the stored embeddings: each pick
+                 trades relevance against similarity to what is already picked
+                 (`mmr_lambda`: 1.0 = pure relevance; summary / comparison
+                 want breadth, normal questions want the single best passage)
+  4. rerank      optional small cross-encoder on CPU (fastembed / ONNX) over
+                 the MMR short-list, when RERANK_ENABLED
+  5. fit         keep retrieval_k(mode) chunks — what the prompt budget holds
+
+Per-stage timings are logged for every question and aggregated in stats().
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.runnables.config import run_in_executor
+
+from services.context_packer import retrieval_k
+from services.hybrid_retrieval import HYBRID_ENABLED, lexical_candidates, reciprocal_rank_fusion
+from Utils.pdfvectorising import get_embeddings, get_project_vectorstore, registry
+
+# --- CONFIGURATION (override via .env) ---
+_DEFAULT_PROFILES = {
+    # mode: (candidates to over-fetch, MMR lambda)
+    "normal": (16, 0.7),
+    "elaborate": (24, 0.6),
+    "deep": (24, 0.6),
+    "comparison": (30, 0.5),
+    "summary": (40, 0.4),
+}
+RETRIEVAL_PROFILES = {
+    mode: {
+        "fetch_k": int(os.getenv(f"RETRIEVAL_FETCH_K_{mode.upper()}", str(fetch_k))),
+        "mmr_lambda": float(os.getenv(f"RETRIEVAL_MMR_LAMBDA_{mode.upper()}", str(mmr_lambda))),
+    }
+    for mode, (fetch_k, mmr_lambda) in _DEFAULT_PROFILES.items()
+}
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "Xenova/ms-marco-MiniLM-L-6-v2")
+# ONNX threads for the cross-encoder; 0 = let ONNX decide
+RERANK_THREADS = int(os.getenv("RERANK_THREADS", "0"))
+# MMR short-lists this many times the final k for the cross-encoder to order
+RERANK_POOL_FACTOR = int(os.getenv("RERANK_POOL_FACTOR", "2"))
+# Threads for retrievals started before the question is final (streaming STT)
+RETRIEVAL_AHEAD_WORKERS = int(os.getenv("RETRIEVAL_AHEAD_WORKERS", "2"))
+
+STAGES = ("embed", "candidates", "mmr", "rerank", "total")
+
+
+def profile_for(mode: str) -> dict:
+    return RETRIEVAL_PROFILES.get(mode, RETRIEVAL_PROFILES["normal"])
+
+
+# ============================================================================
+#   RERANKER (optional, lazy)
+# ============================================================================
+
+_reranker = None
+_reranker_error: str | None = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """The shared cross-encoder, loaded on first use. None when disabled or unavailable."""
+    global _reranker, _reranker_error
+    if not RERANK_ENABLED:
+        return None
+    if _reranker is None and _reranker_error is None:
+        with _reranker_lock:
+            if _reranker is None and _reranker_error is None:
+                try:
+                    from fastembed.rerank.cross_encoder import TextCrossEncoder
+                    _reranker = TextCrossEncoder(model_name=RERANK_MODEL, threads=RERANK_THREADS or None)
+                    print(f"✅ Reranker: Ready (Model: {RERANK_MODEL})")
+                except Exception as e:
+                    _reranker_error = str(e)
+                    print(f"⚠️ Reranker unavailable, retrieval continues without it: {e}")
+    return _reranker
+
+
+# ============================================================================
+#   STAGES
+# ============================================================================
+
+class _Candidate:
+    __slots__ = ("doc", "vector", "relevance")
+
+    def __init__(self, doc: Document, vector, relevance: float | None = None):
+        self.doc = doc
+        self.vector = np.asarray(vector, dtype=np.float32)
+        self.relevance = relevance
+
+
+def _query_collection(filename: str, query_vector, n: int) -> list[tuple[_Candidate, float]]:
+    """Nearest chunks of one project with their stored embeddings, as (candidate, distance)."""
+    result = get_project_vectorstore(filename)._collection.query(
+        query_embeddings=[query_vector], n_results=n,
+        include=["documents", "metadatas", "embeddings", "distances"],
+    )
+    return [
+        (_Candidate(Document(id=chunk, page_content=text or "", metadata=metadata or {}), vector), distance)
+        for chunk, text, metadata, vector, distance in zip(
+            result["ids"][0], result["documents"][0], result["metadatas"][0],
+            result["embeddings"][0], result["distances"][0],
+        )
+    ]
+
+
+def _fetch(filename: str, ids: list[str]) -> dict[str, _Candidate]:
+    rows = get_project_vectorstore(filename)._collection.get(
+        ids=ids, include=["documents", "metadatas", "embeddings"])
+    return {
+        chunk: _Candidate(Document(id=chunk, page_content=text or "", metadata=metadata or {}), vector)
+        for chunk, text, metadata, vector in zip(
+            rows["ids"], rows["documents"], rows["metadatas"], rows["embeddings"])
+    }
+
+
+def _candidates(query: str, query_vector, filter_filename: str | None, fetch_k: int) -> list[_Candidate]:
+    if not filter_filename:
+        # Every project's nearest chunks; distances share one embedding space
+        hits = [hit for filename in registry.datasets()
+                for hit in _query_collection(filename, query_vector, fetch_k)]
+        hits.sort(key=lambda hit: hit[1])
+        return [candidate for candidate, _ in hits[:fetch_k]]
+
+    by_id = {c.doc.id: c for c, _ in _query_collection(filter_filename, query_vector, fetch_k)}
+    if not HYBRID_ENABLED:
+        return list(by_id.values())
+
+    fused = reciprocal_rank_fusion([list(by_id), lexical_candidates(filter_filename, query, fetch_k)])[:fetch_k]
+    missing = [chunk for chunk, _ in fused if chunk not in by_id]
+    if missing:
+        by_id.update(_fetch(filter_filename, missing))
+    candidates = []
+    for chunk, score in fused:
+        if chunk in by_id:
+            by_id[chunk].relevance = score
+            candidates.append(by_id[chunk])
+    return candidates
+
+
+def mmr(query_vector, candidates: list[_Candidate], n: int, lambda_mult: float) -> list[_Candidate]:
+    """Greedy maximal marginal relevance. Relevance is the fused score when the
+    candidates have one, cosine similarity to the query otherwise; both are
+    rescaled to 0..1 so lambda weighs them against chunk-to-chunk cosine."""
+    if len(candidates) <= 1:
+        return candidates[:n]
+    vectors = np.stack([c.vector for c in candidates])
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if all(c.relevance is not None for c in candidates):
+        relevance = np.array([c.relevance for c in candidates], dtype=np.float32)
+    else:
+        query = np.asarray(query_vector, dtype=np.float32)
+        relevance = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    spread = float(relevance.max() - relevance.min())
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    remaining = [i for i in range(len(candidates)) if i != selected[0]]
+    while remaining and len(selected) < n:
+        redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+    return [candidates[i] for i in selected]
+
+
+def _rerank(query: str, docs: list[Document], k: int) -> list[Document]:
+    reranker = get_reranker()
+    if reranker is None or len(docs) <= 1:
+        return docs[:k]
+    scores = list(reranker.rerank(query, [doc.page_content for doc in docs]))
+    order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+    return [docs[i] for i in order[:k]]
+
+
+# ============================================================================
+#   PIPELINE
+# ============================================================================
+
+class _StageStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = {stage: 0.0 for stage in STAGES}
+        self.lock = threading.Lock()
+
+    def add(self, timings: dict):
+        with self.lock:
+            self.count += 1
+            for stage in STAGES:
+                self.total_ms[stage] += timings.get(stage, 0.0)
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "queries": self.count,
+                "avg_ms": {stage: round(total / self.count, 2) if self.count else 0.0
+                           for stage, total in self.total_ms.items()},
+            }
+
+
+_stats = _StageStats()
+
+
+def retrieve(query: str, filter_filename: str | None, mode: str) -> tuple[list[Document], dict]:
+    """Run the mode's pipeline. Returns (chunks best first, per-stage ms)."""
+    profile = profile_for(mode)
+    k = retrieval_k(mode)
+    timings = {}
+    started = last = time.perf_counter()
+
+    def lap(stage: str):
+        nonlocal last
+        now = time.perf_counter()
+        timings[stage] = round((now - last) * 1000, 2)
+        last = now
+
+    query_vector = get_embeddings().embed_query(query)
+    lap("embed")
+
+    candidates = _candidates(query, query_vector, filter_filename, max(profile["fetch_k"], k))
+    lap("candidates")
+
+    reranking = get_reranker() is not None
+    shortlist = mmr(query_vector, candidates, k * RERANK_POOL_FACTOR if reranking else k, profile["mmr_lambda"])
+    lap("mmr")
+
+    docs = _rerank(query, [c.doc for c in shortlist], k) if reranking else [c.doc for c in shortlist]
+    lap("rerank")
+
+    timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+    _stats.add(timings)
+    print(f"⏱️ Retrieval [{mode}] {len(candidates)}→{len(docs)} chunks: "
+          + " | ".join(f"{stage} {timings[stage]:.1f} ms" for stage in STAGES))
+    return docs, timings
+
+
+async def aretrieve(query: str, filter_filename: str | None, mode: str) -> tuple[list[Document], dict]:
+    """retrieve() on a worker thread — Chroma, ONNX and numpy all block."""
+    return await run_in_executor(None, retrieve, query, filter_filename, mode)
+
+
+_ahead_executor = ThreadPoolExecutor(max_workers=max(1, RETRIEVAL_AHEAD_WORKERS), thread_name_prefix="retrieve-ahead")
+
+
+def _retrieve_docs(query: str, filter_filename: str | None, mode: str) -> list[Document] | None:
+    try:
+        return retrieve(query, filter_filename, mode)[0]
+    except Exception as e:
+        print(f"⚠️ Early retrieval failed: {e}")
+        return None
+
+
+def submit_retrieve(query: str, filter_filename: str | None, mode: str) -> Future:
+    """Start retrieve() ahead of the question on its own threads. The future
+    resolves to the docs, or None when retrieval failed (retrieve live then)."""
+    return _ahead_executor.submit(_retrieve_docs, query, filter_filename, mode)
+
+
+def stats() -> dict:
+    return {
+        "rerank": RERANK_ENABLED and _reranker is not None,
+        "hybrid": HYBRID_ENABLED,
+        **_stats.summary(),
+    }
@@ -1,15 +1,272 @@
 import asyncio
-from faster_whisper import WhisperModel
-
-# --- STT MODEL INITIALIZATION ---
-try:
-    # "small" is the sweet spot for laptop CPUs.
-    # It is much smarter than "base" but still runs reasonably fast.
-    stt_model = WhisperModel("small", device="cpu", compute_type="int8")
-    print("✅ Faster-Whisper: Ready (Model: Small - High Accuracy)")
-except Exception as e:
-    stt_model = None
-    print(f"❌ Whisper Error: {e}")
-
-# Concurrency Lock
-inference_lock = asyncio.Semaphore(4)
+import io
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- STT MODELS (lazy — loaded by the startup warm-up, not at import) ---
+# "small" is the sweet spot for laptop CPUs.
+# It is much smarter than "base" but still runs reasonably fast.
+STT_MODEL_SIZE = "small"
+# Smaller model for the fast profile (short booth questions)
+STT_FAST_MODEL_SIZE = os.getenv("STT_FAST_MODEL_SIZE", "base.en")
+
+# --- WORKER POOL (override via .env) ---
+# Transcriptions that can decode at the same time. Each worker is a
+# CTranslate2 model replica (num_workers) driven by its own pool thread.
+STT_WORKERS = int(os.getenv("STT_WORKERS", "2"))
+# CPU threads per worker; 0 = share the machine's cores between workers
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", "0")) or max(1, (os.cpu_count() or 2) // STT_WORKERS)
+# Clips allowed to wait for a free worker before /api/stt answers 503
+STT_MAX_QUEUE = int(os.getenv("STT_MAX_QUEUE", "8"))
+
+# --- PROFILE SELECTION ---
+# Clips up to this long (after decoding) take the fast profile
+STT_FAST_MAX_SEC = float(os.getenv("STT_FAST_MAX_SEC", "8"))
+# Longer clips also take the fast profile once this many clips are in flight
+STT_FAST_UNDER_LOAD = int(os.getenv("STT_FAST_UNDER_LOAD", str(STT_WORKERS + 1)))
+# A fast result whose mean log-probability is below this (noisy / unsure)
+# is re-decoded with the accurate profile, load permitting
+STT_FAST_MIN_LOGPROB = float(os.getenv("STT_FAST_MIN_LOGPROB", "-0.8"))
+
+_INITIAL_PROMPT = "This is a user asking a technical question about a software project or exhibition."
+
+STT_PROFILES = {
+    # Greedy decoding on a smaller model; VAD trims the leading / trailing
+    # silence of press-and-hold recordings
+    "fast": {
+        "model": STT_FAST_MODEL_SIZE,
+        "options": {
+            "beam_size": 1,
+            "vad_filter": True,
+            "vad_parameters": {"min_silence_duration_ms": 500, "speech_pad_ms": 300},
+            "condition_on_previous_text": False,
+            "initial_prompt": _INITIAL_PROMPT,
+        },
+    },
+    # --- ACCURACY SETTINGS ---
+    "accurate": {
+        "model": STT_MODEL_SIZE,
+        "options": {
+            "vad_filter": False,  # Don't cut off quiet speech
+            "beam_size": 5,  # Look for 5 possibilities (Smarter)
+            "initial_prompt": _INITIAL_PROMPT,  # Context Clue
+        },
+    },
+}
+
+SAMPLE_RATE = 16000
+
+_stt_models: dict = {}
+_stt_errors: dict[str, str] = {}
+_stt_lock = threading.Lock()
+
+
+def get_stt_model(size: str = STT_MODEL_SIZE):
+    """Return the shared Whisper model of a size, loading it on first use. None if it failed to load."""
+    if size not in _stt_models and size not in _stt_errors:
+        with _stt_lock:
+            if size not in _stt_models and size not in _stt_errors:
+                try:
+                    from faster_whisper import WhisperModel
+                    _stt_models[size] = WhisperModel(
+                        size,
+                        device="cpu",
+                        compute_type="int8",
+                        cpu_threads=STT_CPU_THREADS,
+                        num_workers=STT_WORKERS,
+                    )
+                    print(f"✅ Faster-Whisper: Ready (Model: {size}, "
+                          f"{STT_WORKERS} workers x {STT_CPU_THREADS} threads)")
+                except Exception as e:
+                    _stt_errors[size] = str(e)
+                    print(f"❌ Whisper Error ({size}): {e}")
+    return _stt_models.get(size)
+
+
+def _usable(profile: str) -> bool:
+    return get_stt_model(STT_PROFILES[profile]["model"]) is not None
+
+
+def load_profiles() -> bool:
+    """Load every profile's model. True if at least one is usable."""
+    return any([_usable(profile) for profile in STT_PROFILES])
+
+
+# ============================================================================
+#   METRICS
+# ============================================================================
+
+class _ProfileStats:
+    """Decode time and real-time factor (decode sec / audio sec) per profile."""
+
+    def __init__(self, window: int = 500):
+        self.count = 0
+        self.audio_sec = 0.0
+        self.decode_sec = 0.0
+        self.recent_rtf = deque(maxlen=window)
+
+    def add(self, audio_sec: float, decode_sec: float):
+        self.count += 1
+        self.audio_sec += audio_sec
+        self.decode_sec += decode_sec
+        self.recent_rtf.append(decode_sec / audio_sec if audio_sec else 0.0)
+
+    def summary(self) -> dict:
+        recent = sorted(self.recent_rtf)
+        p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+        return {
+            "count": self.count,
+            "avg_audio_sec": round(self.audio_sec / self.count, 2) if self.count else 0.0,
+            "avg_decode_sec": round(self.decode_sec / self.count, 3) if self.count else 0.0,
+            "rtf": round(self.decode_sec / self.audio_sec, 3) if self.audio_sec else 0.0,
+            "p95_rtf": round(p95, 3),
+        }
+
+
+_profile_stats = {name: _ProfileStats() for name in STT_PROFILES}
+_upgrades = 0   # fast results re-decoded with the accurate profile
+_metrics_lock = threading.Lock()
+
+
+# ============================================================================
+#   TRANSCRIPTION POOL
+# ============================================================================
+
+class STTBusy(Exception):
+    """Every worker is busy and the wait queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Speech recognition is busy")
+        self.retry_after = retry_after
+
+
+# Decoding runs here, never on the event loop: chat streams keep flowing
+# while a voice query is being transcribed.
+_executor = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="whisper")
+_admitted = 0   # queued + decoding; only touched on the event loop thread
+
+
+def choose_profile(audio_sec: float, in_flight: int, requested: str | None = None) -> str:
+    """Pick the STT profile: an explicit request wins, then short clips and a
+    busy pool take the fast path; long clips on an idle pool stay accurate."""
+    if requested in STT_PROFILES and _usable(requested):
+        return requested
+    if audio_sec <= STT_FAST_MAX_SEC or in_flight >= STT_FAST_UNDER_LOAD:
+        profile = "fast"
+    else:
+        profile = "accurate"
+    if not _usable(profile):
+        profile = "accurate" if profile == "fast" else "fast"
+    return profile
+
+
+def _decode(samples, profile: str) -> tuple[str, float, float]:
+    """Run one profile. Returns (text, mean avg_logprob, decode seconds)."""
+    spec = STT_PROFILES[profile]
+    started = time.perf_counter()
+    segments, _ = get_stt_model(spec["model"]).transcribe(samples, **spec["options"])
+    # segments is lazy — the actual decode happens while iterating, in this thread
+    segments = list(segments)
+    decode_sec = time.perf_counter() - started
+    text = " ".join(s.text for s in segments).strip()
+    logprob = sum(s.avg_logprob for s in segments) / len(segments) if segments else 0.0
+    return text, logprob, decode_sec
+
+
+def _transcribe_samples_sync(samples, in_flight: int, requested: str | None) -> dict:
+    global _upgrades
+    audio_sec = len(samples) / SAMPLE_RATE
+    profile = choose_profile(audio_sec, in_flight, requested)
+
+    text, logprob, decode_sec = _decode(samples, profile)
+    with _metrics_lock:
+        _profile_stats[profile].add(audio_sec, decode_sec)
+
+    # Noisy or mumbled clip: the fast model was unsure — spend the accurate
+    # pass on it unless the pool is already saturated
+    if (profile == "fast" and requested != "fast" and text and logprob < STT_FAST_MIN_LOGPROB
+            and in_flight < STT_FAST_UNDER_LOAD and _usable("accurate")):
+        profile = "accurate"
+        text, logprob, extra_sec = _decode(samples, profile)
+        decode_sec += extra_sec
+        with _metrics_lock:
+            _profile_stats[profile].add(audio_sec, extra_sec)
+            _upgrades += 1
+
+    return {
+        "text": text,
+        "profile": profile,
+        "audio_sec": round(audio_sec, 2),
+        "decode_sec": round(decode_sec, 3),
+        "rtf": round(decode_sec / audio_sec, 3) if audio_sec else 0.0,
+    }
+
+
+def _transcribe_sync(audio: bytes, in_flight: int, requested: str | None) -> dict:
+    from faster_whisper import decode_audio
+
+    # PyAV decodes straight from the in-memory buffer (webm / mp4 / wav alike);
+    # decoding once up front also gives the clip duration for the profile choice
+    samples = decode_audio(io.BytesIO(audio), sampling_rate=SAMPLE_RATE)
+    return _transcribe_samples_sync(samples, in_flight, requested)
+
+
+def _release_slot():
+    global _admitted
+    _admitted -= 1
+
+
+async def _run_on_pool(fn, payload, profile: str | None) -> dict:
+    global _admitted
+    if _admitted >= STT_WORKERS + STT_MAX_QUEUE:
+        raise STTBusy(retry_after=max(1, _admitted // STT_WORKERS))
+    loop = asyncio.get_running_loop()
+    future = _executor.submit(fn, payload, _admitted + 1, profile)
+    _admitted += 1
+
+    def on_done(_future):
+        # A cancelled await does not stop a decode already running on its
+        # Whisper thread: the slot is only free once the thread is
+        try:
+            loop.call_soon_threadsafe(_release_slot)
+        except RuntimeError:
+            pass   # loop closed at shutdown
+
+    future.add_done_callback(on_done)
+    return await asyncio.wrap_future(future)
+
+
+async def transcribe(audio: bytes, profile: str | None = None) -> dict:
+    """Transcribe an uploaded clip on the Whisper pool. Raises STTBusy when full.
+
+    Returns {"text", "profile", "audio_sec", "decode_sec", "rtf"}.
+    """
+    return await _run_on_pool(_transcribe_sync, audio, profile)
+
+
+async def transcribe_samples(samples, profile: str | None = None) -> dict:
+    """Same as transcribe() for already-decoded 16 kHz float32 samples."""
+    return await _run_on_pool(_transcribe_samples_sync, samples, profile)
+
+
+async def transcribe_partial(samples) -> dict | None:
+    """Fast-profile decode of an utterance in progress. Partials never queue
+    behind real work: returns None when no worker is free right now."""
+    if _admitted >= STT_WORKERS:
+        return None
+    return await _run_on_pool(_transcribe_samples_sync, samples, "fast")
+
+
+def stats() -> dict:
+    with _metrics_lock:
+        return {
+            "workers": STT_WORKERS,
+            "cpu_threads": STT_CPU_THREADS,
+            "max_queue": STT_MAX_QUEUE,
+            "in_flight": _admitted,
+            "profiles": {name: st.summary() for name, st in _profile_stats.items()},
+            "fast_upgraded_to_accurate": _upgrades,
+        }
@@ -0,0 +1,95 @@
+"""
+stt_stream.py — Rolling audio buffer for streaming speech recognition (/ws/stt).
+
+The visitor's audio arrives in small PCM frames while they are still
+speaking. This buffer:
+
+  • converts 16-bit PCM at any sample rate to Whisper's 16 kHz float32
+  • says when enough new audio has arrived for another partial transcript
+    (decoded on a rolling window of the most recent audio)
+  • detects end-of-speech from trailing silence, so the final decode — and
+    retrieval, from the last partial — can start without waiting for the
+    visitor to release the mic
+"""
+
+import os
+
+import numpy as np
+
+from services.stt_service import SAMPLE_RATE
+
+# --- CONFIGURATION (override via .env) ---
+# New audio needed between two partial transcripts
+STT_WS_PARTIAL_SEC = float(os.getenv("STT_WS_PARTIAL_SEC", "1.0"))
+# Partials decode at most this much of the most recent audio
+STT_WS_WINDOW_SEC = float(os.getenv("STT_WS_WINDOW_SEC", "12"))
+# Trailing silence after speech that counts as end-of-speech
+STT_WS_EOS_SILENCE_MS = int(os.getenv("STT_WS_EOS_SILENCE_MS", "800"))
+# RMS level (0..1) below which a frame counts as silence
+STT_WS_SILENCE_RMS = float(os.getenv("STT_WS_SILENCE_RMS", "0.01"))
+# Hard cap on one utterance
+STT_WS_MAX_SEC = float(os.getenv("STT_WS_MAX_SEC", "30"))
+
+_FRAME = SAMPLE_RATE * 30 // 1000   # 30 ms analysis frames
+
+
+class UtteranceBuffer:
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE):
+        if sample_rate <= 0:
+            raise ValueError(f"sample_rate must be positive, got {sample_rate}")
+        self.sample_rate = sample_rate
+        self._chunks: list[np.ndarray] = []
+        self._length = 0
+        self._pending = np.zeros(0, dtype=np.float32)   # not yet analysed for silence
+        self._last_partial_at = 0
+        self._speech_seen = False
+        self._silent_samples = 0
+
+    @property
+    def duration(self) -> float:
+        return self._length / SAMPLE_RATE
+
+    def _resample(self, samples: np.ndarray) -> np.ndarray:
+        if self.sample_rate == SAMPLE_RATE or not len(samples):
+            return samples
+        target = int(round(len(samples) * SAMPLE_RATE / self.sample_rate))
+        positions = np.linspace(0, len(samples) - 1, num=target)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+    def feed(self, pcm16: bytes) -> bool:
+        """Append little-endian 16-bit mono PCM. Returns True at end-of-speech."""
+        usable = len(pcm16) - len(pcm16) % 2
+        samples = np.frombuffer(pcm16[:usable], dtype="<i2").astype(np.float32) / 32768.0
+        samples = self._resample(samples)
+        self._chunks.append(samples)
+        self._length += len(samples)
+
+        # Silence tracking on whole 30 ms frames
+        self._pending = np.concatenate([self._pending, samples])
+        whole = len(self._pending) - len(self._pending) % _FRAME
+        for start in range(0, whole, _FRAME):
+            frame = self._pending[start:start + _FRAME]
+            if float(np.sqrt(np.mean(frame * frame))) >= STT_WS_SILENCE_RMS:
+                self._speech_seen = True
+                self._silent_samples = 0
+            else:
+                self._silent_samples += _FRAME
+        self._pending = self._pending[whole:]
+
+        eos = self._speech_seen and self._silent_samples * 1000 >= STT_WS_EOS_SILENCE_MS * SAMPLE_RATE
+        return eos or self.duration >= STT_WS_MAX_SEC
+
+    def partial_due(self) -> bool:
+        return self._speech_seen and self._length - self._last_partial_at >= STT_WS_PARTIAL_SEC * SAMPLE_RATE
+
+    def samples(self, window_sec: float | None = None) -> np.ndarray:
+        audio = np.concatenate(self._chunks) if self._chunks else np.zeros(0, dtype=np.float32)
+        self._chunks = [audio]
+        if window_sec is not None:
+            audio = audio[-int(window_sec * SAMPLE_RATE):]
+        return audio
+
+    def partial_window(self) -> np.ndarray:
+        self._last_partial_at = self._length
+        return self.samples(STT_WS_WINDOW_SEC)
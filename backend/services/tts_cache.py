@@ -0,0 +1,205 @@
+"""
+tts_cache.py — Content-addressed on-disk cache of synthesized speech.
+
+Small-talk replies, the "no information" fallbacks and sentences of popular
+(answer-cached) answers were re-synthesized by edge-tts every time anyone
+heard them — a round trip over the venue Wi-Fi for audio we already had.
+
+  • key = sha256(cleaned text, voice, RATE, PITCH) — any change to the voice
+    settings is a different key, so stale audio is never served
+  • one <key>.mp3 (edge-tts) or <key>.wav (local engine) per entry in
+    TTS_CACHE_DIR, written atomically
+  • the directory is size-bounded (TTS_CACHE_MAX_MB) with LRU eviction;
+    file mtimes carry the recency order across restarts
+  • the key doubles as the HTTP ETag, so phones can cache audio too
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+MEDIA_TYPES = {"mp3": "audio/mpeg", "wav": "audio/wav"}
+
+# --- CONFIGURATION (override via .env) ---
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_DIR = os.getenv(
+    "TTS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tts_cache"),
+)
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "256"))
+
+
+def cache_key(cleaned_text: str, voice_name: str, rate: str, pitch: str) -> str:
+    payload = "\n".join((cleaned_text, voice_name, rate, pitch))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_mb: float = TTS_CACHE_MAX_MB,
+                 enabled: bool = TTS_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = enabled and self.max_bytes > 0
+
+        # {key: (size in bytes, extension)}, least recently used first
+        self._entries: OrderedDict[str, tuple[int, str]] = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+        # --- Counters ---
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------- INDEX ----------
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files on disk (oldest mtime first)."""
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for name in os.listdir(self.directory):
+            key, _, extension = name.rpartition(".")
+            if extension not in MEDIA_TYPES:
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((st.st_mtime, key, st.st_size, extension))
+        for _, key, size, extension in sorted(found):
+            self._entries[key] = (size, extension)
+            self._total_bytes += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, (size, extension) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key, extension))
+            except OSError:
+                pass
+
+    # ---------- PUBLIC API ----------
+
+    def get(self, key: str) -> tuple[str, int, str] | None:
+        """Return (path, size, media type) of a cached clip and mark it recently used."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load_index()
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(self._path(key, entry[1])):
+                if entry is not None:
+                    # Deleted behind our back
+                    del self._entries[key]
+                    self._total_bytes -= entry[0]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        size, extension = entry
+        path = self._path(key, extension)
+        try:
+            # Persist recency for the next restart's LRU order
+            os.utime(path)
+        except OSError:
+            pass
+        return path, size, MEDIA_TYPES[extension]
+
+    def read(self, key: str) -> bytes | None:
+        hit = self.get(key)
+        if hit is None:
+            return None
+        try:
+            with open(hit[0], "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def contains(self, key: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._lock:
+            self._load_index()
+            return key in self._entries
+
+    def put(self, key: str, audio: bytes, extension: str = "mp3"):
+        if not self.enabled or not audio or len(audio) > self.max_bytes:
+            return
+        with self._lock:
+            self._load_index()
+            path = self._path(key, extension)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(audio)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️ TTS cache write failed: {e}")
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[0]
+                if old[1] != extension:
+                    try:
+                        os.remove(self._path(key, old[1]))
+                    except OSError:
+                        pass
+            self._entries[key] = (len(audio), extension)
+            self._total_bytes += len(audio)
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "size_mb": round(self._total_bytes / (1024 * 1024), 2),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+# ============================================================================
+#   HTTP RANGE SUPPORT
+# ============================================================================
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Parse a single "bytes=start-end" range into inclusive (start, end).
+
+    Returns None when there is no (usable) range — the caller then serves the
+    whole clip. Raises ValueError for a range that lies outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_s == "":
+            # Suffix range: the last N bytes
+            length = int(end_s)
+            return (max(0, size - length), size - 1) if length > 0 else None
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+tts_cache = TTSCache()
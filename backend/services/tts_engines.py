@@ -0,0 +1,121 @@
+"""
+tts_engines.py — Speech synthesis backends behind tts_service.speak().
+
+edge-tts is a remote service: every clip is a round trip to Microsoft over
+the venue Wi-Fi, and with no network there is no voice at all. Backends now
+share one small interface so tts_service can pick one per VOICE_MAP entry
+and fall back to a local engine when the remote one is slow or down.
+
+  • EdgeEngine   — remote Neural voices (MP3), streamed as they arrive
+  • PiperEngine  — local Piper ONNX voices on the CPU (WAV), no network
+
+VOICE_MAP values select the engine: a plain edge-tts voice name, or
+"piper:<voice id>" for a local model at TTS_LOCAL_MODEL_DIR/<voice id>.onnx.
+"""
+
+import asyncio
+import io
+import os
+import threading
+import wave
+
+import edge_tts
+
+# --- CONFIGURATION (override via .env) ---
+TTS_LOCAL_MODEL_DIR = os.getenv(
+    "TTS_LOCAL_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tts_voices"),
+)
+
+LOCAL_PREFIX = "piper:"
+
+
+class TTSEngine:
+    """A speech backend. stream() yields encoded audio chunks for one clip."""
+
+    name = ""
+    media_type = "audio/mpeg"
+    extension = "mp3"
+    remote = False
+
+    def available(self, voice_id: str) -> bool:
+        return True
+
+    async def stream(self, cleaned_text: str, voice_id: str):
+        raise NotImplementedError
+
+
+class EdgeEngine(TTSEngine):
+
+    name = "edge"
+    remote = True
+
+    def __init__(self, rate: str, pitch: str):
+        self.rate = rate
+        self.pitch = pitch
+
+    async def stream(self, cleaned_text: str, voice_id: str):
+        communicate = edge_tts.Communicate(
+            cleaned_text,
+            voice_id,
+            rate=self.rate,
+            pitch=self.pitch,
+        )
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                yield chunk["data"]
+
+
+class PiperEngine(TTSEngine):
+    """Local Piper voices. Each request is usually one sentence (the frontend
+    and the voice pipeline speak sentence by sentence), so a clip is
+    synthesized whole in a worker thread and sent as one complete WAV."""
+
+    name = "piper"
+    media_type = "audio/wav"
+    extension = "wav"
+
+    def __init__(self, model_dir: str = TTS_LOCAL_MODEL_DIR):
+        self.model_dir = model_dir
+        self._voices = {}
+        self._lock = threading.Lock()
+        self._importable: bool | None = None
+
+    def _model_path(self, voice_id: str) -> str:
+        return os.path.join(self.model_dir, f"{voice_id}.onnx")
+
+    def available(self, voice_id: str) -> bool:
+        if not voice_id or not os.path.exists(self._model_path(voice_id)):
+            return False
+        if self._importable is None:
+            try:
+                import piper  # noqa: F401
+                self._importable = True
+            except ImportError:
+                self._importable = False
+        return self._importable
+
+    def _get_voice(self, voice_id: str):
+        voice = self._voices.get(voice_id)
+        if voice is None:
+            with self._lock:
+                voice = self._voices.get(voice_id)
+                if voice is None:
+                    from piper import PiperVoice
+                    voice = PiperVoice.load(self._model_path(voice_id))
+                    self._voices[voice_id] = voice
+                    print(f"✅ Piper voice loaded: {voice_id}")
+        return voice
+
+    def _synthesize_wav(self, cleaned_text: str, voice_id: str) -> bytes:
+        voice = self._get_voice(voice_id)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            if hasattr(voice, "synthesize_wav"):
+                voice.synthesize_wav(cleaned_text, wav_file)   # piper-tts >= 1.3
+            else:
+                voice.synthesize(cleaned_text, wav_file)       # piper-tts 1.2
+        return buffer.getvalue()
+
+    async def stream(self, cleaned_text: str, voice_id: str):
+        yield await asyncio.to_thread(self._synthesize_wav, cleaned_text, voice_id)
@@ -1,9 +1,16 @@
+import asyncio
+import os
 import re
-import edge_tts
+import time
 from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+
+from services.tts_cache import tts_cache, cache_key, parse_range
+from services.tts_engines import EdgeEngine, PiperEngine, LOCAL_PREFIX
 
 
 # --- Voice Presets (natural-sounding Neural voices) ---
+# Plain names are edge-tts voices; "piper:<id>" runs a local Piper model on the CPU.
 VOICE_MAP = {
     "ava":       "en-US-AvaMultilingualNeural",
     "andrew":    "en-US-AndrewMultilingualNeural",
@@ -11,12 +18,25 @@ VOICE_MAP = {
     "brian":     "en-US-BrianMultilingualNeural",
     "jenny":     "en-US-JennyNeural",
     "aria":      "en-US-AriaNeural",
+    "amy":       "piper:en_US-amy-medium",
 }
 
 DEFAULT_VOICE = "ava"
 RATE = "+5%"
 PITCH = "+0Hz"
 
+# Bytes buffered before the first flush — enough for the player to sniff the
+# MP3 frame header; after that every edge-tts chunk is forwarded as it arrives.
+TTS_FIRST_CHUNK_BYTES = int(os.getenv("TTS_FIRST_CHUNK_BYTES", "2048"))
+# Local voice used when edge-tts is slow or unreachable ("" disables fallback)
+TTS_FALLBACK_VOICE = os.getenv("TTS_FALLBACK_VOICE", "piper:en_US-amy-medium")
+# Max wait for edge-tts's first audio chunk before falling back to the local voice
+TTS_REMOTE_TIMEOUT_SEC = float(os.getenv("TTS_REMOTE_TIMEOUT_SEC", "3"))
+# After a remote failure, go straight to the local voice for this long
+TTS_REMOTE_RETRY_SEC = float(os.getenv("TTS_REMOTE_RETRY_SEC", "30"))
+# Browser cache lifetime for /api/speak audio (the URL carries text + voice)
+TTS_BROWSER_MAX_AGE_SEC = int(os.getenv("TTS_BROWSER_MAX_AGE_SEC", "86400"))
+
 
 def _clean_text_for_tts(text: str) -> str:
     """Sanitize text to prevent voice pitch/tone changes in edge-tts.
@@ -55,29 +75,224 @@ def _clean_text_for_tts(text: str) -> str:
     return cleaned
 
 
-async def speak(text: str, voice: str | None = None):
+_edge = EdgeEngine(RATE, PITCH)
+_local = PiperEngine()
+_remote_down_until = 0.0
+
+
+def _engine_for(voice_name: str):
+    if voice_name.startswith(LOCAL_PREFIX):
+        return _local, voice_name[len(LOCAL_PREFIX):]
+    return _edge, voice_name
+
+
+def _fallback_for(voice_name: str) -> str | None:
+    """The local voice to use instead of a remote one, if one is installed."""
+    engine, _ = _engine_for(voice_name)
+    if not engine.remote or not TTS_FALLBACK_VOICE:
+        return None
+    fallback_engine, fallback_id = _engine_for(TTS_FALLBACK_VOICE)
+    return TTS_FALLBACK_VOICE if fallback_engine.available(fallback_id) else None
+
+
+def resolve_voice(voice: str | None) -> str:
+    """Map a preset key (e.g. "ava") to the voice that will actually speak.
+
+    Unknown keys and local voices whose model is not installed get the
+    default voice; while edge-tts is known to be down, remote voices are
+    routed straight to the local fallback instead of waiting for a timeout.
+    """
+    voice_key = (voice or DEFAULT_VOICE).lower().strip()
+    voice_name = VOICE_MAP.get(voice_key, VOICE_MAP[DEFAULT_VOICE])
+    engine, voice_id = _engine_for(voice_name)
+    if not engine.available(voice_id):
+        voice_name = VOICE_MAP[DEFAULT_VOICE]
+    if time.monotonic() < _remote_down_until:
+        voice_name = _fallback_for(voice_name) or voice_name
+    return voice_name
+
+
+async def _first_flush(chunks, first_chunk_bytes: int = TTS_FIRST_CHUNK_BYTES):
+    """Coalesce only the start of the stream into one >= first_chunk_bytes piece
+    (growable bytearray, no repeated bytes concatenation); pass the rest through."""
+    buffer = bytearray()
+    async for data in chunks:
+        if buffer is None:
+            yield data
+            continue
+        buffer.extend(data)
+        if len(buffer) >= first_chunk_bytes:
+            yield bytes(buffer)
+            buffer = None
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _open_audio(cleaned_text: str, voice_name: str):
+    """Start synthesis and pull the first chunk, falling back to the local
+    engine when the remote one times out or fails before producing audio.
+
+    Returns (voice_name, engine, first_chunk, stream); first_chunk is None
+    when the engine produced no audio at all.
+    """
+    global _remote_down_until
+    engine, voice_id = _engine_for(voice_name)
+    stream = _first_flush(engine.stream(cleaned_text, voice_id))
+    try:
+        timeout = TTS_REMOTE_TIMEOUT_SEC if engine.remote else None
+        first = await asyncio.wait_for(anext(stream), timeout)
+        return voice_name, engine, first, stream
+    except StopAsyncIteration:
+        return voice_name, engine, None, stream
+    except Exception as e:
+        await stream.aclose()
+        fallback = _fallback_for(voice_name)
+        if fallback is None:
+            raise
+        _remote_down_until = time.monotonic() + TTS_REMOTE_RETRY_SEC
+        reason = "timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+        print(f"⚠️ edge-tts {reason} — falling back to local voice {fallback}")
+        return await _open_audio(cleaned_text, fallback)
+
+
+def _audio_key(cleaned_text: str, voice_name: str) -> str:
+    return cache_key(cleaned_text, voice_name, RATE, PITCH)
+
+
+async def _synthesize_voice(cleaned_text: str, voice_name: str) -> bytes:
+    key = _audio_key(cleaned_text, voice_name)
+    audio = await asyncio.to_thread(tts_cache.read, key)
+    if audio is not None:
+        return audio
+
+    voice_name, engine, first, stream = await _open_audio(cleaned_text, voice_name)
+    if first is None:
+        return b""
+    parts = [first] + [data async for data in stream]
+    audio = b"".join(parts)
+    await asyncio.to_thread(tts_cache.put, _audio_key(cleaned_text, voice_name), audio, engine.extension)
+    return audio
+
+
+async def synthesize(text: str, voice: str | None = None) -> bytes:
+    """Synthesize a short piece of text (e.g. one sentence) to complete audio bytes."""
+    cleaned_text = _clean_text_for_tts(text)
+    if not cleaned_text:
+        return b""
+    return await _synthesize_voice(cleaned_text, resolve_voice(voice))
+
+
+def _cache_headers(key: str) -> dict:
+    return {
+        "ETag": f'"{key}"',
+        "Cache-Control": f"public, max-age={TTS_BROWSER_MAX_AGE_SEC}",
+    }
+
+
+async def _cached_response(key: str, path: str, size: int, media_type: str,
+                           range_header: str | None, if_none_match: str | None):
+    """Serve a cached clip, honouring If-None-Match and single byte ranges."""
+    headers = {**_cache_headers(key), "Accept-Ranges": "bytes"}
+    if if_none_match and headers["ETag"] in if_none_match:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    def _read(start: int, length: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(length)
+
+    if byte_range is None:
+        data = await asyncio.to_thread(_read, 0, size)
+        return Response(content=data, media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    data = await asyncio.to_thread(_read, start, end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=data, status_code=206, media_type=media_type, headers=headers)
+
+
+async def speak(text: str, voice: str | None = None,
+                range_header: str | None = None, if_none_match: str | None = None):
+    """Serve speech from the on-disk cache, or stream it as the engine produces
+    it (and cache the finished clip for the next visitor).
+
+    Both paths carry the same ETag, derived from the cache key before any
+    synthesis, so a streamed clip can be revalidated like a cached one. Byte
+    ranges are only served from the cache: a streamed miss answers 200 with
+    Accept-Ranges: none.
+    """
+    # Always resolve voice consistently
+    voice_name = resolve_voice(voice)
+
+    # Clean the text to prevent voice tone changes
+    cleaned_text = _clean_text_for_tts(text)
+
+    if not cleaned_text:
+        # Nothing to say after cleaning
+        return Response(content=b"", media_type="audio/mpeg")
+
+    key = _audio_key(cleaned_text, voice_name)
+    hit = await asyncio.to_thread(tts_cache.get, key)
+    if hit is not None:
+        return await _cached_response(key, *hit, range_header, if_none_match)
+    # The key hashes text, voice and prosody: a client holding this ETag
+    # already has the clip, even if it has since left the disk cache
+    if if_none_match and f'"{key}"' in if_none_match:
+        return Response(status_code=304, headers=_cache_headers(key))
+
+    # Pull the first chunk before answering, so connection / voice errors
+    # still surface as a proper 500 instead of a truncated 200 stream.
     try:
-        # Always resolve voice consistently
-        voice_key = (voice or DEFAULT_VOICE).lower().strip()
-        voice_name = VOICE_MAP.get(voice_key, VOICE_MAP[DEFAULT_VOICE])
-
-        # Clean the text to prevent voice tone changes
-        cleaned_text = _clean_text_for_tts(text)
-
-        if not cleaned_text:
-            # Nothing to say after cleaning
-            return Response(content=b"", media_type="audio/mpeg")
-
-        communicate = edge_tts.Communicate(
-            cleaned_text,
-            voice_name,
-            rate=RATE,
-            pitch=PITCH,
-        )
-        audio_data = b""
-        async for chunk in communicate.stream():
-            if chunk["type"] == "audio":
-                audio_data += chunk["data"]
-        return Response(content=audio_data, media_type="audio/mpeg")
+        voice_name, engine, first, stream = await _open_audio(cleaned_text, voice_name)
     except Exception as e:
-        raise HTTPException(500, str(e))
+        raise HTTPException(500, str(e) or "TTS timed out")
+    if first is None:
+        return Response(content=b"", media_type=engine.media_type)
+    key = _audio_key(cleaned_text, voice_name)
+
+    async def body():
+        audio = bytearray(first)
+        yield first
+        try:
+            async for data in stream:
+                audio.extend(data)
+                yield data
+        except Exception as e:
+            print(f"❌ TTS stream error: {e}")
+            return
+        # Only complete clips are cached
+        await asyncio.to_thread(tts_cache.put, key, bytes(audio), engine.extension)
+
+    return StreamingResponse(body(), media_type=engine.media_type,
+                             headers={**_cache_headers(key), "Accept-Ranges": "none"})
+
+
+async def prewarm(phrases, voices=None, concurrency: int = 4) -> int:
+    """Synthesize phrases for every voice into the cache ahead of time.
+    Returns how many clips had to be synthesized."""
+    semaphore = asyncio.Semaphore(concurrency)
+    voice_names = {resolve_voice(v) for v in (voices or VOICE_MAP)}
+    synthesized = 0
+
+    async def _one(phrase: str, voice_name: str):
+        nonlocal synthesized
+        cleaned_text = _clean_text_for_tts(phrase)
+        if not cleaned_text or tts_cache.contains(_audio_key(cleaned_text, voice_name)):
+            return
+        async with semaphore:
+            await _synthesize_voice(cleaned_text, voice_name)
+            synthesized += 1
+
+    results = await asyncio.gather(
+        *(_one(p, v) for p in phrases for v in voice_names),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        raise RuntimeError(f"{len(errors)} clip(s) failed to synthesize: {errors[0]}")
+    return synthesized
@@ -0,0 +1,117 @@
+"""
+voice_pipeline.py — Sentence-level pipelined TTS driven by the chat stream.
+
+Without this, voice latency was LLM time + TTS time: the frontend waited for
+the whole answer and then called /api/speak. Here the answer text is split at
+sentence boundaries while it streams, and each finished sentence is sent to
+TTS right away, so sentence 1 is being synthesized while sentence 2 is still
+being generated. Voice starts after the first sentence, not the whole answer.
+
+Output is NDJSON, one frame per line, interleaving text and audio:
+
+    {"type": "text",  "data": "Lumira answers"}
+    {"type": "audio", "seq": 0, "text": "Lumira answers questions.", "data": "<base64 mp3 or wav>"}
+    {"type": "done"}
+
+Audio frames are always emitted in sentence order.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import re
+
+from services.tts_service import synthesize
+
+# Sentences synthesized concurrently per answer (bounded so a long answer
+# does not open a burst of edge-tts connections)
+VOICE_MAX_INFLIGHT = int(os.getenv("VOICE_MAX_INFLIGHT", "3"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_MIN_SENTENCE_CHARS = 12   # don't synthesize "e.g." style fragments on their own
+
+
+class SentenceSplitter:
+    """Accumulates streamed text and releases complete sentences."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        self._buffer += text
+        parts = _SENTENCE_END.split(self._buffer)
+        if len(parts) == 1:
+            return []
+        sentences, pending = [], ""
+        for part in parts[:-1]:
+            pending = f"{pending} {part}".strip()
+            if len(pending) >= _MIN_SENTENCE_CHARS:
+                sentences.append(pending)
+                pending = ""
+        self._buffer = f"{pending} {parts[-1]}".strip() if pending else parts[-1]
+        return sentences
+
+    def flush(self) -> str:
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest
+
+
+def _frame(**fields) -> str:
+    return json.dumps(fields) + "\n"
+
+
+async def chat_with_audio(text_stream, voice: str | None = None):
+    """Wrap an async text stream (ask_lumira_async) into interleaved text/audio frames."""
+    splitter = SentenceSplitter()
+    limit = asyncio.Semaphore(VOICE_MAX_INFLIGHT)
+    pending: list[tuple[int, str, asyncio.Task]] = []
+    seq = 0
+
+    async def _synth(sentence: str) -> bytes:
+        async with limit:
+            try:
+                return await synthesize(sentence, voice)
+            except Exception as e:
+                print(f"❌ Sentence TTS failed: {e}")
+                return b""
+
+    def _start(sentence: str):
+        nonlocal seq
+        pending.append((seq, sentence, asyncio.create_task(_synth(sentence))))
+        seq += 1
+
+    def _ready_frames():
+        """Audio frames for the finished head of the queue (keeps sentence order)."""
+        frames = []
+        while pending and pending[0][2].done():
+            n, sentence, task = pending.pop(0)
+            audio = task.result()
+            if audio:
+                frames.append(_frame(type="audio", seq=n, text=sentence,
+                                     data=base64.b64encode(audio).decode("ascii")))
+        return frames
+
+    try:
+        async for chunk in text_stream:
+            yield _frame(type="text", data=chunk)
+            # Error toasts are not part of the spoken answer
+            if not chunk.startswith("ERROR_NOTIFICATION:"):
+                for sentence in splitter.feed(chunk):
+                    _start(sentence)
+            for frame in _ready_frames():
+                yield frame
+
+        rest = splitter.flush()
+        if rest and not rest.startswith("ERROR_NOTIFICATION:"):
+            _start(rest)
+        while pending:
+            await pending[0][2]
+            for frame in _ready_frames():
+                yield frame
+        yield _frame(type="done")
+    finally:
+        for _, _, task in pending:
+            task.cancel()
+        # Release the answer stream (and its LLM slot) promptly on disconnect
+        await text_stream.aclose()
@@ -0,0 +1,184 @@
+"""
+warmup.py — Startup warm-up of the heavy components + readiness reporting.
+
+Nothing heavy is loaded at import time any more. The FastAPI lifespan handler
+starts warm_up_all() in the background: the embedding model, the Chroma
+client, Whisper, an Ollama preload and the TTS cache pre-warm run in parallel
+threads, and each one records its state and load time. /api/health/ready reports them so a load
+balancer only routes visitors to warmed instances.
+
+Required components gate readiness; optional ones (Whisper, TTS cache) only degrade a
+feature when they fail. A component with `after` waits for that component to
+be ready (overviews need the registry the vectorstore migration fills in).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Failed required components (e.g. Ollama not started yet) are retried this often
+WARMUP_RETRY_SEC = float(os.getenv("WARMUP_RETRY_SEC", "15"))
+
+
+class Component:
+
+    def __init__(self, name: str, loader, required: bool = True, after: str | None = None):
+        self.name = name
+        self.loader = loader
+        self.required = required
+        self.after = after
+        self.state = "cold"   # cold → loading → ready | failed
+        self.load_sec: float | None = None
+        self.error: str | None = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.state == "ready":
+                return
+            self.state = "loading"
+            self.error = None
+            started = time.perf_counter()
+            try:
+                self.loader()
+                self.state = "ready"
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                print(f"❌ Warm-up failed for {self.name}: {e}")
+            self.load_sec = round(time.perf_counter() - started, 2)
+        if self.state == "ready":
+            print(f"🔥 {self.name} warm in {self.load_sec}s")
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "required": self.required,
+            "load_sec": self.load_sec,
+            "error": self.error,
+        }
+
+
+# ============================================================================
+#   LOADERS
+# ============================================================================
+
+def _warm_embeddings():
+    from Utils.pdfvectorising import get_embeddings
+    # First embed_query pays ONNX session init — do it now, not on a visitor
+    get_embeddings().embed_query("warm up")
+
+
+def _warm_vectorstore():
+    from Utils.pdfvectorising import (
+        get_chroma_client, get_project_vectorstore, migrate_legacy_collection, registry,
+    )
+    get_chroma_client()
+    # A chroma_db from before per-project collections is split up before
+    # the server reports ready (no-op once done)
+    migrate_legacy_collection()
+    # One query per project loads its HNSW index into memory
+    for filename in registry.datasets():
+        get_project_vectorstore(filename).similarity_search("warm up", k=1)
+
+
+def _warm_reranker():
+    from services.retrieval_pipeline import RERANK_ENABLED, get_reranker
+    if RERANK_ENABLED and get_reranker() is None:
+        raise RuntimeError("Reranker could not be loaded")
+
+
+def _warm_overviews():
+    from services.project_overview import project_overviews
+    from Utils.pdfvectorising import get_project_vectorstore, registry
+    # Datasets ingested before overviews existed get one in the background
+    project_overviews.schedule_missing(registry.datasets(), get_project_vectorstore)
+
+
+def _warm_whisper():
+    from services.stt_service import load_profiles
+    # Both the fast and the accurate profile's model
+    if not load_profiles():
+        raise RuntimeError("Whisper model could not be loaded")
+
+
+def _warm_tts_cache():
+    from bot import SMALL_TALK_REPLIES, NO_CONTEXT_REPLY
+    from services.tts_service import prewarm
+    # Canned replies are what every visitor hears — have them on disk for every voice
+    phrases = [reply for replies in SMALL_TALK_REPLIES.values() for reply in replies]
+    phrases.append(NO_CONTEXT_REPLY)
+    synthesized = asyncio.run(prewarm(phrases))
+    print(f"🔊 TTS cache pre-warmed ({synthesized} new clips)")
+
+
+def _warm_ollama():
+    import ollama
+    from bot import model
+    # An empty prompt makes Ollama load the model into memory without generating
+    ollama.Client(host=model.base_url).generate(model=model.model, prompt="", keep_alive=model.keep_alive)
+
+
+components = OrderedDict(
+    (c.name, c) for c in [
+        Component("embeddings", _warm_embeddings),
+        Component("vectorstore", _warm_vectorstore),
+        Component("ollama", _warm_ollama),
+        Component("reranker", _warm_reranker, required=False),
+        # The registry is empty until migrate_legacy_collection() has run
+        Component("overviews", _warm_overviews, required=False, after="vectorstore"),
+        Component("whisper", _warm_whisper, required=False),
+        Component("tts_cache", _warm_tts_cache, required=False),
+    ]
+)
+
+_started_at: float | None = None
+_finished_at: float | None = None
+
+
+async def warm_up_all():
+    """Load every component in parallel worker threads, then keep retrying
+    failed required ones until the instance is ready."""
+    global _started_at, _finished_at
+    _started_at = time.perf_counter()
+    print("🔥 Warming up: " + ", ".join(components))
+    tasks = {}
+    for c in components.values():
+        tasks[c.name] = asyncio.create_task(_load(c, tasks))
+    await asyncio.gather(*tasks.values())
+    _finished_at = time.perf_counter()
+    print(f"🔥 Warm-up finished in {_finished_at - _started_at:.2f}s")
+
+    while not is_ready():
+        await asyncio.sleep(WARMUP_RETRY_SEC)
+        failed = [c for c in components.values() if c.required and c.state == "failed"]
+        await asyncio.gather(*(asyncio.to_thread(c.load) for c in failed))
+        # Components that were waiting on one that just recovered
+        unblocked = [c for c in components.values()
+                     if c.after and c.state == "cold" and components[c.after].state == "ready"]
+        await asyncio.gather(*(asyncio.to_thread(c.load) for c in unblocked))
+
+
+async def _load(component: Component, tasks: dict):
+    if component.after:
+        await tasks[component.after]
+        if components[component.after].state != "ready":
+            return   # stays cold until the retry loop sees its dependency ready
+    await asyncio.to_thread(component.load)
+
+
+def is_ready() -> bool:
+    return all(c.state == "ready" for c in components.values() if c.required)
+
+
+def readiness() -> dict:
+    total = None
+    if _started_at is not None and _finished_at is not None:
+        total = round(_finished_at - _started_at, 2)
+    return {
+        "ready": is_ready(),
+        "warmup_sec": total,
+        "components": {name: c.status() for name, c in components.items()},
+    }